@@ -0,0 +1,84 @@
+"""Compare.py compares two benchmark results files from `benchmarks.run`,
+reporting the change in every metric and failing on regressions, e.g.
+
+    $ python -m benchmarks.compare baseline.json results.json --threshold 0.2
+"""
+
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+import argparse
+import json
+import sys
+
+# Metrics where larger values are better, every other metric is a cost
+HIGHER_IS_BETTER = ("per_second",)
+# Counters describing the run rather than its performance
+IGNORED = ("n", "words", "hits", "misses", "hit_ratio", "quotes", "bytes", "maxsize")
+
+
+def flatten(results: Dict, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    """Yield (<dotted-metric-name>, <value>) pairs for every numeric metric"""
+    for name, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{name}.")
+        elif isinstance(value, (int, float)) and name not in IGNORED:
+            yield f"{prefix}{name}", value
+
+
+def scenarios(path: Path) -> Dict[Tuple[int, str], Dict[str, float]]:
+    report = json.loads(Path(path).read_text())
+    return {
+        (scenario["quotes"], scenario["backend"]): dict(flatten(scenario["results"]))
+        for scenario in report["scenarios"]
+    }
+
+
+def compare(
+    baseline: Path, results: Path, threshold: float
+) -> Tuple[List[str], List[str]]:
+    """Compare the scenarios run in both files.
+
+    Returns:
+        tuple of (<report lines>, <regressed metrics>)
+    """
+    old, new = scenarios(baseline), scenarios(results)
+    lines, regressions = [], []
+    for key in sorted(old.keys() & new.keys()):
+        lines.append(f"{key[0]} quotes on {key[1]}")
+        for metric in sorted(old[key].keys() & new[key].keys()):
+            before, after = old[key][metric], new[key][metric]
+            if not before:
+                continue
+            change = (after - before) / before
+            worse = -change if metric.endswith(HIGHER_IS_BETTER) else change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions.append(f"{key[0]}/{key[1]}/{metric}")
+            lines.append(
+                f"  {metric:<40} {before:>12.3f} {after:>12.3f} {change:>+8.1%}{flag}"
+            )
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("results", type=Path)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="fractional change counted as a regression",
+    )
+    args = parser.parse_args()
+
+    lines, regressions = compare(args.baseline, args.results, args.threshold)
+    print("\n".join(lines))
+    if regressions:
+        print(f"{len(regressions)} metrics regressed by over {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
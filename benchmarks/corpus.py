@@ -0,0 +1,94 @@
+"""Corpus.py generates synthetic quote corpora for benchmarks.
+
+Words are drawn from a Zipf distribution over a generated vocabulary, as in
+natural text a few words are very common and most are rare. The vocabulary
+grows with the corpus following Heaps' law. Generation is seeded, the same
+scale and seed always give the same corpus.
+"""
+
+from itertools import accumulate
+from pathlib import Path
+from random import Random
+from typing import Any, Iterator, List, Tuple
+
+from src.pack import PACK_KEY, encode_pack
+
+CONSONANTS = "bcdfghjklmnprstvwz"
+VOWELS = "aeiouy"
+ZIPF_EXPONENT = 1.07
+WORDS_PER_QUOTE = (5, 40)
+
+
+def vocabulary_size(n_quotes: int) -> int:
+    """Heaps' law estimate of the distinct words in a corpus of quotes"""
+    total_words = n_quotes * sum(WORDS_PER_QUOTE) // 2
+    return max(100, int(30 * total_words**0.55))
+
+
+class Corpus:
+    """Seeded generator of quotes and of words and typos to query them with"""
+
+    def __init__(self, n_quotes: int, seed: int = 0):
+        self.n_quotes = n_quotes
+        self.seed = seed
+        rng = Random(seed)
+        vocabulary = set()
+        size = vocabulary_size(n_quotes)
+        while len(vocabulary) < size:
+            syllables = rng.randint(1, 4)
+            vocabulary.add(
+                "".join(
+                    rng.choice(CONSONANTS) + rng.choice(VOWELS)
+                    for _ in range(syllables)
+                )
+            )
+        # Sorted first so the vocabulary does not depend on set ordering
+        self.vocabulary: List[str] = sorted(vocabulary)
+        rng.shuffle(self.vocabulary)
+        self.cum_weights = list(
+            accumulate(1 / rank**ZIPF_EXPONENT for rank in range(1, size + 1))
+        )
+
+    def words(self, rng: Random, k: int) -> List[str]:
+        return rng.choices(self.vocabulary, cum_weights=self.cum_weights, k=k)
+
+    def quotes(self) -> Iterator[Tuple[int, str]]:
+        """(<file-id>, <quote>) pairs, formatted like `src.handler.form_quote`"""
+        rng = Random(self.seed + 1)
+        for file_id in range(1, self.n_quotes + 1):
+            content = " ".join(self.words(rng, rng.randint(*WORDS_PER_QUOTE)))
+            source = " ".join(self.words(rng, 2)).title()
+            quote = f"'{content.capitalize()}.'\n{source}"
+            if rng.random() < 0.2:
+                quote = f"On {self.words(rng, 1)[0]}...\n{quote}"
+            yield file_id, quote
+
+    def queries(self, n_queries: int) -> List[str]:
+        """Words to query, as frequent in queries as in the corpus"""
+        return self.words(Random(self.seed + 2), n_queries)
+
+    def typos(self, n_queries: int) -> List[str]:
+        """Query words with one character substituted"""
+        rng = Random(self.seed + 3)
+        typos = []
+        for word in self.words(rng, n_queries):
+            pos = rng.randrange(len(word))
+            typos.append(word[:pos] + rng.choice(CONSONANTS + VOWELS) + word[pos + 1 :])
+        return typos
+
+    def write_local(self, path: Path, pack: bool = False):
+        """Write one file per quote, or a single packed corpus"""
+        Path(path).mkdir(parents=True, exist_ok=True)
+        if pack:
+            (Path(path) / PACK_KEY).write_bytes(encode_pack(self.quotes()))
+            return
+        for file_id, quote in self.quotes():
+            (Path(path) / f"{file_id}.txt").write_text(quote)
+
+    def write_s3(self, s3_res: Any, bucket: str, pack: bool = False):
+        """Upload one object per quote, or a single packed corpus"""
+        if pack:
+            s3_res.Object(bucket, PACK_KEY).put(Body=encode_pack(self.quotes()))
+            return
+        for file_id, quote in self.quotes():
+            s3_res.Object(bucket, f"{file_id}.txt").put(Body=quote)
@@ -0,0 +1,251 @@
+"""Run.py benchmarks the index build, index load and query paths against
+synthetic corpora, e.g.
+
+    $ python -m benchmarks.run --quotes 1000 10000 --backend local s3 \
+        --output results.json
+
+Each scale and backend runs in a fresh process, so peak RSS and the loading
+of the index when `src.api` is imported are measured for each on its own.
+The S3 backend runs against moto. Results are written as JSON and can be
+compared between runs with `benchmarks.compare`.
+"""
+
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.corpus import Corpus
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).parent.parent
+BUCKET = "quotes-benchmark"
+REGION = "eu-west-1"
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of unsorted values"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def latency_stats(latencies: List[float]) -> Dict[str, float]:
+    """Summarize latencies in seconds as milliseconds and throughput"""
+    total = sum(latencies)
+    return {
+        "n": len(latencies),
+        "mean_ms": total / len(latencies) * 1000,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "per_second": len(latencies) / total if total else float("inf"),
+    }
+
+
+def time_calls(func: Callable, args: List[Any]) -> Dict[str, float]:
+    """Time a call of `func` for each argument"""
+    latencies = []
+    for arg in args:
+        start = time.perf_counter()
+        func(arg)
+        latencies.append(time.perf_counter() - start)
+    return latency_stats(latencies)
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def build_index(handler_factory: Callable, processes: int) -> Dict[str, float]:
+    """Build and write an index as `src.local_index` does, timing each phase"""
+    from src.index import create_inverted_index_parallel, postings_from_positions
+    from src.terms import TermDictionary
+
+    handler = handler_factory()
+    n_quotes = len(handler.list_file_ids())
+    word_id_map = TermDictionary()
+    documents: Dict[int, Any] = {}
+
+    start = time.perf_counter()
+    positional_index = create_inverted_index_parallel(
+        handler_factory, word_id_map, processes, positional=True, documents=documents
+    )
+    inverted_index = postings_from_positions(positional_index)
+    built = time.perf_counter()
+    handler.write_snapshot(inverted_index, word_id_map, positional_index, documents)
+    written = time.perf_counter()
+    return {
+        "build_s": built - start,
+        "build_quotes_per_second": n_quotes / (built - start),
+        "write_snapshot_s": written - built,
+        "words": len(word_id_map),
+    }
+
+
+def run_scenario(args: argparse.Namespace) -> Dict[str, Any]:
+    """Benchmark one scale and backend in this process"""
+    corpus = Corpus(args.quotes[0], seed=args.seed)
+    results: Dict[str, Any] = {}
+
+    with tempfile.TemporaryDirectory() as quotes_dir:
+        start = time.perf_counter()
+        if args.backend[0] == "s3":
+            from moto import mock_s3
+
+            os.environ.update(
+                {
+                    "QUOTES_ENV": "aws",
+                    "QUOTES_INDEX_S3_BUCKET": BUCKET,
+                    "AWS_DEFAULT_REGION": REGION,
+                    "AWS_ACCESS_KEY_ID": "benchmark",
+                    "AWS_SECRET_ACCESS_KEY": "benchmark",
+                }
+            )
+            mock = mock_s3()
+            mock.start()
+            from src.handler import AWSHandler, create_s3_resource
+
+            s3_res = create_s3_resource()
+            s3_res.create_bucket(
+                Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": REGION}
+            )
+            corpus.write_s3(s3_res, BUCKET, pack=args.pack)
+            # moto state lives in this process, build without subprocesses
+            handler_factory: Callable = partial(AWSHandler, s3_res)
+            processes = 1
+        else:
+            from src.handler import LocalHandler
+
+            os.environ["QUOTES_LOCAL_PATH"] = quotes_dir
+            corpus.write_local(Path(quotes_dir), pack=args.pack)
+            handler_factory = partial(LocalHandler, Path(quotes_dir))
+            processes = args.processes
+        results["write_corpus_s"] = time.perf_counter() - start
+
+        results.update(build_index(handler_factory, processes))
+
+        # Importing the API loads the index, as on a cold start
+        os.environ["QUOTES_RELOAD_SECONDS"] = "0"
+        start = time.perf_counter()
+        import src.api as api
+
+        results["import_api_s"] = time.perf_counter() - start
+        results["get_indexes"] = time_calls(
+            lambda _: api.get_indexes(), range(args.load_repeat)
+        )
+
+        queries = corpus.queries(args.queries)
+        results["get_quotes"] = time_calls(api.get_quotes, queries)
+        results["get_quotes_ranked"] = time_calls(
+            lambda query: api.get_quotes(query, k=10, ranked=True), queries
+        )
+        results["get_quotes_typo"] = time_calls(
+            api.get_quotes, corpus.typos(args.queries)
+        )
+        loop = asyncio.new_event_loop()
+        results["get_random_quote"] = time_calls(
+            lambda _: loop.run_until_complete(api.get_pooled_random_quote()),
+            range(args.queries),
+        )
+        loop.close()
+        results["suggest"] = time_calls(
+            lambda query: api.suggest(query[:2], 10), queries
+        )
+        results["quote_cache"] = api.get_quote_cache().stats()
+
+        if args.backend[0] == "s3":
+            mock.stop()
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--quotes", type=int, nargs="+", default=[1000])
+    parser.add_argument(
+        "--backend", choices=["local", "s3"], nargs="+", default=["local"]
+    )
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--load-repeat", type=int, default=3)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pack", action="store_true", help="store a packed corpus")
+    parser.add_argument("--output", type=Path, default=Path("benchmark-results.json"))
+    parser.add_argument("--scenario", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(stream=sys.stderr, level=logging.WARNING)
+
+    if args.scenario:
+        args.output.write_text(json.dumps(run_scenario(args)))
+        return
+
+    scenarios = []
+    for n_quotes, backend in itertools.product(args.quotes, args.backend):
+        print(f"Benchmarking {n_quotes} quotes on {backend}", file=sys.stderr)
+        with tempfile.NamedTemporaryFile(suffix=".json") as scenario_output:
+            command = [
+                sys.executable,
+                "-m",
+                "benchmarks.run",
+                "--scenario",
+                f"--quotes={n_quotes}",
+                f"--backend={backend}",
+                f"--queries={args.queries}",
+                f"--load-repeat={args.load_repeat}",
+                f"--processes={args.processes}",
+                f"--seed={args.seed}",
+                f"--output={scenario_output.name}",
+            ] + (["--pack"] if args.pack else [])
+            subprocess.run(command, cwd=ROOT, check=True)
+            results = json.loads(Path(scenario_output.name).read_text())
+        scenarios.append({"quotes": n_quotes, "backend": backend, "results": results})
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "seed": args.seed,
+            "queries": args.queries,
+            "pack": args.pack,
+        },
+        "scenarios": scenarios,
+    }
+    args.output.write_text(json.dumps(report, indent=2))
+    print(f"Wrote results to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,13 @@ logger = logging.getLogger(__name__)
 def main():
     bucket = os.getenv("QUOTES_INDEX_S3_BUCKET")
     s3_client = boto3.client("s3")
+    pack_path = Path(__file__).parent.parent / "quotes" / "quotes.qpak"
+    if pack_path.exists():
+        # The packed corpus holds every quote, upload it as one object
+        s3_client.upload_file(pack_path.as_posix(), bucket, pack_path.name)
+        logger.info(f"Uploaded packed corpus {pack_path.name}")
+        return
+
     quotes_files = list((Path(__file__).parent.parent / "quotes").glob("*txt"))
     for ind, f in enumerate(quotes_files, start=1):
         _ = s3_client.upload_file(f.as_posix(), bucket, f.name)
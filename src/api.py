@@ -1,48 +1,440 @@
-from typing import List, Tuple, Dict
+from typing import Dict, List, NamedTuple, Optional, Sequence, Mapping, Tuple
 from pathlib import Path
-from random import choices, choice
+from random import randrange, sample
+from array import array
+from bisect import bisect_left
+import asyncio
 import logging
-import re
 import os
-from itertools import chain
+import time
 
 from pydantic import BaseModel
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response
 from fastapi.templating import Jinja2Templates
-from fastapi import FastAPI, Request, Form, HTTPException
-from cachetools import TTLCache, cached
-import boto3
-
-from src.handler import LocalHandler, AWSHandler, Handler
-
-
-@cached(cache=TTLCache(maxsize=5000, ttl=3 * 60 * 60))
+from fastapi import FastAPI, Request, Form, Header, HTTPException, Query
+from cachetools import cached
+
+from src.async_handler import AsyncHandler
+from src.bloom import BloomFilter
+from src.handler import LocalHandler, AWSHandler, Handler, create_s3_resource
+from src.documents import FIELDS, Document, DocumentStore, contains_phrase, parse_quote
+from src.incremental import (
+    empty_delta,
+    load_optional_documents,
+    load_optional_filter,
+    load_optional_index,
+)
+from src.index import document_lengths
+from src.ingest import DEFAULT_BATCH_SIZE, ingest
+from src.fuzzy import FuzzyMatcher, correct_query
+from src.metrics import REGISTRY, CountedTTLCache, Counter, Gauge, Histogram
+from src.profiler import SamplingProfiler
+from src.query import Node, QueryError, evaluate, parse_query
+from src.postings import CompactPostings, merge_postings
+from src.ranking import Rankable, lookup_frequencies, rank_matches
+from src.quote_cache import QuoteCache
+from src.reload import Reloader
+from src.response_cache import (
+    RandomPool,
+    Rendered,
+    ResponseCache,
+    etag_matches,
+    make_etag,
+)
+from src.shards import TERMS_PREFIX, ShardedIndex
+from src.suggest import Suggester
+from src.tokenizer import normalize, tokenize
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Duration of HTTP requests by method, route and status",
+)
+TEMPLATE_SECONDS = Histogram(
+    "template_render_seconds", "Duration of rendering templates by template"
+)
+QUERY_PHASE_SECONDS = Histogram(
+    "query_phase_seconds",
+    "Duration of each phase of answering a query: match, correct, rank, load",
+)
+INDEX_LOAD_SECONDS = Histogram(
+    "index_load_seconds",
+    "Duration of loading an index snapshot",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+VOCABULARY_REJECTS = Counter(
+    "vocabulary_filter_rejects",
+    "Words rejected by the vocabulary filter without a term dictionary lookup",
+)
+
+
+@cached(cache=CountedTTLCache("get_handler", maxsize=5000, ttl=3 * 60 * 60))
 def get_handler() -> Handler:
     """Load the local or AWS handler, caching for 3 hours.
     Default to loading local handler if environment variable
-    is not defined.
+    is not defined. Local quotes are read from QUOTES_LOCAL_PATH,
+    defaulting to `quotes`.
     """
     if os.getenv("QUOTES_ENV") == "aws":
-        s3 = boto3.resource("s3")
+        s3 = create_s3_resource()
         handler = AWSHandler(s3)
     else:
-        local_path = Path("quotes")
+        local_path = Path(os.getenv("QUOTES_LOCAL_PATH", "quotes"))
         handler = LocalHandler(local_path)
     return handler
 
 
-@cached(cache=TTLCache(maxsize=5000, ttl=3 * 60 * 60))
-def get_indexes() -> Tuple[Dict, Dict]:
-    """Load the inverted index and word ID map, caching for 3 hours"""
+@cached(cache={})
+def get_quote_cache() -> QuoteCache:
+    """Create the quote cache in front of the handler, sized in bytes by
+    QUOTES_CACHE_BYTES. Every quote is fetched up front if QUOTES_PRELOAD is set.
+    """
+    maxsize = int(os.getenv("QUOTES_CACHE_BYTES", 32 * 1024 * 1024))
+    quote_cache = QuoteCache(get_handler(), maxsize=maxsize)
+    if os.getenv("QUOTES_PRELOAD"):
+        quote_cache.preload()
+    return quote_cache
+
+
+@cached(cache={})
+def get_async_handler() -> AsyncHandler:
+    """Async interface to the handler behind the quote cache, for endpoints
+    which must not block the event loop on storage. Its thread pool is sized
+    by QUOTES_FETCH_WORKERS.
+    """
+    return AsyncHandler(get_quote_cache().handler)
+
+
+def load_quote(file_id: int) -> str:
+    """Load a quote by file ID through the quote cache"""
+    return get_quote_cache().get(file_id)
+
+
+async def load_quote_async(file_id: int) -> str:
+    """Load a quote by file ID through the quote cache, awaiting the handler
+    in its thread pool on a miss
+    """
+    quote_cache = get_quote_cache()
+    quote = quote_cache.lookup(file_id)
+    if quote is None:
+        quote = await get_async_handler().run(quote_cache.load, file_id)
+    return quote
+
+
+def quote_cache_stat(name: str):
+    """Read a statistic of the quote cache for a gauge, as 0 until the cache
+    is created, so a scrape never creates it and preloads every quote
+    """
+
+    def stat() -> float:
+        quote_cache = next(iter(get_quote_cache.cache.values()), None)
+        return quote_cache.stats()[name] if quote_cache is not None else 0
+
+    return stat
+
+
+for _stat, _documentation in (
+    ("hits", "Quotes served from the quote cache"),
+    ("misses", "Quotes loaded through the handler on a quote cache miss"),
+    ("hit_ratio", "Fraction of quote lookups served from the quote cache"),
+    ("bytes", "Size of the quotes held in the quote cache"),
+):
+    Gauge(f"quote_cache_{_stat}", _documentation, quote_cache_stat(_stat))
+
+
+class IndexSnapshot(NamedTuple):
+    inverted_index: Mapping
+    word_id_map: Mapping
+    positional_index: Mapping
+    # Sorted distinct IDs of every indexed quote
+    file_ids: Sequence[int]
+    # Number of words in each quote, aligned with `file_ids`
+    lengths: Sequence[int]
+    total_length: int
+    suggester: Suggester
+    # Typo tolerant lookup over the same term dictionary as `suggester`
+    fuzzy: FuzzyMatcher
+    # Structured quotes, None for snapshots built without them
+    documents: Optional[DocumentStore]
+    # Bloom filter over `word_id_map`, None where lookups are cheap already
+    vocabulary: Optional[BloomFilter] = None
+
+
+def create_snapshot(
+    inverted_index: Mapping,
+    word_id_map: Mapping,
+    positional_index: Mapping,
+    lengths: Optional[Mapping] = None,
+    suggester: Optional[Suggester] = None,
+    documents: Optional[DocumentStore] = None,
+    vocabulary: Optional[BloomFilter] = None,
+    fuzzy: Optional[FuzzyMatcher] = None,
+) -> IndexSnapshot:
+    """Create a snapshot with the IDs and lengths of every quote held in
+    compact arrays. Lengths are counted from the inverted index if they were
+    not written with it.
+
+    A JSON loaded inverted index, which repeats a file ID once per
+    occurrence, is compacted into `CompactPostings`. Memory-mapped binary
+    indexes are kept as they are.
+    """
+    if lengths is None:
+        lengths = document_lengths(inverted_index)
+    if isinstance(inverted_index, dict):
+        inverted_index = CompactPostings.from_occurrences(inverted_index)
+    if suggester is None:
+        suggester = Suggester.from_index(inverted_index, word_id_map)
+    if fuzzy is None:
+        # Builds its deletion index on the first typo, not on load
+        fuzzy = FuzzyMatcher(suggester.terms, suggester.frequencies)
+    # JSON loaded lengths have stringified file IDs
+    lengths = sorted((int(file_id), length) for file_id, length in lengths.items())
+    return IndexSnapshot(
+        inverted_index,
+        word_id_map,
+        positional_index,
+        array("Q", (file_id for file_id, _ in lengths)),
+        array("Q", (length for _, length in lengths)),
+        sum(length for _, length in lengths),
+        suggester,
+        fuzzy,
+        documents,
+        vocabulary,
+    )
+
+
+@INDEX_LOAD_SECONDS.time()
+def get_indexes(manifest: Optional[Dict] = None) -> IndexSnapshot:
+    """Load the inverted index, word ID map and positional index of the
+    snapshot a manifest describes, the latest if none is given. Prefer the
+    memory-mapped binary index, falling back to JSON if no binary index has
+    been written. Sharded indexes map only their terms index here, shards
+    are mapped when a query first needs them, see `src.shards`.
+
+    Memory-mapped indexes come with the vocabulary filter, which rejects
+    most words that are not indexed before their term dictionary is searched,
+    and with typo tolerant lookup, whose deletion index is built in the
+    background from here on.
+    """
     handler = get_handler()
-    inverted_index = handler.load_index("index")
-    word_id_map = handler.load_index("word-ids")
-    return inverted_index, word_id_map
+    if manifest is None:
+        manifest = handler.load_manifest()
+    lengths = load_optional_index(handler, "doc-lengths", manifest)
+    documents = load_optional_documents(handler, manifest)
+    n_shards = manifest.get("shards")
+    terms_name = manifest.get(TERMS_PREFIX) if n_shards else None
+    terms = handler.open_binary_index(terms_name) if terms_name else None
+    if terms is not None:
+        # Shards are loaded later, from this manifest rather than the latest
+        sharded_index = ShardedIndex(terms, n_shards, handler.shard_loader(manifest))
+        fuzzy = FuzzyMatcher.from_binary_index(terms)
+        fuzzy.warm()
+        return create_snapshot(
+            sharded_index.postings_map(),
+            terms.word_id_map(),
+            sharded_index.positions_map(),
+            lengths,
+            Suggester.from_binary_index(terms),
+            documents,
+            load_optional_filter(handler, manifest),
+            fuzzy,
+        )
+
+    binary_index = handler.load_binary_index("binary-index", manifest)
+    if binary_index is not None:
+        fuzzy = FuzzyMatcher.from_binary_index(binary_index)
+        fuzzy.warm()
+        return create_snapshot(
+            binary_index.postings_map(),
+            binary_index.word_id_map(),
+            binary_index.positions_map(),
+            lengths,
+            Suggester.from_binary_index(binary_index),
+            documents,
+            load_optional_filter(handler, manifest),
+            fuzzy,
+        )
+
+    inverted_index = handler.load_index("index", manifest)
+    word_id_map = handler.load_index("word-ids", manifest)
+    positional_index = load_optional_index(handler, "positions", manifest) or {}
+    return create_snapshot(
+        inverted_index, word_id_map, positional_index, lengths, documents=documents
+    )
+
+
+@cached(cache=CountedTTLCache("get_delta", maxsize=1, ttl=60))
+def get_delta() -> Dict:
+    """Load the delta segment of recently added quotes, caching for a minute
+    so added quotes become searchable without a rebuild
+    """
+    return get_handler().load_delta() or empty_delta()
+
+
+def load_index_manifest() -> Dict:
+    """Manifest of the latest index snapshot, empty if it was written without"""
+    return get_handler().load_manifest()
 
 
-INVERTED_INDEX, WORD_ID_MAP = get_indexes()
+def get_index_version(manifest: Dict) -> Optional[str]:
+    """Version of the index snapshot a manifest describes. Snapshots written
+    without a manifest are versioned by the timestamped name of their latest
+    JSON index, read after the manifest and before the snapshot is loaded, so
+    a snapshot is never labelled with a newer version than its own
+    """
+    return manifest.get("version") or get_handler().latest_name("index")
+
+
+# Swapped for a new snapshot in the background when the manifest changes
+INDEX_RELOADER = Reloader(get_indexes, load_index_manifest, get_index_version)
+RELOAD_SECONDS = float(os.getenv("QUOTES_RELOAD_SECONDS", 5 * 60))
+# Stacks of every thread are sampled this often while the API runs, if set
+PROFILE_INTERVAL = float(os.getenv("QUOTES_PROFILE_INTERVAL", 0))
+PROFILER = SamplingProfiler(PROFILE_INTERVAL or 0.01)
+
+# Parsed quotes and rendered quote pages of the current index version
+RESPONSE_CACHE = ResponseCache(
+    maxsize=int(os.getenv("QUOTES_RESPONSE_CACHE_SIZE", 4096)),
+    ttl=float(os.getenv("QUOTES_RESPONSE_CACHE_SECONDS", 60 * 60)),
+)
+# Parsed quotes error pages pick from, so misses do not reach storage
+RANDOM_QUOTES = RandomPool(
+    int(os.getenv("QUOTES_RANDOM_POOL_SIZE", 32)),
+    int(os.getenv("QUOTES_RANDOM_POOL_REFRESH", 4)),
+)
+# Quotes never change once written, pages may be cached downstream this long
+QUOTE_MAX_AGE = int(os.getenv("QUOTES_MAX_AGE", 60 * 60))
+# Largest page of /api/search, each quote of a page is loaded from storage
+MAX_SEARCH_LIMIT = int(os.getenv("QUOTES_MAX_SEARCH_LIMIT", 100))
+# Most completions /suggest returns
+MAX_SUGGEST_LIMIT = int(os.getenv("QUOTES_MAX_SUGGEST_LIMIT", 50))
+
+
+class IndexSearcher(Rankable):
+    """Evaluate and rank queries against the main index merged with the delta
+    segment
+    """
+
+    def __init__(self, snapshot: IndexSnapshot, delta: Dict):
+        self.snapshot = snapshot
+        self.inverted_index = snapshot.inverted_index
+        self.word_id_map = snapshot.word_id_map
+        self.positional_index = snapshot.positional_index
+        self.file_ids = snapshot.file_ids
+        self.delta = delta
+        self._delta_lengths: Optional[Dict[int, int]] = None
+
+    def word_id(self, word: str) -> Optional[int]:
+        """Word ID of a word in the main index, None if it is not indexed.
+        Consults the vocabulary filter first, if the snapshot has one.
+        """
+        vocabulary = self.snapshot.vocabulary
+        if vocabulary is not None and word not in vocabulary:
+            VOCABULARY_REJECTS.inc()
+            return None
+        return self.word_id_map.get(word)
+
+    def entry(self, word: str) -> Tuple[Sequence[int], Sequence[int]]:
+        """Distinct sorted file IDs in the main index containing a word, and
+        the occurrences in each
+        """
+        word_id = self.word_id(word)
+        if word_id is None:
+            return (), ()
+        try:
+            return self.inverted_index.entry(word_id)
+        except KeyError:
+            return (), ()
+
+    def postings(self, word: str) -> List[int]:
+        file_ids, _ = self.entry(word)
+        added = self.delta["postings"].get(word)
+        return merge_postings(file_ids, added) if added else list(file_ids)
+
+    def term_frequencies(self, word: str, file_ids: Sequence[int]) -> List[int]:
+        frequencies = lookup_frequencies(*self.entry(word), file_ids)
+        delta_positions = self.delta["positions"].get(word)
+        if delta_positions:
+            for pos, file_id in enumerate(file_ids):
+                frequencies[pos] += len(delta_positions.get(str(file_id), ()))
+        return frequencies
+
+    @property
+    def delta_lengths(self) -> Dict[int, int]:
+        if self._delta_lengths is None:
+            self._delta_lengths = {}
+            for file_positions in self.delta["positions"].values():
+                for file_id, positions in file_positions.items():
+                    file_id = int(file_id)
+                    self._delta_lengths[file_id] = self._delta_lengths.get(
+                        file_id, 0
+                    ) + len(positions)
+        return self._delta_lengths
+
+    def document_length(self, file_id: int) -> int:
+        if file_id in self.delta_lengths:
+            return self.delta_lengths[file_id]
+        pos = bisect_left(self.file_ids, file_id)
+        if pos < len(self.file_ids) and self.file_ids[pos] == file_id:
+            return self.snapshot.lengths[pos]
+        return 0
+
+    def document_count(self) -> int:
+        return len(self.file_ids) + len(self.delta_lengths)
+
+    def average_document_length(self) -> float:
+        total_length = self.snapshot.total_length + sum(self.delta_lengths.values())
+        return total_length / max(self.document_count(), 1)
+
+    def positions(self, word: str) -> Dict[int, List[int]]:
+        word_id = self.word_id(word)
+        file_positions = {}
+        if word_id is not None:
+            file_positions.update(self.positional_index.get(str(word_id), {}))
+        for file_id, positions in self.delta["positions"].get(word, {}).items():
+            file_positions[int(file_id)] = positions
+        # JSON loaded positions have stringified file IDs
+        return {int(file_id): pos for file_id, pos in file_positions.items()}
+
+    def all_file_ids(self) -> List[int]:
+        return merge_postings(self.file_ids, self.delta["file_ids"])
+
+    def field_postings(self, field: str, words: List[str]) -> List[int]:
+        if self.snapshot.documents is None:
+            raise QueryError("The index was built without fields to search")
+        field_ind = FIELDS.index(field)
+        added = sorted(
+            int(file_id)
+            for file_id, document in self.delta.get("documents", {}).items()
+            if contains_phrase(tokenize(document[field_ind]), words)
+        )
+        return merge_postings(
+            self.snapshot.documents.field_postings(field, words), added
+        )
+
+    def document(self, file_id: int) -> Optional[Document]:
+        """Structured quote of a file ID, None for quotes indexed without one"""
+        if self.snapshot.documents is not None:
+            document = self.snapshot.documents.get(file_id)
+            if document is not None:
+                return document
+        added = self.delta.get("documents", {}).get(str(file_id))
+        return None if added is None else Document(*added)
+
+
+class Matches(NamedTuple):
+    file_ids: List[int]
+    # Query which was evaluated, with any corrections applied
+    query: Node
+    # Misspelt words of the query mapped to the indexed words used instead
+    corrections: Dict[str, str]
+
+
+def get_searcher() -> IndexSearcher:
+    # Read the current snapshot once so a query sees a single consistent index
+    return IndexSearcher(INDEX_RELOADER.current, get_delta())
+
 
 app = FastAPI()
 
@@ -51,44 +443,335 @@ app.mount("/static", StaticFiles(directory="src/static"), name="static")
 templates = Jinja2Templates(directory="src/templates")
 
 
+def render_template(name: str, context: Dict) -> HTMLResponse:
+    """Render a template, timing how long rendering takes"""
+    with TEMPLATE_SECONDS.time(template=name):
+        return templates.TemplateResponse(name, context)
+
+
+def render_string(name: str, context: Dict) -> str:
+    """Render a template to a string which can be cached, see `render_template`"""
+    with TEMPLATE_SECONDS.time(template=name):
+        return templates.get_template(name).render(context)
+
+
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Route templates rather than paths, to keep the label values few
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status,
+        )
+
+
+@app.on_event("startup")
+def start_index_reloader():
+    if RELOAD_SECONDS > 0:
+        INDEX_RELOADER.start(RELOAD_SECONDS)
+
+
+@app.on_event("startup")
+def start_profiler():
+    if PROFILE_INTERVAL > 0:
+        PROFILER.start()
+
+
+@app.on_event("shutdown")
+def stop_index_reloader():
+    INDEX_RELOADER.stop()
+    PROFILER.stop()
+    for async_handler in get_async_handler.cache.values():
+        async_handler.close()
+
+
 class Quote(BaseModel):
     lead_in: str = ""
     content: str
     source: str = "Anonymous"
 
 
+class RankedQuote(Quote):
+    # Relevance to the query, None for randomly picked quotes
+    score: Optional[float] = None
+
+
 @app.get("/", response_class=HTMLResponse)
 async def serve_home(request: Request):
-    return templates.TemplateResponse("home.html", {"request": request})
+    return render_template("home.html", {"request": request})
 
 
 @app.post("/", response_class=HTMLResponse)
 async def search_word(request: Request, word: str = Form(...)):
-    quotes = get_quotes(word)
-    if not quotes:
-        raise HTTPException(status_code=404, detail=f"No quote with word '{word}'")
-    single_quote = choice(quotes)
-    quote = split_quote(single_quote)
-    return templates.TemplateResponse(
-        "quote.html",
-        {
-            "request": request,
-            "lead_in": quote.lead_in,
-            "content": quote.content,
-            "source": quote.source,
-        },
+    file_ids, corrections = await get_async_handler().run(match_quotes, word)
+    rendered = (
+        await render_quote(request, file_ids[0], corrections) if file_ids else None
+    )
+    if rendered is None:
+        raise HTTPException(status_code=404, detail=f"No quote matching '{word}'")
+    # The quote is picked at random, only the page itself can be revalidated
+    return HTMLResponse(rendered.body, headers={"ETag": rendered.etag})
+
+
+@app.get("/quote/{file_id}", response_class=HTMLResponse)
+async def serve_quote(
+    request: Request, file_id: int, if_none_match: str = Header(default="")
+):
+    """Permanent page of a single quote, which clients and CDNs may cache
+    for QUOTES_MAX_AGE seconds and then revalidate with its ETag
+    """
+    rendered = await render_quote(request, file_id)
+    if rendered is None:
+        raise HTTPException(status_code=404, detail=f"No quote {file_id}")
+    headers = {
+        "ETag": rendered.etag,
+        "Cache-Control": f"public, max-age={QUOTE_MAX_AGE}",
+    }
+    if if_none_match and etag_matches(if_none_match, rendered.etag):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(rendered.body, headers=headers)
+
+
+async def get_parsed_quote(file_id: int) -> Optional[Quote]:
+    """Get a quote from the structured documents built with the index,
+    through the response cache. Only quotes indexed without a document are
+    loaded and parsed. None if there is no quote with this file ID.
+    """
+    version = INDEX_RELOADER.version
+    quote = RESPONSE_CACHE.get(version, ("quote", file_id))
+    if quote is None:
+        # The delta may be reloaded from storage
+        document = await get_async_handler().run(load_document, file_id)
+        if document is None:
+            return None
+        quote = Quote(**document._asdict())
+        RESPONSE_CACHE.put(version, ("quote", file_id), quote)
+    return quote
+
+
+def load_document(file_id: int) -> Optional[Document]:
+    """Structured quote of a file ID, only loading and parsing the quote if
+    it was indexed without one. None if there is no quote with this file ID.
+    """
+    document = get_searcher().document(file_id)
+    if document is None:
+        quote_str = load_quote(file_id)
+        if not quote_str:
+            return None
+        document = parse_quote(quote_str)
+    return document
+
+
+async def render_quote(
+    request: Request, file_id: int, corrections: Optional[Dict[str, str]] = None
+) -> Optional[Rendered]:
+    """Render the page of a quote through the response cache, None if there
+    is no quote with this file ID
+    """
+    corrections = corrections or {}
+    version = INDEX_RELOADER.version
+    # Links to static files are absolute, so pages differ by base URL
+    key = ("quote.html", str(request.base_url), file_id, tuple(corrections.items()))
+    rendered = RESPONSE_CACHE.get(version, key)
+    if rendered is None:
+        quote = await get_parsed_quote(file_id)
+        if quote is None:
+            return None
+        body = render_string(
+            "quote.html",
+            {
+                "request": request,
+                "lead_in": quote.lead_in,
+                "content": quote.content,
+                "source": quote.source,
+                "corrections": corrections,
+            },
+        )
+        rendered = Rendered(body, make_etag(body))
+        RESPONSE_CACHE.put(version, key, rendered)
+    return rendered
+
+
+@app.get("/api/search")
+async def search_quotes(
+    q: str,
+    limit: int = Query(10, ge=0, le=MAX_SEARCH_LIMIT),
+    offset: int = Query(0, ge=0),
+    order: str = "rank",
+):
+    """Search with a boolean/phrase query, returning the number of matches
+    and a page of at most MAX_SEARCH_LIMIT of the matching quotes. Quotes are
+    ranked by relevance, or with `order=random` are a random sample of the
+    matches, which cannot be paged with `offset`.
+    """
+    if order not in ("rank", "random"):
+        return JSONResponse(status_code=400, content={"detail": "Invalid parameters"})
+    if order == "random" and offset:
+        return JSONResponse(
+            status_code=400, content={"detail": "Random order does not take an offset"}
+        )
+    try:
+        matches, page = await get_async_handler().run(
+            search_page, q, limit, offset, order
+        )
+    except QueryError as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+
+    with QUERY_PHASE_SECONDS.time(phase="load"):
+        loaded = await asyncio.gather(
+            *(get_parsed_quote(file_id) for file_id, _ in page)
+        )
+    quotes = []
+    for quote, (_, score) in zip(loaded, page):
+        if quote is None:
+            continue
+        quotes.append(
+            RankedQuote(
+                lead_in=quote.lead_in,
+                content=quote.content,
+                source=quote.source,
+                score=score,
+            )
+        )
+    return {
+        "query": q,
+        "corrections": matches.corrections,
+        "total": len(matches.file_ids),
+        "offset": offset,
+        "quotes": quotes,
+    }
+
+
+def search_page(
+    q: str, limit: int, offset: int, order: str
+) -> Tuple[Matches, List[Tuple[int, Optional[float]]]]:
+    """Evaluate a query and pick a page of its matches, see `search_quotes`
+
+    Returns:
+        tuple of (<matches>, <file IDs and scores of the page of matches>)
+
+    Raises:
+        QueryError: if the query cannot be parsed
+    """
+    searcher = get_searcher()
+    matches = find_matches(q, searcher)
+    if order == "random":
+        file_ids = sample(matches.file_ids, min(limit, len(matches.file_ids)))
+        return matches, [(file_id, None) for file_id in file_ids]
+    with QUERY_PHASE_SECONDS.time(phase="rank"):
+        page = rank_matches(
+            matches.query, matches.file_ids, searcher, k=limit, offset=offset
+        )
+    return matches, page
+
+
+@app.get("/suggest")
+def suggest(q: str, limit: int = Query(10, ge=1, le=MAX_SUGGEST_LIMIT)):
+    """Complete the last word of a query to indexed words, most common first,
+    at most MAX_SUGGEST_LIMIT of them
+    """
+    words = normalize(q).split()
+    if not words or q[-1:].isspace():
+        return {"query": q, "suggestions": []}
+    prefix = words[-1]
+
+    counts = dict(INDEX_RELOADER.current.suggester.suggest(prefix, limit))
+    # Recently added quotes are few, scanning their words is cheap
+    for word, file_ids in get_delta()["postings"].items():
+        if word.startswith(prefix):
+            counts[word] = counts.get(word, 0) + len(file_ids)
+    suggestions = sorted(counts.items(), key=lambda pair: (-pair[1], pair[0]))[:limit]
+    return {
+        "query": q,
+        "suggestions": [{"word": word, "count": count} for word, count in suggestions],
+    }
+
+
+@app.get("/metrics")
+def serve_metrics():
+    """Metrics in the Prometheus text format"""
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
     )
 
 
+def is_admin(x_admin_token: str) -> bool:
+    """Whether an admin token was sent, requires the QUOTES_ADMIN_TOKEN
+    environment variable to be set
+    """
+    admin_token = os.getenv("QUOTES_ADMIN_TOKEN")
+    return bool(admin_token) and x_admin_token == admin_token
+
+
+@app.get("/admin/profile")
+def serve_profile(reset: bool = False, x_admin_token: str = Header(default="")):
+    """Stacks sampled by the profiler in the folded format read by flamegraph
+    tools, optionally clearing them. Requires QUOTES_PROFILE_INTERVAL to be set
+    and the X-Admin-Token header, see `reload_index`.
+    """
+    if not is_admin(x_admin_token):
+        return JSONResponse(status_code=403, content={"detail": "Forbidden"})
+    if not PROFILER.running:
+        return JSONResponse(status_code=404, content={"detail": "Profiler not running"})
+
+    folded = PROFILER.folded()
+    if reset:
+        PROFILER.reset()
+    return PlainTextResponse(folded)
+
+
+@app.post("/admin/reload")
+def reload_index(x_admin_token: str = Header(default="")):
+    """Force a reload of the latest index snapshot. Requires the
+    QUOTES_ADMIN_TOKEN environment variable to be set and sent as the
+    X-Admin-Token header.
+    """
+    if not is_admin(x_admin_token):
+        return JSONResponse(status_code=403, content={"detail": "Forbidden"})
+
+    INDEX_RELOADER.refresh(force=True)
+    # Compaction prunes the delta alongside writing a new snapshot
+    get_delta.cache_clear()
+    return {"version": INDEX_RELOADER.version}
+
+
+@app.post("/admin/quotes")
+def add_quotes_bulk(quotes: List[Quote], x_admin_token: str = Header(default="")):
+    """Store a batch of quotes, indexed into the delta segment once per
+    DEFAULT_BATCH_SIZE quotes. Requires the admin token, as `reload_index`.
+    """
+    if not is_admin(x_admin_token):
+        return JSONResponse(status_code=403, content={"detail": "Forbidden"})
+
+    # Rejected up front, rather than after earlier batches were stored
+    if not all(quote.content for quote in quotes):
+        return JSONResponse(status_code=400, content={"detail": "No quote provided"})
+    file_ids = ingest(
+        get_handler(), (quote.dict() for quote in quotes), DEFAULT_BATCH_SIZE
+    )
+    get_delta.cache_clear()
+    return {"file_ids": file_ids}
+
+
 @app.exception_handler(StarletteHTTPException)
 async def custom_http_exception_handler(request: Request, exc: StarletteHTTPException):
     """Handle exceptions by returning a 404 page.
 
-    By default FastAPI returns a simple dictionary
+    By default FastAPI returns a simple dictionary. The random quote shown
+    comes from a pool kept per index version once it has filled, so a flood
+    of misses only loads a quote from storage to rotate the pool.
     """
-    quote_str = get_random_quote()
-    quote = split_quote(quote_str)
-    return templates.TemplateResponse(
+    quote = await get_pooled_random_quote()
+    return render_template(
         "404.html",
         {
             "request": request,
@@ -101,7 +784,7 @@ async def custom_http_exception_handler(request: Request, exc: StarletteHTTPExce
 
 @app.get("/add", response_class=HTMLResponse)
 async def add_quote(request: Request):
-    return templates.TemplateResponse("add_quote.html", {"request": request})
+    return render_template("add_quote.html", {"request": request})
 
 
 @app.post("/add", response_model=Quote)
@@ -112,7 +795,7 @@ def add_quotes_post(
     source: str = Form(...),
 ):
     quote = Quote(lead_in=lead_in, content=content, source=source)
-    return templates.TemplateResponse(
+    return render_template(
         "quote.html",
         {
             "request": request,
@@ -123,54 +806,105 @@ def add_quotes_post(
     )
 
 
-def get_random_quote() -> str:
-    all_file_ids = list(chain.from_iterable(INVERTED_INDEX.values()))
-    file_id = choice(all_file_ids)
-    handler = get_handler()
-    return handler.load_object(str(file_id))
+async def get_pooled_random_quote() -> Quote:
+    """Parsed random quote from `RANDOM_QUOTES`, loading one while the pool
+    for the current index version is not yet full and to rotate the pool
+    """
+    version = INDEX_RELOADER.version
+    quote = RANDOM_QUOTES.sample(version)
+    if quote is None:
+        file_id = await get_async_handler().run(get_random_file_id)
+        quote = await get_parsed_quote(file_id)
+        if quote is None:
+            return Quote(content="")
+        RANDOM_QUOTES.add(version, quote)
+    return quote
+
+
+def get_random_file_id() -> int:
+    """File ID chosen uniformly from the indexed and recently added quotes"""
+    file_ids = INDEX_RELOADER.current.file_ids
+    added_file_ids = get_delta()["file_ids"]
+    ind = randrange(len(file_ids) + len(added_file_ids))
+    if ind < len(file_ids):
+        return file_ids[ind]
+    return added_file_ids[ind - len(file_ids)]
+
+
+def find_matches(query: str, searcher: Optional[IndexSearcher] = None) -> Matches:
+    """Evaluate a query against the index, see `src.query` for the syntax.
+    If nothing matches, words which are not in the index are replaced by the
+    closest indexed words and the query is evaluated again.
+
+    Raises:
+        QueryError: if the query cannot be parsed
+    """
+    searcher = searcher or get_searcher()
+    with QUERY_PHASE_SECONDS.time(phase="match"):
+        node = parse_query(query)
+        file_ids = evaluate(node, searcher)
+    if file_ids:
+        return Matches(file_ids, node, {})
+
+    with QUERY_PHASE_SECONDS.time(phase="correct"):
+        corrected, corrections = correct_query(node, searcher, searcher.snapshot.fuzzy)
+        if not corrections:
+            return Matches(file_ids, node, {})
+        logging.debug(f"Corrected query: {query}, with: {corrections}")
+        return Matches(evaluate(corrected, searcher), corrected, corrections)
 
 
-def get_quotes(word: str) -> List[str]:
-    """Given a word, search the inverted index and retrieve
-    all quotes containing that word. Case insensitive.
+def get_file_ids(query: str) -> List[int]:
+    """File IDs matching a query, see `find_matches`"""
+    return find_matches(query).file_ids
+
+
+def get_quotes(
+    query: str, k: int = 1, ranked: bool = False
+) -> Tuple[List[str], Dict[str, str]]:
+    """Given a query, search the inverted index and retrieve
+    quotes matching it. Case insensitive, tolerant of typos.
 
     Args:
-        word: word to search inverted index for.
+        query: single word, or boolean/phrase query to search inverted index for.
+        k: maximum number of quotes to retrieve
+        ranked: retrieve the most relevant quotes rather than random ones
 
     Returns:
-        list of all quotes containing given word.
+        tuple of (<distinct quotes matching the query>, <corrections made to
+        misspelt words of the query>)
     """
-    word_id = WORD_ID_MAP.get(word.lower())
-    if not word_id:
-        logging.debug(f"Word: {word} not in inverted index.")
-        return []
-
-    all_file_ids = INVERTED_INDEX.get(str(word_id))
-    handler = get_handler()
-
-    quotes = set()
-    for file_id in choices(all_file_ids, k=1):
-        quote = handler.load_object(str(file_id))
-        quotes.add(quote)
-    return list(quotes)
+    file_ids, corrections = match_quotes(query, k, ranked)
+    with QUERY_PHASE_SECONDS.time(phase="load"):
+        quotes = [load_quote(file_id) for file_id in file_ids]
+    return quotes, corrections
+
+
+def match_quotes(
+    query: str, k: int = 1, ranked: bool = False
+) -> Tuple[List[int], Dict[str, str]]:
+    """File IDs of the quotes to serve for a query, see `get_quotes`"""
+    try:
+        searcher = get_searcher()
+        matches = find_matches(query, searcher)
+    except QueryError:
+        logging.debug(f"Could not parse query: {query}", exc_info=True)
+        return [], {}
+    if not matches.file_ids:
+        logging.debug(f"Query: {query} matched nothing in inverted index.")
+        return [], {}
+
+    if ranked:
+        with QUERY_PHASE_SECONDS.time(phase="rank"):
+            top = rank_matches(matches.query, matches.file_ids, searcher, k=k)
+        file_ids = [file_id for file_id, _ in top]
+    else:
+        file_ids = sample(matches.file_ids, min(k, len(matches.file_ids)))
+    return file_ids, matches.corrections
 
 
 def split_quote(quote: str) -> Quote:
-    """Turn a quote from raw string form to Quote model class"""
-    quotes_split = quote.split("\n")
-    quote_dict = {}
-    for ind, line in enumerate(quotes_split):
-        if ind == 0 and line.endswith("..."):
-            quote_dict["lead_in"] = line
-
-        if re.match(r"\'.+\'", line, flags=re.DOTALL):
-            quote_dict["content"] = line
-
-        if ind == len(quotes_split) - 1:
-            quote_dict["source"] = line
-
-    return Quote(
-        lead_in=quote_dict.get("lead_in", ""),
-        content=quote_dict.get("content", ""),
-        source=quote_dict.get("source", ""),
-    )
+    """Turn a quote from raw string form to Quote model class, see
+    `src.documents.parse_quote`
+    """
+    return Quote(**parse_quote(quote)._asdict())
@@ -0,0 +1,44 @@
+"""Async_handler.py contains an async interface to a `Handler`, for use from
+the event loop of the API.
+
+Handlers make blocking boto3 calls and file reads. Awaiting them through
+`AsyncHandler` runs them in a bounded pool of threads instead, so a slow S3
+GET only holds up the request waiting for it, and independent loads such as
+the quotes of a page of results run concurrently.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, TypeVar
+import asyncio
+
+from src.handler import FETCH_WORKERS, Handler
+
+T = TypeVar("T")
+
+
+class AsyncHandler:
+    """Await the blocking calls of a handler in a bounded thread pool"""
+
+    def __init__(self, handler: Handler, max_workers: int = FETCH_WORKERS):
+        """
+        Args:
+            handler: handler to run calls against
+            max_workers: number of calls run at once, further calls wait for a
+                free thread. Defaults to the size of the S3 connection pool,
+                see `create_s3_resource`
+        """
+        self.handler = handler
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="handler-io"
+        )
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run any blocking function in the thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    def close(self):
+        """Wait for running calls and stop the thread pool"""
+        self.executor.shutdown(wait=True)
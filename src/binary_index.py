@@ -0,0 +1,525 @@
+"""Binary_index.py contains a compact, versioned on-disk format for the
+inverted index and word ID map.
+
+The file is designed to be opened with `mmap` so that a worker can answer
+lookups without deserializing the whole index. Layout (little-endian):
+
+    header         <4sHHI>  magic, version, number of sections, reserved
+    section table  <4sQQ>   tag, offset, length  (one per section)
+    sections
+
+Sections (version 1):
+    TOFF  u32 * (n_terms + 1)  offsets of each term into TBLB
+    TBLB  bytes                UTF-8 terms, sorted, concatenated
+    TIDS  u32 * n_terms        word ID of each sorted term
+    POFF  u64 * (n_terms + 1)  offsets of each posting list into PBLB
+    PBLB  bytes                varint count then delta/varint encoded file IDs
+    WIDX  <II> * n_terms       (word ID, term position) pairs sorted by word ID
+    XOFF  u64 * (n_terms + 1)  optional, offsets of each term into XBLB
+    XBLB  bytes                optional, varint count of files then for each
+                               file its delta encoded ID and encoded positions
+    TDFQ  u32 * n_terms        optional, number of distinct files containing
+                               each sorted term
+    FDEL  bytes                optional, symmetric deletion index of the
+                               sorted terms for typo tolerant lookup, see
+                               `src.deletions`
+
+Unknown sections are ignored by readers, new sections can be added without
+breaking older files.
+"""
+
+from collections.abc import Mapping, Sequence as SequenceABC
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+import logging
+import mmap
+import shutil
+import struct
+
+try:
+    from src.deletions import HEADER as DELETIONS_HEADER, encode_deletions
+    from src.postings import run_lengths
+except ImportError:  # Flat layout when deployed as a Lambda function
+    from deletions import HEADER as DELETIONS_HEADER, encode_deletions
+    from postings import run_lengths
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"QIDX"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHI")
+SECTION = struct.Struct("<4sQQ")
+U32 = struct.Struct("<I")
+U64 = struct.Struct("<Q")
+WIDX_ENTRY = struct.Struct("<II")
+
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+
+def encode_varint(value: int) -> bytes:
+    """Encode a non-negative integer as an unsigned LEB128 varint"""
+    if value < 0:
+        raise ValueError(f"Cannot varint encode negative value: {value}")
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decode_varint(buffer: Buffer, pos: int) -> Tuple[int, int]:
+    """Decode an unsigned LEB128 varint from a buffer.
+
+    Returns:
+        tuple of (<decoded value>, <position after the varint>)
+    """
+    result = 0
+    shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode_postings(file_ids: Sequence[int]) -> bytes:
+    """Delta/varint encode a sorted list of file IDs, prefixed by its length"""
+    out = bytearray(encode_varint(len(file_ids)))
+    previous = 0
+    for file_id in file_ids:
+        out += encode_varint(file_id - previous)
+        previous = file_id
+    return bytes(out)
+
+
+def decode_postings(buffer: Buffer, pos: int) -> List[int]:
+    """Decode a posting list written by `encode_postings` starting at `pos`"""
+    return _decode_postings(buffer, pos)[0]
+
+
+def _decode_postings(buffer: Buffer, pos: int) -> Tuple[List[int], int]:
+    count, pos = decode_varint(buffer, pos)
+    file_ids = []
+    previous = 0
+    for _ in range(count):
+        delta, pos = decode_varint(buffer, pos)
+        previous += delta
+        file_ids.append(previous)
+    return file_ids, pos
+
+
+def encode_positions(file_positions: Mapping) -> bytes:
+    """Encode a mapping of file IDs to word positions, sorted by file ID"""
+    items = sorted((int(file_id), pos) for file_id, pos in file_positions.items())
+    out = bytearray(encode_varint(len(items)))
+    previous = 0
+    for file_id, positions in items:
+        out += encode_varint(file_id - previous)
+        out += encode_postings(positions)
+        previous = file_id
+    return bytes(out)
+
+
+def decode_positions(buffer: Buffer, pos: int) -> Dict[int, List[int]]:
+    """Decode file positions written by `encode_positions` starting at `pos`"""
+    return read_positions(buffer, pos)[0]
+
+
+def read_positions(buffer: Buffer, pos: int) -> Tuple[Dict[int, List[int]], int]:
+    """As `decode_positions`, also returning the position just past them, for
+    reading encoded positions one after another
+    """
+    count, pos = decode_varint(buffer, pos)
+    file_positions = {}
+    file_id = 0
+    for _ in range(count):
+        delta, pos = decode_varint(buffer, pos)
+        file_id += delta
+        file_positions[file_id], pos = _decode_postings(buffer, pos)
+    return file_positions, pos
+
+
+def encode_index(
+    inverted_index: Mapping,
+    word_id_map: Mapping,
+    positional_index: Optional[Mapping] = None,
+    with_postings: bool = True,
+    with_deletions: bool = False,
+) -> bytes:
+    """Serialize an inverted index and word ID map to the binary format.
+
+    Accepts both freshly built indexes (integer keys) and indexes
+    round-tripped through JSON (stringified word ID keys).
+
+    Args:
+        inverted_index: mapping of word IDs to sorted lists of file IDs
+        word_id_map: mapping of words to word IDs
+        positional_index: optional mapping of word IDs to file IDs to
+        word positions, needed for phrase queries
+        with_postings: write empty posting lists if not set, keeping only
+        the term dictionary and document frequencies, see `src.shards`
+        with_deletions: write the deletion index for typo tolerant lookup.
+        Off by default, as at around 20 entries of 8 bytes per term it is
+        larger than the rest of the index, see `src.fuzzy`
+
+    Returns:
+        bytes of the binary index
+    """
+    postings_by_id = {int(word_id): ids for word_id, ids in inverted_index.items()}
+    positions_by_id = {
+        int(word_id): file_positions
+        for word_id, file_positions in (positional_index or {}).items()
+    }
+    terms = sorted(
+        ((word.encode(), int(word_id)) for word, word_id in word_id_map.items()),
+        key=lambda term: term[0],
+    )
+
+    term_offsets = bytearray()
+    term_blob = bytearray()
+    term_ids = bytearray()
+    term_frequencies = bytearray()
+    postings_offsets = bytearray()
+    postings_blob = bytearray()
+    positions_offsets = bytearray()
+    positions_blob = bytearray()
+    for term, word_id in terms:
+        term_offsets += U32.pack(len(term_blob))
+        term_blob += term
+        term_ids += U32.pack(word_id)
+        postings_offsets += U64.pack(len(postings_blob))
+        file_ids = postings_by_id.get(word_id, [])
+        postings_blob += encode_postings(file_ids if with_postings else [])
+        term_frequencies += U32.pack(count_distinct(file_ids))
+        positions_offsets += U64.pack(len(positions_blob))
+        positions_blob += encode_positions(positions_by_id.get(word_id, {}))
+    term_offsets += U32.pack(len(term_blob))
+    postings_offsets += U64.pack(len(postings_blob))
+    positions_offsets += U64.pack(len(positions_blob))
+
+    id_positions = sorted((word_id, pos) for pos, (_, word_id) in enumerate(terms))
+    word_id_index = b"".join(WIDX_ENTRY.pack(*entry) for entry in id_positions)
+
+    sections = {
+        b"TOFF": bytes(term_offsets),
+        b"TBLB": bytes(term_blob),
+        b"TIDS": bytes(term_ids),
+        b"POFF": bytes(postings_offsets),
+        b"PBLB": bytes(postings_blob),
+        b"WIDX": word_id_index,
+        b"TDFQ": bytes(term_frequencies),
+    }
+    if positional_index is not None:
+        sections[b"XOFF"] = bytes(positions_offsets)
+        sections[b"XBLB"] = bytes(positions_blob)
+    if with_deletions:
+        sections[b"FDEL"] = encode_deletions([term.decode() for term, _ in terms])
+    return pack_sections(sections)
+
+
+def count_distinct(file_ids: Sequence[int]) -> int:
+    """Number of distinct file IDs in a sorted list"""
+    return sum(
+        1
+        for ind, file_id in enumerate(file_ids)
+        if ind == 0 or file_ids[ind - 1] != file_id
+    )
+
+
+def pack_sections(sections: Dict[bytes, bytes]) -> bytes:
+    """Lay out named sections behind a header and section table"""
+    data_start = HEADER.size + SECTION.size * len(sections)
+    table = bytearray()
+    body = bytearray()
+    for tag, data in sections.items():
+        table += SECTION.pack(tag, data_start + len(body), len(data))
+        body += data
+    header = HEADER.pack(MAGIC, VERSION, len(sections), 0)
+    return header + bytes(table) + bytes(body)
+
+
+def write_sections(path: Path, sections: Dict[bytes, Union[bytes, Path]]):
+    """Lay out named sections behind a header and section table in a file, as
+    `pack_sections`. Sections given as paths are copied from those files, so
+    large sections are never held in memory.
+    """
+    lengths = [
+        data.stat().st_size if isinstance(data, Path) else len(data)
+        for data in sections.values()
+    ]
+    offset = HEADER.size + SECTION.size * len(sections)
+    with Path(path).open("wb") as out:
+        out.write(HEADER.pack(MAGIC, VERSION, len(sections), 0))
+        for tag, length in zip(sections, lengths):
+            out.write(SECTION.pack(tag, offset, length))
+            offset += length
+        for data in sections.values():
+            if isinstance(data, Path):
+                with data.open("rb") as f:
+                    shutil.copyfileobj(f, out)
+            else:
+                out.write(data)
+
+
+class BinaryIndex:
+    """Read-only view over a binary index held in a buffer, typically an mmap.
+
+    Lookups binary search the sorted term dictionary and decode only the
+    posting lists that are requested.
+    """
+
+    def __init__(self, buffer: Buffer):
+        self.buffer = buffer
+        magic, version, n_sections, _ = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not a binary index, bad magic: {magic!r}")
+        if version > VERSION:
+            raise ValueError(f"Unsupported binary index version: {version}")
+        self.version = version
+
+        self.sections: Dict[bytes, Tuple[int, int]] = {}
+        for ind in range(n_sections):
+            tag, offset, length = SECTION.unpack_from(
+                buffer, HEADER.size + ind * SECTION.size
+            )
+            self.sections[tag] = (offset, length)
+
+        self.n_terms = self.sections[b"TIDS"][1] // U32.size
+
+    @classmethod
+    def open(cls, path: Path) -> "BinaryIndex":
+        """Memory-map a binary index file"""
+        with Path(path).open("rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def __len__(self) -> int:
+        return self.n_terms
+
+    def _offset(self, tag: bytes) -> int:
+        return self.sections[tag][0]
+
+    def term(self, pos: int) -> str:
+        """Return the term at a position in the sorted term dictionary"""
+        return self._term_bytes(pos).decode()
+
+    def _term_bytes(self, pos: int) -> bytes:
+        offsets = self._offset(b"TOFF")
+        start, end = struct.unpack_from("<II", self.buffer, offsets + pos * U32.size)
+        blob = self._offset(b"TBLB")
+        return self.buffer[blob + start : blob + end]
+
+    def term_word_id(self, pos: int) -> int:
+        return U32.unpack_from(self.buffer, self._offset(b"TIDS") + pos * U32.size)[0]
+
+    def find(self, word: str) -> Optional[int]:
+        """Binary search the term dictionary for a word.
+
+        Returns:
+            position of the word in the term dictionary, None if absent
+        """
+        target = word.encode()
+        low, high = 0, self.n_terms
+        while low < high:
+            mid = (low + high) // 2
+            if self._term_bytes(mid) < target:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.n_terms and self._term_bytes(low) == target:
+            return low
+        return None
+
+    @property
+    def has_frequencies(self) -> bool:
+        return b"TDFQ" in self.sections
+
+    def document_frequency_at(self, pos: int) -> int:
+        """Number of files containing the term at a position"""
+        if self.has_frequencies:
+            return U32.unpack_from(self.buffer, self._offset(b"TDFQ") + pos * U32.size)[
+                0
+            ]
+        return count_distinct(self.postings_at(pos))
+
+    def find_word_id(self, word_id: int) -> Optional[int]:
+        """Binary search for a word ID, returning its term position"""
+        base = self._offset(b"WIDX")
+        low, high = 0, self.n_terms
+        while low < high:
+            mid = (low + high) // 2
+            if (
+                WIDX_ENTRY.unpack_from(self.buffer, base + mid * WIDX_ENTRY.size)[0]
+                < word_id
+            ):
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.n_terms:
+            found_id, pos = WIDX_ENTRY.unpack_from(
+                self.buffer, base + low * WIDX_ENTRY.size
+            )
+            if found_id == word_id:
+                return pos
+        return None
+
+    def postings_at(self, pos: int) -> List[int]:
+        """Decode the posting list for the term at a position"""
+        start = U64.unpack_from(self.buffer, self._offset(b"POFF") + pos * U64.size)[0]
+        return decode_postings(self.buffer, self._offset(b"PBLB") + start)
+
+    @property
+    def has_positions(self) -> bool:
+        return b"XOFF" in self.sections
+
+    def positions_at(self, pos: int) -> Dict[int, List[int]]:
+        """Decode the file IDs and word positions for the term at a position"""
+        start = U64.unpack_from(self.buffer, self._offset(b"XOFF") + pos * U64.size)[0]
+        return decode_positions(self.buffer, self._offset(b"XBLB") + start)
+
+    def positions(self, word_id: int) -> Optional[Dict[int, List[int]]]:
+        if not self.has_positions:
+            return None
+        pos = self.find_word_id(word_id)
+        return None if pos is None else self.positions_at(pos)
+
+    def word_id(self, word: str) -> Optional[int]:
+        pos = self.find(word)
+        return None if pos is None else self.term_word_id(pos)
+
+    def postings(self, word_id: int) -> Optional[List[int]]:
+        pos = self.find_word_id(word_id)
+        return None if pos is None else self.postings_at(pos)
+
+    def deletions(self) -> Optional[Tuple[int, int, memoryview]]:
+        """Max edit distance, prefix length and sorted entries of the
+        deletion index, see `src.deletions`. None if it was not written.
+        """
+        if b"FDEL" not in self.sections:
+            return None
+        offset, length = self.sections[b"FDEL"]
+        max_distance, prefix_length = DELETIONS_HEADER.unpack_from(self.buffer, offset)
+        entries = memoryview(self.buffer)[
+            offset + DELETIONS_HEADER.size : offset + length
+        ].cast("Q")
+        return max_distance, prefix_length, entries
+
+    def word_id_map(self) -> "WordIdMap":
+        return WordIdMap(self)
+
+    def postings_map(self) -> "PostingsMap":
+        return PostingsMap(self)
+
+    def positions_map(self) -> "PositionsMap":
+        return PositionsMap(self)
+
+    def terms(self) -> "TermsView":
+        return TermsView(self)
+
+    def document_frequencies(self) -> "DocumentFrequenciesView":
+        return DocumentFrequenciesView(self)
+
+
+class WordIdMap(Mapping):
+    """Dictionary-like view of words to word IDs over a binary index"""
+
+    def __init__(self, index: BinaryIndex):
+        self.index = index
+
+    def __getitem__(self, word: str) -> int:
+        word_id = self.index.word_id(word)
+        if word_id is None:
+            raise KeyError(word)
+        return word_id
+
+    def __iter__(self) -> Iterator[str]:
+        return (self.index.term(pos) for pos in range(len(self.index)))
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+class PostingsMap(Mapping):
+    """Dictionary-like view of word IDs to file IDs over a binary index.
+
+    Keys may be given as integers or, as with JSON loaded indexes, strings.
+    """
+
+    def __init__(self, index: BinaryIndex):
+        self.index = index
+
+    def __getitem__(self, word_id: Union[int, str]) -> List[int]:
+        postings = self.index.postings(int(word_id))
+        if postings is None:
+            raise KeyError(word_id)
+        return postings
+
+    def entry(self, word_id: Union[int, str]) -> Tuple[List[int], List[int]]:
+        """Distinct file IDs containing a word and the occurrences in each,
+        as `src.postings.CompactPostings.entry`
+        """
+        return run_lengths(self[word_id])
+
+    def __iter__(self) -> Iterator[int]:
+        return (self.index.term_word_id(pos) for pos in range(len(self.index)))
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+class PositionsMap(PostingsMap):
+    """Dictionary-like view of word IDs to file IDs and word positions over
+    a binary index. Empty if the index was written without positions.
+    """
+
+    def __getitem__(self, word_id: Union[int, str]) -> Dict[int, List[int]]:
+        positions = self.index.positions(int(word_id))
+        if positions is None:
+            raise KeyError(word_id)
+        return positions
+
+    def __iter__(self) -> Iterator[int]:
+        return super().__iter__() if self.index.has_positions else iter(())
+
+    def __len__(self) -> int:
+        return len(self.index) if self.index.has_positions else 0
+
+
+class TermsView(SequenceABC):
+    """List-like view of the sorted term dictionary of a binary index"""
+
+    def __init__(self, index: BinaryIndex):
+        self.index = index
+
+    def __getitem__(self, pos: int) -> str:
+        if not 0 <= pos < len(self.index):
+            raise IndexError(pos)
+        return self.index.term(pos)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+class DocumentFrequenciesView(TermsView):
+    """List-like view of the document frequency of each sorted term"""
+
+    def __getitem__(self, pos: int) -> int:
+        if not 0 <= pos < len(self.index):
+            raise IndexError(pos)
+        return self.index.document_frequency_at(pos)
+
+
+def convert_json_index(
+    inverted_index: Dict, word_id_map: Dict, positional_index: Optional[Dict] = None
+) -> bytes:
+    """Convert a JSON loaded inverted index and word ID map to binary"""
+    logger.info(f"Converting index with {len(word_id_map)} words to binary")
+    return encode_index(inverted_index, word_id_map, positional_index)
@@ -0,0 +1,81 @@
+"""Bloom.py contains a Bloom filter over the vocabulary of an index, shipped
+with each snapshot so a word which is not indexed can be rejected without
+searching the term dictionary of a memory-mapped or sharded index.
+
+Layout (little-endian):
+
+    header  <4sHHQ>  magic, version, number of hashes, number of bits
+    bits    bytes    the bit array, bit i is bit (i % 8) of byte (i // 8)
+
+Bit positions come from one 128-bit BLAKE2b digest of the word, split into
+two 64-bit hashes and combined as h1 + i * h2 for each of the hashes.
+"""
+
+from pathlib import Path
+from typing import Iterable, Iterator, Union
+import hashlib
+import math
+import mmap
+import struct
+
+MAGIC = b"QBLM"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHQ")
+HASH_PAIR = struct.Struct("<QQ")
+
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+# Fraction of words which are not indexed but pass the filter
+DEFAULT_FALSE_POSITIVE_RATE = 0.01
+
+
+def bit_positions(word: str, n_hashes: int, n_bits: int) -> Iterator[int]:
+    h1, h2 = HASH_PAIR.unpack(hashlib.blake2b(word.encode(), digest_size=16).digest())
+    for ind in range(n_hashes):
+        yield (h1 + ind * h2) % n_bits
+
+
+def encode_filter(
+    words: Iterable[str], false_positive_rate: float = DEFAULT_FALSE_POSITIVE_RATE
+) -> bytes:
+    """Build a Bloom filter over words, sized for a false positive rate"""
+    words = list(words)
+    n_bits = max(
+        8, math.ceil(-len(words) * math.log(false_positive_rate) / math.log(2) ** 2)
+    )
+    n_hashes = max(1, round(n_bits / max(len(words), 1) * math.log(2)))
+    bits = bytearray(math.ceil(n_bits / 8))
+    for word in words:
+        for pos in bit_positions(word, n_hashes, n_bits):
+            bits[pos >> 3] |= 1 << (pos & 7)
+    return HEADER.pack(MAGIC, VERSION, n_hashes, n_bits) + bytes(bits)
+
+
+class BloomFilter:
+    """Reader over a Bloom filter held in a buffer, typically an mmap"""
+
+    def __init__(self, buffer: Buffer):
+        magic, version, n_hashes, n_bits = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not a Bloom filter, bad magic: {magic!r}")
+        if version > VERSION:
+            raise ValueError(f"Unsupported Bloom filter version: {version}")
+        self.buffer = buffer
+        self.n_hashes = n_hashes
+        self.n_bits = n_bits
+
+    @classmethod
+    def open(cls, path: Path) -> "BloomFilter":
+        """Memory-map a Bloom filter file"""
+        with Path(path).open("rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def __contains__(self, word: str) -> bool:
+        """Whether a word may be in the vocabulary, False only if it is not"""
+        buffer = self.buffer
+        return all(
+            buffer[HEADER.size + (pos >> 3)] & (1 << (pos & 7))
+            for pos in bit_positions(word, self.n_hashes, self.n_bits)
+        )
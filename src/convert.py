@@ -0,0 +1,61 @@
+"""Convert.py converts the latest JSON index snapshot, with its positions, to
+the binary format of `src.binary_index` and points the manifest at it.
+
+Usage: python -m src.convert
+"""
+
+from datetime import datetime
+from pathlib import Path
+import logging
+import tempfile
+
+try:
+    from src.binary_index import convert_json_index
+    from src.handler import Handler, LocalHandler
+    from src.incremental import load_optional_index
+    from src.shards import TERMS_PREFIX, shard_prefix
+except ImportError:  # Flat layout when deployed as a Lambda function
+    from binary_index import convert_json_index
+    from handler import Handler, LocalHandler
+    from incremental import load_optional_index
+    from shards import TERMS_PREFIX, shard_prefix
+
+logger = logging.getLogger(__name__)
+
+
+def convert_snapshot(handler: Handler) -> str:
+    """Convert the latest JSON index snapshot of a handler to a binary index,
+    written under a timestamped name as any other snapshot object, and point
+    the manifest at it in place of any sharded index.
+
+    Returns:
+        name of the binary index written
+    """
+    data = convert_json_index(
+        handler.load_index("index"),
+        handler.load_index("word-ids"),
+        load_optional_index(handler, "positions"),
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "binary-index.qidx"
+        path.write_bytes(data)
+        name = handler.write_file("binary-index", path)
+
+    manifest = handler.load_manifest()
+    for shard in range(manifest.pop("shards", 0)):
+        manifest.pop(shard_prefix(shard), None)
+    manifest.pop(TERMS_PREFIX, None)
+    manifest["binary-index"] = name
+    manifest["version"] = datetime.now().isoformat()
+    handler.write_manifest(manifest)
+    logger.info(f"Converted index snapshot to: {name}")
+    return name
+
+
+def main():
+    """Convert the latest local JSON index snapshot to the binary format"""
+    convert_snapshot(LocalHandler(Path(__file__).parent.parent / "quotes"))
+
+
+if __name__ == "__main__":
+    main()
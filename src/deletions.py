@@ -0,0 +1,63 @@
+"""Deletions.py contains the symmetric deletion index behind typo tolerant
+lookup, see `src.fuzzy`, in a form that can be built in memory or read from
+the optional FDEL section of a binary index, which snapshots leave out:
+
+    header   <BB6x>  max edit distance, prefix length
+    entries  u64 * n  hash of a deletion in the high 32 bits and the position
+                      of its term in the sorted term dictionary in the low 32
+                      bits, sorted
+
+Deletions are hashed with CRC-32 rather than `hash`, which is randomized per
+process, so an index built by one process can be read by every worker.
+"""
+
+from array import array
+from itertools import combinations
+from typing import Sequence, Set
+import struct
+import zlib
+
+HEADER = struct.Struct("<BB6x")
+MASK_32 = 0xFFFFFFFF
+
+DEFAULT_MAX_DISTANCE = 2
+DEFAULT_PREFIX_LENGTH = 7
+
+
+def deletes(word: str, max_distance: int) -> Set[str]:
+    """Every string formed by deleting up to `max_distance` characters"""
+    variants = {word}
+    for distance in range(1, min(max_distance, len(word)) + 1):
+        for kept in combinations(range(len(word)), len(word) - distance):
+            variants.add("".join(word[ind] for ind in kept))
+    return variants
+
+
+def deletion_hash(variant: str) -> int:
+    return zlib.crc32(variant.encode())
+
+
+def build_deletions(
+    terms: Sequence[str],
+    max_distance: int = DEFAULT_MAX_DISTANCE,
+    prefix_length: int = DEFAULT_PREFIX_LENGTH,
+) -> array:
+    """Sorted deletion entries of every sorted term"""
+    return array(
+        "Q",
+        sorted(
+            deletion_hash(variant) << 32 | pos
+            for pos in range(len(terms))
+            for variant in deletes(terms[pos][:prefix_length], max_distance)
+        ),
+    )
+
+
+def encode_deletions(
+    terms: Sequence[str],
+    max_distance: int = DEFAULT_MAX_DISTANCE,
+    prefix_length: int = DEFAULT_PREFIX_LENGTH,
+) -> bytes:
+    """Serialize the deletion index of sorted terms, as the FDEL section"""
+    deletions = build_deletions(terms, max_distance, prefix_length)
+    return HEADER.pack(max_distance, prefix_length) + deletions.tobytes()
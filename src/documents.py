@@ -0,0 +1,244 @@
+"""Documents.py contains the structured form of quotes, parsed once when the
+index is built, and a compact columnar store of them served alongside the
+index so requests never parse quote text.
+
+Layout (little-endian):
+
+    header   <4sHHQ>  magic, version, number of fields, number of documents
+    ids      u64 * n                  file IDs, sorted
+    offsets  u64 * (n + 1) per field  offsets of each value into its column
+    columns                           UTF-8 values of each field, concatenated,
+                                      one column per field in FIELDS order
+
+Offsets are relative to the start of the buffer. Storing each field as its
+own column keeps the values of a field contiguous, so building a field index
+such as the one behind `source:` queries reads only that column.
+"""
+
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+import mmap
+import re
+import struct
+
+try:
+    from src.tokenizer import tokenize
+except ImportError:  # Flat layout when deployed as a Lambda function
+    from tokenizer import tokenize
+
+MAGIC = b"QDOC"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHQ")
+U64 = struct.Struct("<Q")
+
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+
+class Document(NamedTuple):
+    lead_in: str
+    content: str
+    source: str
+
+
+FIELDS = Document._fields
+# Fields which can be searched on their own, e.g. `source:tolstoy`, content
+# is what the main index covers
+SEARCH_FIELDS = ("lead_in", "source")
+
+
+def parse_quote(quote: str) -> Document:
+    """Parse a quote in the form written by `src.handler.form_quote`.
+
+    The first line is the lead in if it ends with '...', a quoted line is the
+    content and the last line is the source.
+    """
+    lines = quote.split("\n")
+    lead_in, content, source = "", "", ""
+    for ind, line in enumerate(lines):
+        if ind == 0 and line.endswith("..."):
+            lead_in = line
+
+        if re.match(r"\'.+\'", line, flags=re.DOTALL):
+            content = line
+
+        if ind == len(lines) - 1:
+            source = line
+
+    return Document(lead_in, content, source)
+
+
+def encode_documents(documents: Iterable[Tuple[int, Document]]) -> bytes:
+    """Encode (<file-id>, <document>) pairs into a document store"""
+    documents = sorted(documents)
+    n_documents = len(documents)
+    offsets_start = HEADER.size + U64.size * n_documents
+    column_start = offsets_start + U64.size * (n_documents + 1) * len(FIELDS)
+
+    ids = array("Q", (file_id for file_id, _ in documents))
+    offsets = array("Q")
+    columns = bytearray()
+    for field_ind in range(len(FIELDS)):
+        for _, document in documents:
+            offsets.append(column_start + len(columns))
+            columns += document[field_ind].encode()
+        offsets.append(column_start + len(columns))
+
+    header = HEADER.pack(MAGIC, VERSION, len(FIELDS), n_documents)
+    return header + ids.tobytes() + offsets.tobytes() + bytes(columns)
+
+
+class DocumentWriter:
+    """Write a document store to a file without holding the documents in
+    memory. Values are appended to a temporary column file per field as
+    documents are added, in any order, then copied into file ID order by
+    `finish`.
+    """
+
+    def __init__(self, directory: Path):
+        self.paths = [Path(directory) / f"column-{field}" for field in FIELDS]
+        self.columns = [path.open("wb") for path in self.paths]
+        self.ids = array("Q")
+        # Offset of each value into its temporary column, then the end
+        self.starts = [array("Q", [0]) for _ in FIELDS]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, file_id: int, document: Document):
+        self.ids.append(file_id)
+        for column, starts, value in zip(self.columns, self.starts, document):
+            data = value.encode()
+            column.write(data)
+            starts.append(starts[-1] + len(data))
+
+    def finish(self, path: Path):
+        """Write the document store and remove the temporary columns"""
+        for column in self.columns:
+            column.close()
+        order = sorted(range(len(self.ids)), key=self.ids.__getitem__)
+        n_documents = len(order)
+        offsets_start = HEADER.size + U64.size * n_documents
+        column_start = offsets_start + U64.size * (n_documents + 1) * len(FIELDS)
+
+        offsets = array("Q")
+        offset = column_start
+        for starts in self.starts:
+            for ind in order:
+                offsets.append(offset)
+                offset += starts[ind + 1] - starts[ind]
+            offsets.append(offset)
+
+        with Path(path).open("wb") as out:
+            out.write(HEADER.pack(MAGIC, VERSION, len(FIELDS), n_documents))
+            out.write(array("Q", (self.ids[ind] for ind in order)).tobytes())
+            out.write(offsets.tobytes())
+            for column_path, starts in zip(self.paths, self.starts):
+                # Empty files cannot be memory-mapped
+                if starts[-1]:
+                    with column_path.open("rb") as f, mmap.mmap(
+                        f.fileno(), 0, access=mmap.ACCESS_READ
+                    ) as column:
+                        for ind in order:
+                            out.write(column[starts[ind] : starts[ind + 1]])
+                column_path.unlink()
+
+
+def contains_phrase(words: List[str], phrase: List[str]) -> bool:
+    """Whether the phrase occurs as consecutive words"""
+    return any(
+        words[start : start + len(phrase)] == phrase
+        for start in range(len(words) - len(phrase) + 1)
+    )
+
+
+class DocumentStore:
+    """Reader over a document store held in a buffer, typically an mmap"""
+
+    def __init__(self, buffer: Buffer):
+        self.buffer = buffer
+        magic, version, n_fields, n_documents = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not a document store, bad magic: {magic!r}")
+        if version > VERSION:
+            raise ValueError(f"Unsupported document store version: {version}")
+        if n_fields != len(FIELDS):
+            raise ValueError(f"Unexpected number of document fields: {n_fields}")
+        self.n_documents = n_documents
+        self.ids = memoryview(buffer)[
+            HEADER.size : HEADER.size + U64.size * n_documents
+        ].cast("Q")
+        self.offsets_start = HEADER.size + U64.size * n_documents
+        # Field indexes are built on first use, see `field_postings`
+        self.field_indexes: Dict[str, Dict[str, array]] = {}
+        self.lock = Lock()
+
+    @classmethod
+    def open(cls, path: Path) -> "DocumentStore":
+        """Memory-map a document store file"""
+        with Path(path).open("rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def __len__(self) -> int:
+        return self.n_documents
+
+    def position(self, file_id: int) -> Optional[int]:
+        pos = bisect_left(self.ids, file_id)
+        if pos < self.n_documents and self.ids[pos] == file_id:
+            return pos
+        return None
+
+    def value_at(self, field_ind: int, pos: int) -> str:
+        offset = self.offsets_start + U64.size * (
+            (self.n_documents + 1) * field_ind + pos
+        )
+        start, end = struct.unpack_from("<QQ", self.buffer, offset)
+        return bytes(self.buffer[start:end]).decode()
+
+    def document_at(self, pos: int) -> Document:
+        return Document(*(self.value_at(ind, pos) for ind in range(len(FIELDS))))
+
+    def get(self, file_id: int) -> Optional[Document]:
+        """Document of a file ID, None if it is not in the store"""
+        pos = self.position(int(file_id))
+        return None if pos is None else self.document_at(pos)
+
+    def __iter__(self) -> Iterator[Tuple[int, Document]]:
+        for pos in range(self.n_documents):
+            yield self.ids[pos], self.document_at(pos)
+
+    def field_index(self, field: str) -> Dict[str, array]:
+        """Sorted file IDs of the documents containing each word in a field"""
+        with self.lock:
+            if field not in self.field_indexes:
+                field_ind = FIELDS.index(field)
+                field_index: Dict[str, array] = {}
+                for pos in range(self.n_documents):
+                    file_id = self.ids[pos]
+                    for word in dict.fromkeys(tokenize(self.value_at(field_ind, pos))):
+                        field_index.setdefault(word, array("Q")).append(file_id)
+                self.field_indexes[field] = field_index
+            return self.field_indexes[field]
+
+    def field_postings(self, field: str, words: List[str]) -> List[int]:
+        """Sorted file IDs of the documents containing the words consecutively
+        in a field
+        """
+        field_index = self.field_index(field)
+        candidates = min(
+            (field_index.get(word, ()) for word in words), key=len, default=()
+        )
+        if len(words) == 1:
+            return list(candidates)
+        field_ind = FIELDS.index(field)
+        return [
+            file_id
+            for file_id in candidates
+            if contains_phrase(
+                tokenize(self.value_at(field_ind, self.position(file_id))), words
+            )
+        ]
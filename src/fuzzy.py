@@ -0,0 +1,197 @@
+"""Fuzzy.py contains typo tolerant lookup of indexed words, used when the
+words of a query are not in the index.
+
+Lookups use a symmetric deletion index (as in SymSpell). Every indexed word
+is stored under each string formed by deleting up to `max_distance` of its
+characters. A misspelt word is then looked up under its own deletions, so
+candidates are found with a few dictionary lookups rather than by comparing
+it to the whole vocabulary. Candidates are verified with the true edit
+distance, as sharing a deletion does not guarantee they are close enough.
+
+Only the first `prefix_length` characters of words are used for deletions,
+which bounds the size of the index for long words. Deletions are stored as
+a sorted array of 32 bit hashes alongside the positions of their words,
+rather than as a dictionary of strings, as there are dozens per word. Hash
+collisions only add candidates, which are then verified.
+
+The deletion index is built in memory from the term dictionary, on a
+background thread once an index is loaded (`warm`) or else on the first
+lookup, so loading an index never waits for it. For a vocabulary of 100k
+words it takes a few seconds and holds about 20 entries of 8 bytes per word,
+more than the rest of the binary index, which is why snapshots are written
+without it. A binary index written with one (the optional FDEL section, see
+`src.deletions`) is memory-mapped instead.
+"""
+
+from bisect import bisect_left
+from threading import Lock, Thread
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+try:
+    from src.binary_index import BinaryIndex
+    from src.deletions import (
+        DEFAULT_MAX_DISTANCE,
+        DEFAULT_PREFIX_LENGTH,
+        MASK_32,
+        build_deletions,
+        deletes,
+        deletion_hash,
+    )
+    from src.query import Node, Searchable
+except ImportError:  # Flat layout when deployed as a Lambda function
+    from binary_index import BinaryIndex
+    from deletions import (
+        DEFAULT_MAX_DISTANCE,
+        DEFAULT_PREFIX_LENGTH,
+        MASK_32,
+        build_deletions,
+        deletes,
+        deletion_hash,
+    )
+    from query import Node, Searchable
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Damerau-Levenshtein distance (optimal string alignment), counting
+    insertions, deletions, substitutions and adjacent transpositions.
+    Returns `max_distance + 1` as soon as the distance is known to exceed
+    `max_distance`.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous_previous: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(
+                previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost
+            )
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return min(previous[-1], max_distance + 1)
+
+
+class FuzzyMatcher:
+    """Find the indexed words closest to a misspelt word"""
+
+    def __init__(
+        self,
+        terms: Sequence[str],
+        frequencies: Sequence[int],
+        max_distance: int = DEFAULT_MAX_DISTANCE,
+        prefix_length: int = DEFAULT_PREFIX_LENGTH,
+        deletions: Optional[Sequence[int]] = None,
+    ):
+        """
+        Args:
+            terms: every indexed word, sorted
+            frequencies: number of quotes containing each word in `terms`,
+                used to choose between equally close words
+            max_distance: largest edit distance to match within
+            prefix_length: number of leading characters deletions are taken from
+            deletions: sorted entries of the deletion index of `terms`, built
+                on first use if not given, see `src.deletions`
+        """
+        self.terms = terms
+        self.frequencies = frequencies
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self._deletions = deletions
+        self.lock = Lock()
+
+    @classmethod
+    def from_binary_index(cls, index: BinaryIndex) -> "FuzzyMatcher":
+        """Match against the memory-mapped term dictionary and deletion index
+        of a binary index
+        """
+        terms, frequencies = index.terms(), index.document_frequencies()
+        deletions = index.deletions()
+        if deletions is None:
+            return cls(terms, frequencies)
+        max_distance, prefix_length, entries = deletions
+        return cls(terms, frequencies, max_distance, prefix_length, entries)
+
+    @property
+    def deletions(self) -> Sequence[int]:
+        if self._deletions is None:
+            with self.lock:
+                if self._deletions is None:
+                    self._deletions = build_deletions(
+                        self.terms, self.max_distance, self.prefix_length
+                    )
+        return self._deletions
+
+    def warm(self):
+        """Build the deletion index on a background thread, unless it was
+        built or mapped already, so the first lookup does not wait for it
+        """
+        if self._deletions is None:
+            Thread(target=lambda: self.deletions, daemon=True).start()
+
+    def candidates(self, word: str) -> Set[int]:
+        """Positions of terms sharing a deletion with a word"""
+        deletions = self.deletions
+        positions: Set[int] = set()
+        for variant in deletes(word[: self.prefix_length], self.max_distance):
+            key = deletion_hash(variant)
+            ind = bisect_left(deletions, key << 32)
+            while ind < len(deletions) and deletions[ind] >> 32 == key:
+                positions.add(deletions[ind] & MASK_32)
+                ind += 1
+        return positions
+
+    def lookup(self, word: str) -> List[Tuple[str, int]]:
+        """Indexed words within `max_distance` edits of a word.
+
+        Returns:
+            (<word>, <edit-distance>) pairs, closest and then most common first
+        """
+        matches = []
+        for pos in self.candidates(word):
+            term = self.terms[pos]
+            distance = edit_distance(word, term, self.max_distance)
+            if distance <= self.max_distance:
+                matches.append((distance, -self.frequencies[pos], term))
+        return [(term, distance) for distance, _, term in sorted(matches)]
+
+    def best(self, word: str) -> Optional[str]:
+        """Closest indexed word to a word, None if nothing is close enough"""
+        matches = self.lookup(word)
+        return matches[0][0] if matches else None
+
+
+def correct_query(
+    node: Node, index: Searchable, matcher: FuzzyMatcher
+) -> Tuple[Node, Dict[str, str]]:
+    """Replace words of a query which match nothing in the index with the
+    closest indexed words.
+
+    Returns:
+        tuple of (<corrected-query>, <mapping of replaced words to replacements>)
+    """
+    corrections: Dict[str, str] = {}
+
+    def correct_word(word: str) -> str:
+        if word not in corrections:
+            replacement = None if index.postings(word) else matcher.best(word)
+            corrections[word] = replacement or word
+        return corrections[word]
+
+    def correct(node: Node) -> Node:
+        kind = node[0]
+        if kind == "term":
+            return ("term", correct_word(node[1]))
+        if kind == "phrase":
+            return ("phrase", [correct_word(word) for word in node[1]])
+        if kind == "field":
+            # Field words are looked up in their field, not the main index
+            return node
+        return (kind, *(correct(child) for child in node[1:]))
+
+    corrected = correct(node)
+    return corrected, {k: v for k, v in corrections.items() if k != v}
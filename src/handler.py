@@ -1,19 +1,77 @@
 from abc import abstractmethod
-from typing import Any, Iterator, Tuple, Dict, Optional
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Tuple,
+    Dict,
+    Optional,
+)
 from datetime import datetime
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import fcntl
 import json
 import itertools
 import re
 import os
 import logging
+import random
+import shutil
 import sys
+import time
 
-from botocore.exceptions import BotoCoreError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+import boto3
+
+try:
+    from src.binary_index import BinaryIndex, encode_index
+    from src.bloom import BloomFilter, encode_filter
+    from src.documents import Document, DocumentStore, encode_documents
+    from src.index import document_lengths
+    from src.metrics import Counter, Histogram
+    from src.pack import PACK_KEY, HEADER as PACK_HEADER, PackReader, table_size
+    from src.shards import TERMS_PREFIX, encode_shards, shard_prefix
+except ImportError:  # Flat layout when deployed as a Lambda function
+    from binary_index import BinaryIndex, encode_index
+    from bloom import BloomFilter, encode_filter
+    from documents import Document, DocumentStore, encode_documents
+    from index import document_lengths
+    from metrics import Counter, Histogram
+    from pack import PACK_KEY, HEADER as PACK_HEADER, PackReader, table_size
+    from shards import TERMS_PREFIX, encode_shards, shard_prefix
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Fixed name of the delta segment holding quotes added since the last build
+DELTA_KEY = "delta.json"
+# Fixed name of the manifest pointing at the objects of the latest snapshot
+MANIFEST_KEY = "manifest.json"
+# Fixed name of the counter holding the next unused file ID
+COUNTER_KEY = "next-file-id.json"
+# Lock file serializing local updates of the delta segment
+DELTA_LOCK_KEY = "delta.lock"
+
+# Concurrent requests, and attempts per object, when fetching quotes from S3
+FETCH_WORKERS = int(os.getenv("QUOTES_FETCH_WORKERS", 16))
+FETCH_ATTEMPTS = 5
+# Bytes read at a time when streaming the packed corpus from S3
+PACK_CHUNK_SIZE = 1 << 20
+
+HANDLER_SECONDS = Histogram(
+    "handler_load_seconds", "Duration of handler loads by handler and operation"
+)
+S3_REQUESTS = Counter("s3_requests", "S3 API calls by operation and outcome")
+S3_SECONDS = Histogram("s3_request_seconds", "Duration of S3 API calls by operation")
+
 
 def form_quote(
     content: str,
@@ -42,6 +100,14 @@ def form_quote(
     return "\n".join((lead_in, f"'{content}'", source)).strip()
 
 
+def timestamp() -> str:
+    """Timestamp for the names of snapshot objects, to the microsecond so
+    snapshots written within the same minute never share a name. Downloaded
+    objects are cached by name, see `AWSHandler._download`.
+    """
+    return datetime.now().strftime("%Y-%m-%d--%H:%M:%S.%f")
+
+
 class Handler:
     """Interface for loading files into iterator of file IDs and lines"""
 
@@ -52,6 +118,11 @@ class Handler:
         """
         raise NotImplementedError
 
+    @abstractmethod
+    def list_file_ids(self) -> List[int]:
+        """List the IDs of all quote files, sorted"""
+        raise NotImplementedError
+
     @abstractmethod
     def write_index(self, *args: Any):
         """Write a dictionary containing an inverted index to path"""
@@ -62,14 +133,160 @@ class Handler:
         """Load in any object from the environment"""
         raise NotImplementedError
 
+    @abstractmethod
+    def load_quote(self, file_id: int) -> str:
+        """Load a quote by its exact file ID, empty if there is no such quote"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_pack(self, data: bytes):
+        """Write a packed corpus from `src.pack`. Packed quotes take
+        precedence over quotes stored one per file
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def load_index(self, *args: Any):
         """Load in an dictionary containing an inverted index from path"""
         raise NotImplementedError
 
     @abstractmethod
-    def add_quote(self, *args: Any, **kwargs: Any):
-        """Add a quote, do NOT update the index"""
+    def latest_name(self, prefix: str) -> Optional[str]:
+        """Name of the latest object with a prefix, None if there is none.
+        Snapshot objects are timestamped, so the name changes with every new
+        snapshot
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def allocate_file_ids(self, n: int) -> range:
+        """Reserve `n` consecutive file IDs from the persisted counter, which
+        concurrent writers never share
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_quotes(self, quotes: Iterable[Dict[str, Any]]) -> List[int]:
+        """Add a batch of quotes, given as keyword arguments of `form_quote`,
+        do NOT update the index. Returns the new file IDs, in the order given
+        """
+        raise NotImplementedError
+
+    def add_quote(self, **kwargs: Any) -> int:
+        """Add a quote, do NOT update the index. Returns the new file ID"""
+        return self.add_quotes([kwargs])[0]
+
+    def first_unused_file_id(self) -> int:
+        """One past the largest file ID, to start a counter from the quotes
+        written before it existed
+        """
+        return max(self.list_file_ids(), default=0) + 1
+
+    @abstractmethod
+    def write_snapshot(
+        self,
+        inverted_index: Dict,
+        word_id_map: Dict,
+        positional_index: Optional[Dict] = None,
+        documents: Optional[Mapping[int, Document]] = None,
+        shards: int = 1,
+    ):
+        """Write a timestamped JSON and binary snapshot of an index, along with
+        the length of each document for ranking and, if given, the structured
+        documents of the quotes. With more than one shard, the binary index is
+        written as a terms index and a binary index per shard, see `src.shards`
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_manifest(self) -> Dict:
+        """Load the manifest of the latest snapshot, mapping each snapshot
+        prefix to the name of its object, plus a `version`. Empty if no
+        snapshot has been written with a manifest.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_manifest(self, manifest: Dict):
+        """Overwrite the manifest, after the snapshot objects are written"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_delta(self) -> Dict:
+        """Load the delta segment of quotes added since the last build"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_delta(self, delta: Dict):
+        """Overwrite the delta segment"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_delta(self, update: Callable[[Dict], Dict]) -> Dict:
+        """Replace the delta segment with `update` applied to it, without
+        losing concurrent updates. `update` may be called again with a newer
+        delta if another writer got there first. Returns the written delta
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_binary_index(self, *args: Any):
+        """Write an index serialized with `src.binary_index` as bytes"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_binary_index(self, *args: Any) -> Optional[BinaryIndex]:
+        """Memory-map the latest binary index, None if there is none"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_documents(self, *args: Any):
+        """Write a document store serialized with `src.documents` as bytes"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_documents(self, *args: Any) -> Optional[DocumentStore]:
+        """Memory-map the latest document store, None if there is none"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_filter(self, *args: Any):
+        """Write a Bloom filter serialized with `src.bloom` as bytes"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_filter(self, *args: Any) -> Optional[BloomFilter]:
+        """Memory-map the latest Bloom filter, None if there is none"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def open_binary_index(self, name: str) -> Optional[BinaryIndex]:
+        """Memory-map the binary index stored under an exact object name, as
+        recorded in a manifest, None if there is no such object
+        """
+        raise NotImplementedError
+
+    def shard_loader(self, manifest: Dict) -> Callable[[int], Optional[BinaryIndex]]:
+        """Load the shards of the snapshot a manifest describes, by the object
+        names recorded in it rather than those of whichever snapshot is the
+        latest when a shard is first needed
+        """
+        names = [
+            manifest.get(shard_prefix(shard)) for shard in range(manifest["shards"])
+        ]
+
+        def load_shard(shard: int) -> Optional[BinaryIndex]:
+            name = names[shard]
+            return self.open_binary_index(name) if name else None
+
+        return load_shard
+
+    @abstractmethod
+    def write_file(self, prefix: str, path: Path) -> str:
+        """Move a finished local file into place as a timestamped snapshot
+        object for a prefix, without reading it into memory. Returns the
+        object's name for the manifest
+        """
         raise NotImplementedError
 
 
@@ -83,25 +300,70 @@ class LocalHandler(Handler):
             Index will also be saved to local path
         """
         self.local_path = local_path
+        self._pack: Optional[PackReader] = None
 
-    def iterate_text_pairs(self) -> Iterator[Tuple[int, str]]:
-        for fname in Path(self.local_path).glob("*.txt"):
+    def load_pack(self) -> Optional[PackReader]:
+        """Memory-map the packed corpus, None if there is none"""
+        if self._pack is None:
+            path = Path(self.local_path) / PACK_KEY
+            if path.exists():
+                self._pack = PackReader.open(path)
+        return self._pack
+
+    def iterate_text_pairs(
+        self, file_ids: Optional[Iterable[int]] = None
+    ) -> Iterator[Tuple[int, str]]:
+        """Generate (<file-id>, <line-from-file>) pairs for every quote,
+        or only for the given file IDs. Packed quotes are streamed from the
+        packed corpus in one sequential pass.
+        """
+        pack = self.load_pack()
+        if file_ids is None:
+            packed_ids = set()
+            if pack is not None:
+                for file_id, quote in pack:
+                    packed_ids.add(file_id)
+                    yield from zip(itertools.repeat(file_id), quote.splitlines())
+            fnames = (
+                fname
+                for fname in Path(self.local_path).glob("*.txt")
+                if int(fname.stem) not in packed_ids
+            )
+        else:
+            fnames = []
+            for ind in file_ids:
+                quote = pack.get(ind) if pack is not None else None
+                if quote is None:
+                    fnames.append(Path(self.local_path) / f"{ind}.txt")
+                else:
+                    yield from zip(itertools.repeat(ind), quote.splitlines())
+
+        for fname in fnames:
             file_id = int(fname.stem)
             logger.debug(f"Found file ID: {file_id}")
             file_id_iterator = itertools.repeat(file_id)
             with fname.open("r") as f:
                 yield from zip(file_id_iterator, f.read().splitlines())
 
+    def list_file_ids(self) -> List[int]:
+        file_ids = {int(fname.stem) for fname in Path(self.local_path).glob("*.txt")}
+        pack = self.load_pack()
+        if pack is not None:
+            file_ids.update(pack.file_ids())
+        return sorted(file_ids)
+
     def write_index(self, prefix: str, index: Dict):
         """Write a dictionary to a file with the filename as
-        <path>/<prefix>-YYYY-MM-DD--HH:MM.json
+        <path>/<prefix>-YYYY-MM-DD--HH:MM:SS.ffffff.json
         """
-        dt_str = datetime.now().strftime("%Y-%m-%d--%H:%M")
+        dt_str = timestamp()
         path = Path(self.local_path) / f"{prefix}-{dt_str}.json"
         with path.open("w") as f:
             json.dump(index, f)
         logger.info(f"Wrote dictionary to path: {path}")
+        return path.name
 
+    @HANDLER_SECONDS.time(handler="local", operation="load_object")
     def load_object(self, prefix: str) -> str:
         """Load an object by prefix from local path.
         If several objects have the same prefix, load the
@@ -119,59 +381,471 @@ class LocalHandler(Handler):
 
         return data
 
-    def load_index(self, prefix: str) -> Dict:
-        """Searches the local path for a prefix, loads in the latest
-        associated object from JSON as a dictionary.
+    def latest_name(self, prefix: str) -> Optional[str]:
+        names = sorted(path.name for path in Path(self.local_path).glob(f"{prefix}*"))
+        return names[-1] if names else None
+
+    @HANDLER_SECONDS.time(handler="local", operation="load_quote")
+    def load_quote(self, file_id: int) -> str:
+        pack = self.load_pack()
+        quote = pack.get(file_id) if pack is not None else None
+        if quote is not None:
+            return quote
+
+        path = Path(self.local_path) / f"{int(file_id)}.txt"
+        try:
+            return path.read_text()
+        except FileNotFoundError:
+            logging.error(f"No quote with file ID: {file_id}")
+            return ""
+
+    @HANDLER_SECONDS.time(handler="local", operation="load_index")
+    def load_index(self, prefix: str, manifest: Optional[Dict] = None) -> Dict:
+        """Loads the object the manifest names for a prefix from JSON as a
+        dictionary. Without a manifest entry, searches the local path for the
+        prefix and loads the latest associated object. Reads the latest
+        manifest unless one is given.
         """
-        data_str = self.load_object(prefix)
+        if manifest is None:
+            manifest = self.load_manifest()
+        name = manifest.get(prefix)
+        if name:
+            data_str = (Path(self.local_path) / name).read_text()
+        else:
+            data_str = self.load_object(prefix)
         return json.loads(data_str)
 
-    def add_quote(self, **kwargs):
-        last_quote_index = list(self.local_path.glob("*.txt"))[-1].stem
-        next_quote_index = int(last_quote_index.rstrip(".txt")) + 1
-        next_quote_fname = self.local_path / f"{next_quote_index}.txt"
+    def allocate_file_ids(self, n: int) -> range:
+        path = Path(self.local_path) / COUNTER_KEY
+        with path.open("a+") as f:
+            # Held until the file is closed, so allocations are serialized
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            data = f.read()
+            start = json.loads(data)["next_file_id"] if data else None
+            if start is None:
+                start = self.first_unused_file_id()
+            f.seek(0)
+            f.truncate()
+            json.dump({"next_file_id": start + n}, f)
+        return range(start, start + n)
+
+    def add_quotes(self, quotes: Iterable[Dict[str, Any]]) -> List[int]:
+        # Every quote is validated before any ID is allocated
+        texts = [form_quote(**quote) for quote in quotes]
+        file_ids = self.allocate_file_ids(len(texts))
+        for file_id, text in zip(file_ids, texts):
+            # Exclusive, a quote is never overwritten
+            with (Path(self.local_path) / f"{file_id}.txt").open("x") as f:
+                f.write(text + "\n")
+        logger.info(f"Added {len(texts)} quotes to path: {self.local_path}")
+        return list(file_ids)
+
+    def write_snapshot(
+        self,
+        inverted_index: Dict,
+        word_id_map: Dict,
+        positional_index: Optional[Dict] = None,
+        documents: Optional[Mapping[int, Document]] = None,
+        shards: int = 1,
+    ):
+        manifest = {
+            "version": datetime.now().isoformat(),
+            "index": self.write_index("index", inverted_index),
+            "word-ids": self.write_index("word-ids", word_id_map),
+            "vocabulary": self.write_filter("vocabulary", encode_filter(word_id_map)),
+        }
+        if shards > 1:
+            terms, shard_data = encode_shards(
+                inverted_index, word_id_map, positional_index, shards
+            )
+            manifest[TERMS_PREFIX] = self.write_binary_index(TERMS_PREFIX, terms)
+            for shard, data in enumerate(shard_data):
+                prefix = shard_prefix(shard)
+                manifest[prefix] = self.write_binary_index(prefix, data)
+            manifest["shards"] = shards
+        else:
+            manifest["binary-index"] = self.write_binary_index(
+                "binary-index",
+                encode_index(inverted_index, word_id_map, positional_index),
+            )
+        if positional_index is not None:
+            manifest["positions"] = self.write_index("positions", positional_index)
+        manifest["doc-lengths"] = self.write_index(
+            "doc-lengths", document_lengths(inverted_index)
+        )
+        if documents is not None:
+            manifest["documents"] = self.write_documents(
+                "documents", encode_documents(documents.items())
+            )
+        self.write_manifest(manifest)
+
+    def load_manifest(self) -> Dict:
+        path = Path(self.local_path) / MANIFEST_KEY
+        if not path.exists():
+            return {}
+        with path.open("r") as f:
+            return json.load(f)
+
+    def write_manifest(self, manifest: Dict):
+        self._replace_json(Path(self.local_path) / MANIFEST_KEY, manifest)
+        logger.info(f"Wrote manifest for snapshot: {manifest['version']}")
+
+    def load_delta(self) -> Dict:
+        path = Path(self.local_path) / DELTA_KEY
+        if not path.exists():
+            return {}
+        with path.open("r") as f:
+            return json.load(f)
+
+    def write_delta(self, delta: Dict):
+        path = Path(self.local_path) / DELTA_KEY
+        self._replace_json(path, delta)
+        logger.info(f"Wrote delta segment to path: {path}")
+
+    def update_delta(self, update: Callable[[Dict], Dict]) -> Dict:
+        with (Path(self.local_path) / DELTA_LOCK_KEY).open("a") as lock:
+            # Held until the file is closed, so updates are serialized
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            delta = update(self.load_delta())
+            self.write_delta(delta)
+        return delta
+
+    def _replace_json(self, path: Path, data: Dict):
+        # Replace rather than overwrite, so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.local_path, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def write_pack(self, data: bytes):
+        path = Path(self.local_path) / PACK_KEY
+        # Replace rather than overwrite, readers may have the old file mapped
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        self._pack = None
+        logger.info(f"Wrote packed corpus to path: {path}")
+
+    def write_binary_index(self, prefix: str, data: bytes):
+        """Write a binary index to a file with the filename as
+        <path>/<prefix>-YYYY-MM-DD--HH:MM:SS.ffffff.qidx
+        """
+        return self._write_mapped_file(prefix, ".qidx", data)
+
+    @HANDLER_SECONDS.time(handler="local", operation="load_binary_index")
+    def load_binary_index(
+        self, prefix: str, manifest: Optional[Dict] = None
+    ) -> Optional[BinaryIndex]:
+        """Memory-map the binary index the manifest names for a prefix, or the
+        latest binary index with the prefix from local path
+        """
+        path = self._mapped_file_path(prefix, ".qidx", manifest)
+        return None if path is None else BinaryIndex.open(path)
+
+    def open_binary_index(self, name: str) -> Optional[BinaryIndex]:
+        path = Path(self.local_path) / name
+        if not path.exists():
+            logger.info(f"No binary index at path: {path}")
+            return None
+        return BinaryIndex.open(path)
+
+    def write_documents(self, prefix: str, data: bytes):
+        """Write a document store to a file with the filename as
+        <path>/<prefix>-YYYY-MM-DD--HH:MM:SS.ffffff.qdoc
+        """
+        return self._write_mapped_file(prefix, ".qdoc", data)
+
+    @HANDLER_SECONDS.time(handler="local", operation="load_documents")
+    def load_documents(
+        self, prefix: str, manifest: Optional[Dict] = None
+    ) -> Optional[DocumentStore]:
+        """Memory-map the document store the manifest names for a prefix, or
+        the latest document store with the prefix from local path
+        """
+        path = self._mapped_file_path(prefix, ".qdoc", manifest)
+        return None if path is None else DocumentStore.open(path)
+
+    def write_filter(self, prefix: str, data: bytes):
+        """Write a Bloom filter to a file with the filename as
+        <path>/<prefix>-YYYY-MM-DD--HH:MM:SS.ffffff.qblm
+        """
+        return self._write_mapped_file(prefix, ".qblm", data)
+
+    @HANDLER_SECONDS.time(handler="local", operation="load_filter")
+    def load_filter(
+        self, prefix: str, manifest: Optional[Dict] = None
+    ) -> Optional[BloomFilter]:
+        """Memory-map the Bloom filter the manifest names for a prefix, or
+        the latest Bloom filter with the prefix from local path
+        """
+        path = self._mapped_file_path(prefix, ".qblm", manifest)
+        return None if path is None else BloomFilter.open(path)
+
+    def write_file(self, prefix: str, path: Path) -> str:
+        """Move a file to <path>/<prefix>-YYYY-MM-DD--HH:MM:SS.ffffff<suffix>"""
+        dt_str = timestamp()
+        dest = Path(self.local_path) / f"{prefix}-{dt_str}{Path(path).suffix}"
+        # Replace rather than overwrite, readers may have the old file mapped
+        tmp_path = dest.with_suffix(".tmp")
+        shutil.move(str(path), str(tmp_path))
+        os.replace(tmp_path, dest)
+        logger.info(f"Moved file to path: {dest}")
+        return dest.name
+
+    def _write_mapped_file(self, prefix: str, suffix: str, data: bytes) -> str:
+        dt_str = timestamp()
+        path = Path(self.local_path) / f"{prefix}-{dt_str}{suffix}"
+        # Replace rather than overwrite, readers may have the old file mapped
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        logger.info(f"Wrote {suffix} file to path: {path}")
+        return path.name
+
+    def _mapped_file_path(
+        self, prefix: str, suffix: str, manifest: Optional[Dict] = None
+    ) -> Optional[Path]:
+        if manifest is None:
+            manifest = self.load_manifest()
+        name = manifest.get(prefix)
+        if name:
+            return Path(self.local_path) / name
+
+        paths = sorted(Path(self.local_path).glob(f"{prefix}-*{suffix}"))
+        if not paths:
+            logger.info(f"No {suffix} file with prefix: {prefix}")
+            return None
+        return paths[-1]
+
+
+def create_s3_resource(max_workers: int = FETCH_WORKERS) -> Any:
+    """Create an s3 resource whose connection pool fits `max_workers`
+    concurrent requests, retrying throttled and failed requests with backoff
+    """
+    config = Config(
+        max_pool_connections=max_workers,
+        retries={"max_attempts": FETCH_ATTEMPTS, "mode": "standard"},
+    )
+    s3_res = boto3.resource("s3", config=config)
+    instrument_s3_client(s3_res.meta.client)
+    return s3_res
+
+
+def instrument_s3_client(client: Any):
+    """Count and time every API call made by an S3 client, including its
+    retries, through botocore's event hooks
+    """
 
-        quote = form_quote(kwargs.pop("content"), **kwargs)
-        with open(next_quote_fname, "w") as f:
-            f.write(quote + "\n")
+    def before_call(context: Dict, **kwargs: Any):
+        context["metrics_start"] = time.perf_counter()
+
+    def after_call(event_name: str, context: Dict, **kwargs: Any):
+        # Event names are e.g. `after-call.s3.GetObject`
+        operation = event_name.rsplit(".", 1)[-1]
+        http_response = kwargs.get("http_response")
+        if http_response is not None and http_response.status_code < 300:
+            outcome = "success"
+        else:
+            outcome = "error"
+        start = context.pop("metrics_start", None)
+        if start is not None:
+            S3_SECONDS.observe(time.perf_counter() - start, operation=operation)
+        S3_REQUESTS.inc(operation=operation, outcome=outcome)
+
+    client.meta.events.register("before-call.s3", before_call)
+    client.meta.events.register("after-call.s3", after_call)
+    client.meta.events.register("after-call-error.s3", after_call)
 
 
 class AWSHandler(Handler):
-    def __init__(self, s3_res: Any):
+    def __init__(self, s3_res: Any, max_workers: int = FETCH_WORKERS):
         """
         Args:
-            s3_res: instantiated s3 resource object
+            s3_res: instantiated s3 resource object, see `create_s3_resource`
+            max_workers: number of objects fetched concurrently when iterating
         """
         self.bucket = os.getenv("QUOTES_INDEX_S3_BUCKET")
         self.region = os.getenv("QUOTES_INDEX_AWS_REGION", "eu-west-1")
         self.s3_res = s3_res
+        self.max_workers = max_workers
+        self.retry_delay = 0.1
+        self._pack_table: Optional[PackReader] = None
+        self._pack_checked = False
+
+    def load_pack_table(self) -> Optional[PackReader]:
+        """Fetch the header and table of the packed corpus with ranged GETs,
+        once per handler. None if there is no packed corpus.
+        """
+        if not self._pack_checked:
+            try:
+                header = self.fetch_range(PACK_KEY, 0, PACK_HEADER.size)
+                table = self.fetch_range(PACK_KEY, 0, table_size(header))
+                self._pack_table = PackReader(table)
+            except self.s3_res.meta.client.exceptions.NoSuchKey:
+                logger.info("No packed corpus in bucket")
+            self._pack_checked = True
+        return self._pack_table
+
+    def fetch_range(self, s3_key: str, start: int, end: int) -> bytes:
+        """Read bytes [start, end) of an object with a ranged GET"""
+        if end <= start:
+            return b""
+        response = self.s3_res.meta.client.get_object(
+            Bucket=self.bucket, Key=s3_key, Range=f"bytes={start}-{end - 1}"
+        )
+        return response["Body"].read()
+
+    def iterate_pack(
+        self, pack: PackReader, file_ids: List[int]
+    ) -> Iterator[Tuple[int, bytes]]:
+        """Read packed quotes with one ranged GET spanning all of them, which
+        for a contiguous range of file IDs reads nothing else
+        """
+        entries = [(ind, *pack.entry(ind)) for ind in file_ids]
+        if not entries:
+            return
+        start = min(offset for _, offset, _ in entries)
+        end = max(offset + length for _, offset, length in entries)
+        data = self.fetch_range(PACK_KEY, start, end)
+        for file_id, offset, length in entries:
+            yield file_id, data[offset - start : offset - start + length]
+
+    def stream_pack(self, pack: PackReader) -> Iterator[Tuple[int, bytes]]:
+        """Read every packed quote, in file ID order, with one GET whose body
+        is streamed in chunks, so memory is bounded by a chunk rather than
+        by the size of the packed corpus
+        """
+        if not len(pack):
+            return
+        start = pack.entry_at(0)[1]
+        _, last_offset, last_length = pack.entry_at(len(pack) - 1)
+        end = last_offset + last_length
+        chunks: Iterator[bytes] = iter(())
+        if end > start:
+            response = self.s3_res.meta.client.get_object(
+                Bucket=self.bucket, Key=PACK_KEY, Range=f"bytes={start}-{end - 1}"
+            )
+            chunks = response["Body"].iter_chunks(PACK_CHUNK_SIZE)
+        # Bytes of the body from `buffer_start` on, read up to `pos`
+        buffer = b""
+        buffer_start = start
+        pos = 0
+        for ind in range(len(pack)):
+            file_id, offset, length = pack.entry_at(ind)
+            begin = offset - buffer_start
+            while len(buffer) < begin + length:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    raise ValueError("Packed corpus ended before its last quote")
+                # Drop what was read already, rather than slicing the front
+                # of the buffer off for every quote
+                buffer_start += pos
+                begin -= pos
+                buffer = buffer[pos:] + chunk
+                pos = 0
+            yield file_id, buffer[begin : begin + length]
+            pos = begin + length
 
-    def iterate_text_pairs(self) -> Iterator[Tuple[int, str]]:
+    def iterate_text_pairs(
+        self, file_ids: Optional[Iterable[int]] = None
+    ) -> Iterator[Tuple[int, str]]:
         """Generate successive pairs of (<s3-key>, <line-from-s3-file>) tuples from files
         in a s3 bucket which are labeled by their order in the bucket.
         i.e. '1.txt', '2.txt', ...
 
+        Args:
+            file_ids: only fetch these file IDs by key, rather than
+            listing the whole bucket
+
         Returns:
             iterator yielding (<file-id>, <line-from-file>) pairs
         """
         bucket = self.s3_res.Bucket(self.bucket)
         logger.info(f"Iterating through items in bucket: {bucket}")
 
-        for f in bucket.objects.all():
-            if not re.match(r"\d+.txt", f.key):
-                continue
+        pack = self.load_pack_table()
+        if file_ids is None:
+            packed_ids = set()
+            if pack is not None:
+                for file_id, data in self.stream_pack(pack):
+                    packed_ids.add(file_id)
+                    yield from zip(itertools.repeat(file_id), data.splitlines())
+            keys = (
+                f.key
+                for f in bucket.objects.all()
+                if re.match(r"\d+.txt", f.key)
+                and int(Path(f.key).stem) not in packed_ids
+            )
+        else:
+            file_ids = list(file_ids)
+            packed_ids = set()
+            if pack is not None:
+                packed_ids = {ind for ind in file_ids if pack.entry(ind) is not None}
+                for file_id, data in self.iterate_pack(pack, sorted(packed_ids)):
+                    yield from zip(itertools.repeat(file_id), data.splitlines())
+            keys = (f"{ind}.txt" for ind in file_ids if ind not in packed_ids)
 
+        for key, data in self.fetch_objects(keys):
             # Assume s3 keys are named by order in bucket, as per spec
-            file_id = int(Path(f.key).stem)
+            file_id = int(Path(key).stem)
             logger.debug(f"Found file ID: {file_id}")
             file_id_iterator = itertools.repeat(file_id)
+            yield from zip(file_id_iterator, data.splitlines())
 
+    def fetch_objects(self, keys: Iterable[str]) -> Iterator[Tuple[str, bytes]]:
+        """Fetch objects on a thread pool, yielding (<s3-key>, <data>) pairs in
+        the order of `keys`. At most twice `max_workers` requests are in flight,
+        so memory stays bounded however many keys there are.
+        """
+        max_in_flight = 2 * self.max_workers
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            in_flight: Deque = deque()
+            for key in keys:
+                in_flight.append((key, executor.submit(self.fetch_object, key)))
+                if len(in_flight) >= max_in_flight:
+                    key, future = in_flight.popleft()
+                    yield key, future.result()
+            while in_flight:
+                key, future = in_flight.popleft()
+                yield key, future.result()
+
+    def fetch_object(self, s3_key: str) -> bytes:
+        """Read a whole object, retrying with exponential backoff.
+
+        Botocore retries failed requests, this also retries failures while
+        streaming the body.
+        """
+        # Clients are thread safe, resources are not
+        client = self.s3_res.meta.client
+        attempt = 1
+        while True:
             try:
-                obj = f.get()
-            except BotoCoreError:
-                logger.error(f"Failed to get s3 object: {f.key}")
+                response = client.get_object(Bucket=self.bucket, Key=s3_key)
+                return response["Body"].read()
+            except client.exceptions.NoSuchKey:
+                logger.error(f"No s3 object: {s3_key}")
+                raise
+            except (BotoCoreError, ClientError):
+                if attempt == FETCH_ATTEMPTS:
+                    logger.error(f"Failed to get s3 object: {s3_key}", exc_info=True)
+                    raise
+                delay = self.retry_delay * 2 ** (attempt - 1)
+                logger.warning(f"Retrying s3 object: {s3_key} in {delay:.2f}s")
+                time.sleep(delay * random.uniform(0.5, 1.5))
+                attempt += 1
 
-            yield from zip(file_id_iterator, obj["Body"].iter_lines())
+    def list_file_ids(self) -> List[int]:
+        bucket = self.s3_res.Bucket(self.bucket)
+        file_ids = {
+            int(Path(f.key).stem)
+            for f in bucket.objects.all()
+            if re.match(r"\d+.txt", f.key)
+        }
+        pack = self.load_pack_table()
+        if pack is not None:
+            file_ids.update(pack.file_ids())
+        return sorted(file_ids)
 
     def write_index(self, s3_key: str, index: Dict):
         """Write an dictionary to a s3 path
@@ -184,7 +858,7 @@ class AWSHandler(Handler):
             index: dictionary to write to S3
         """
         if not index:
-            return
+            return None
 
         try:
             object = self.s3_res.Object(self.bucket, s3_key)
@@ -193,7 +867,9 @@ class AWSHandler(Handler):
         except BotoCoreError:
             logger.error(f"Failed to upload dictionary to key: {s3_key}", exc_info=True)
             raise
+        return s3_key
 
+    @HANDLER_SECONDS.time(handler="aws", operation="load_object")
     def load_object(self, s3_key: str) -> str:
         """Serve the data in an S3 object
 
@@ -219,24 +895,327 @@ class AWSHandler(Handler):
         except (UnicodeDecodeError, AttributeError):
             return data
 
-    def load_index(self, s3_key: str) -> Dict:
+    def latest_name(self, prefix: str) -> Optional[str]:
+        bucket = self.s3_res.Bucket(self.bucket)
+        keys = sorted(obj.key for obj in bucket.objects.filter(Prefix=prefix))
+        return keys[-1] if keys else None
+
+    @HANDLER_SECONDS.time(handler="aws", operation="load_quote")
+    def load_quote(self, file_id: int) -> str:
+        """Serve a quote with a ranged GET from the packed corpus, or a
+        single GET of its exact key
+        """
+        pack = self.load_pack_table()
+        entry = pack.entry(int(file_id)) if pack is not None else None
+        if entry is not None:
+            offset, length = entry
+            return self.fetch_range(PACK_KEY, offset, offset + length).decode()
+
+        s3_key = f"{int(file_id)}.txt"
+        try:
+            response = self.s3_res.Object(self.bucket, s3_key).get()
+        except self.s3_res.meta.client.exceptions.NoSuchKey:
+            logger.error(f"No quote with key: {s3_key}")
+            return ""
+        except BotoCoreError:
+            logger.error(f"Failed to load quote from key: {s3_key}", exc_info=True)
+            raise
+        return response["Body"].read().decode()
+
+    @HANDLER_SECONDS.time(handler="aws", operation="load_index")
+    def load_index(self, s3_key: str, manifest: Optional[Dict] = None) -> Dict:
         """Load an index, or any dictionary from an S3 object
 
         Args:
-            s3_key: s3 path to read from. If a prefix is passed,
+            s3_key: s3 path to read from. If the manifest names an object for
+            it, load that object directly. Otherwise if a prefix is passed,
             load the last object.
+            manifest: manifest to look the key up in, the latest if not given
         """
         try:
+            if manifest is None:
+                manifest = self.load_manifest()
+            manifest_key = manifest.get(s3_key)
+            if manifest_key:
+                response = self.s3_res.Object(self.bucket, manifest_key).get()
+                return json.load(response["Body"])
             object = self.load_object(s3_key)
             return json.loads(object)
         except BotoCoreError:
             logger.error(f"Failed to load dictionary from key: {s3_key}", exc_info=True)
             raise
 
-    def add_quote(self, **kwargs):
-        tstamp = int(datetime.now().timestamp())
-        s3_key = f"{tstamp}.txt"
+    def allocate_file_ids(self, n: int) -> range:
+        """Reserve file IDs with a conditional write of the counter object,
+        retrying if another writer updated it in between
+        """
+
+        def allocate(counter: Dict) -> Dict:
+            start = counter.get("next_file_id") or self.first_unused_file_id()
+            return {"next_file_id": start + n}
+
+        end = self._update_json(COUNTER_KEY, allocate)["next_file_id"]
+        return range(end - n, end)
+
+    def add_quotes(self, quotes: Iterable[Dict[str, Any]]) -> List[int]:
+        """Add a batch of quotes, uploading up to `max_workers` at once"""
+        # Every quote is validated before any ID is allocated
+        texts = [form_quote(**quote) for quote in quotes]
+        file_ids = self.allocate_file_ids(len(texts))
+        client = self.s3_res.meta.client
+
+        def put(file_id: int, text: str):
+            # Conditional, a quote is never overwritten
+            client.put_object(
+                Bucket=self.bucket, Key=f"{file_id}.txt", Body=text, IfNoneMatch="*"
+            )
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for future in [
+                executor.submit(put, file_id, text)
+                for file_id, text in zip(file_ids, texts)
+            ]:
+                future.result()
+        logger.info(f"Added {len(texts)} quotes to bucket: {self.bucket}")
+        return list(file_ids)
+
+    def write_pack(self, data: bytes):
+        try:
+            object = self.s3_res.Object(self.bucket, PACK_KEY)
+            object.put(Body=data)
+            logger.info(f"Wrote packed corpus to key: {PACK_KEY}")
+        except BotoCoreError:
+            logger.error("Failed to upload packed corpus", exc_info=True)
+            raise
+        self._pack_table = None
+        self._pack_checked = False
+
+    def write_snapshot(
+        self,
+        inverted_index: Dict,
+        word_id_map: Dict,
+        positional_index: Optional[Dict] = None,
+        documents: Optional[Mapping[int, Document]] = None,
+        shards: int = 1,
+    ):
+        dt_str = timestamp()
+        manifest = {
+            "version": datetime.now().isoformat(),
+            "index": self.write_index(f"index-{dt_str}", inverted_index),
+            "word-ids": self.write_index(f"word-ids-{dt_str}", word_id_map),
+            "vocabulary": self.write_filter(
+                f"vocabulary-{dt_str}.qblm", encode_filter(word_id_map)
+            ),
+        }
+        if shards > 1:
+            terms, shard_data = encode_shards(
+                inverted_index, word_id_map, positional_index, shards
+            )
+            manifest[TERMS_PREFIX] = self.write_binary_index(
+                f"{TERMS_PREFIX}-{dt_str}.qidx", terms
+            )
+            for shard, data in enumerate(shard_data):
+                prefix = shard_prefix(shard)
+                manifest[prefix] = self.write_binary_index(
+                    f"{prefix}-{dt_str}.qidx", data
+                )
+            manifest["shards"] = shards
+        else:
+            manifest["binary-index"] = self.write_binary_index(
+                f"binary-index-{dt_str}.qidx",
+                encode_index(inverted_index, word_id_map, positional_index),
+            )
+        if positional_index is not None:
+            manifest["positions"] = self.write_index(
+                f"positions-{dt_str}", positional_index
+            )
+        manifest["doc-lengths"] = self.write_index(
+            f"doc-lengths-{dt_str}", document_lengths(inverted_index)
+        )
+        if documents is not None:
+            manifest["documents"] = self.write_documents(
+                f"documents-{dt_str}.qdoc", encode_documents(documents.items())
+            )
+        # Leave out anything `write_index` skipped as empty
+        self.write_manifest({k: v for k, v in manifest.items() if v})
+
+    def load_manifest(self) -> Dict:
+        return self._load_json(MANIFEST_KEY)
+
+    def write_manifest(self, manifest: Dict):
+        try:
+            object = self.s3_res.Object(self.bucket, MANIFEST_KEY)
+            object.put(Body=json.dumps(manifest))
+            logger.info(f"Wrote manifest for snapshot: {manifest['version']}")
+        except BotoCoreError:
+            logger.error("Failed to upload manifest", exc_info=True)
+            raise
+
+    def _load_json(self, s3_key: str) -> Dict:
+        """Load a dictionary from an exact key, empty if there is no such key"""
+        try:
+            response = self.s3_res.Object(self.bucket, s3_key).get()
+        except self.s3_res.meta.client.exceptions.NoSuchKey:
+            return {}
+        return json.load(response["Body"])
+
+    def _update_json(self, s3_key: str, update: Callable[[Dict], Dict]) -> Dict:
+        """Replace a dictionary at an exact key with `update` applied to it,
+        empty if there is no such key, with a conditional write. Retries if
+        another writer updated it in between.
+        """
+        client = self.s3_res.meta.client
+        while True:
+            try:
+                response = client.get_object(Bucket=self.bucket, Key=s3_key)
+                obj = json.load(response["Body"])
+                condition = {"IfMatch": response["ETag"]}
+            except client.exceptions.NoSuchKey:
+                obj = {}
+                condition = {"IfNoneMatch": "*"}
+            obj = update(obj)
+            try:
+                client.put_object(
+                    Bucket=self.bucket,
+                    Key=s3_key,
+                    Body=json.dumps(obj),
+                    **condition,
+                )
+            except ClientError as err:
+                code = err.response.get("Error", {}).get("Code")
+                if code in ("PreconditionFailed", "ConditionalRequestConflict"):
+                    logger.info(f"Object changed, retrying update of key: {s3_key}")
+                    continue
+                raise
+            return obj
+
+    def load_delta(self) -> Dict:
+        return self._load_json(DELTA_KEY)
+
+    def update_delta(self, update: Callable[[Dict], Dict]) -> Dict:
+        delta = self._update_json(DELTA_KEY, update)
+        logger.info(f"Updated delta segment at key: {DELTA_KEY}")
+        return delta
+
+    def write_delta(self, delta: Dict):
+        try:
+            object = self.s3_res.Object(self.bucket, DELTA_KEY)
+            object.put(Body=json.dumps(delta))
+            logger.info(f"Wrote delta segment to key: {DELTA_KEY}")
+        except BotoCoreError:
+            logger.error("Failed to upload delta segment", exc_info=True)
+            raise
+
+    def write_binary_index(self, s3_key: str, data: bytes):
+        """Write a binary index to a s3 path
+
+        Args:
+            s3_key: key to s3 path to write to, including filename
+            e.g. `binary-index-2021-05-27--12:00.qidx`
+            data: bytes of the binary index
+        """
+        return self._write_bytes(s3_key, data)
+
+    @HANDLER_SECONDS.time(handler="aws", operation="load_binary_index")
+    def load_binary_index(
+        self, prefix: str, manifest: Optional[Dict] = None
+    ) -> Optional[BinaryIndex]:
+        """Download the binary index the manifest names for a prefix, or the
+        latest binary index with the prefix, to temporary storage and
+        memory-map it.
+        """
+        path = self._download_latest(prefix, manifest)
+        return None if path is None else BinaryIndex.open(path)
+
+    def open_binary_index(self, name: str) -> Optional[BinaryIndex]:
+        path = self._download(name)
+        return None if path is None else BinaryIndex.open(path)
+
+    def write_documents(self, s3_key: str, data: bytes):
+        """Write a document store to a s3 path, see `write_binary_index`"""
+        return self._write_bytes(s3_key, data)
+
+    @HANDLER_SECONDS.time(handler="aws", operation="load_documents")
+    def load_documents(
+        self, prefix: str, manifest: Optional[Dict] = None
+    ) -> Optional[DocumentStore]:
+        """Download the document store the manifest names for a prefix, or
+        the latest document store with the prefix, to temporary storage and
+        memory-map it.
+        """
+        path = self._download_latest(prefix, manifest)
+        return None if path is None else DocumentStore.open(path)
+
+    def write_filter(self, s3_key: str, data: bytes):
+        """Write a Bloom filter to a s3 path, see `write_binary_index`"""
+        return self._write_bytes(s3_key, data)
+
+    @HANDLER_SECONDS.time(handler="aws", operation="load_filter")
+    def load_filter(
+        self, prefix: str, manifest: Optional[Dict] = None
+    ) -> Optional[BloomFilter]:
+        """Download the Bloom filter the manifest names for a prefix, or the
+        latest Bloom filter with the prefix, to temporary storage and
+        memory-map it.
+        """
+        path = self._download_latest(prefix, manifest)
+        return None if path is None else BloomFilter.open(path)
+
+    def write_file(self, prefix: str, path: Path) -> str:
+        """Upload a file to <prefix>-YYYY-MM-DD--HH:MM:SS.ffffff<suffix>.
+        Large files are uploaded in multipart chunks, read from disk as they
+        are sent
+        """
+        dt_str = timestamp()
+        s3_key = f"{prefix}-{dt_str}{Path(path).suffix}"
+        try:
+            self.s3_res.Bucket(self.bucket).upload_file(Path(path).as_posix(), s3_key)
+            logger.info(f"Uploaded file to key: {s3_key}")
+        except (BotoCoreError, ClientError):
+            logger.error(f"Failed to upload file to key: {s3_key}", exc_info=True)
+            raise
+        return s3_key
+
+    def _write_bytes(self, s3_key: str, data: bytes) -> str:
+        try:
+            object = self.s3_res.Object(self.bucket, s3_key)
+            object.put(Body=data)
+            logger.info(f"Wrote bytes to key: {s3_key}")
+        except BotoCoreError:
+            logger.error(f"Failed to upload bytes to key: {s3_key}", exc_info=True)
+            raise
+        return s3_key
+
+    def _download_latest(
+        self, prefix: str, manifest: Optional[Dict] = None
+    ) -> Optional[Path]:
+        """Download the object the manifest names for a prefix, or the latest
+        object with the prefix, unless it was downloaded before. Object names
+        are timestamped, so a downloaded object never changes.
+        """
+        if manifest is None:
+            manifest = self.load_manifest()
+        s3_key = manifest.get(prefix) or self.latest_name(prefix)
+        if not s3_key:
+            logger.info(f"No object with prefix: {prefix}")
+            return None
+        return self._download(s3_key)
 
-        quote = form_quote(kwargs.pop("content"), **kwargs)
-        object = self.s3_res.Object(self.bucket, s3_key)
-        object.put(Body=quote)
+    def _download(self, s3_key: str) -> Optional[Path]:
+        """Download an object unless it was downloaded before, None if there
+        is no such object
+        """
+        path = Path(tempfile.gettempdir()) / Path(s3_key).name
+        if not path.exists():
+            try:
+                self.s3_res.Bucket(self.bucket).download_file(s3_key, path.as_posix())
+            except ClientError as err:
+                if err.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                    logger.info(f"No object: {s3_key}")
+                    return None
+                logger.error(f"Failed to download object: {s3_key}", exc_info=True)
+                raise
+            except BotoCoreError:
+                logger.error(f"Failed to download object: {s3_key}", exc_info=True)
+                raise
+        return path
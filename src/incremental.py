@@ -0,0 +1,274 @@
+"""Incremental.py contains functions for updating the index as quotes are added,
+without rebuilding it from every quote.
+
+Added quotes are indexed into a small delta segment of the form
+```
+{
+    "file_ids": [<file-id>, ...],
+    "postings": {<word>: [<file-id>, ...]},
+    "positions": {<word>: {<file-id>: [<position>, ...]}},
+    "documents": {<file-id>: [<lead-in>, <content>, <source>]},
+}
+```
+which is keyed by word rather than word ID, as added quotes may contain words
+the main index has never seen. Queries merge the delta with the main index,
+and compaction folds it back into a new main index snapshot.
+"""
+
+from collections import defaultdict
+from heapq import merge
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+import itertools
+import logging
+
+try:
+    from src.bloom import BloomFilter
+    from src.documents import Document, DocumentStore
+    from src.index import WordLinePair, collect_documents, create_positional_index
+    from src.handler import Handler, LocalHandler, form_quote
+    from src.postings import merge_postings
+    from src.terms import TermDictionary
+except ImportError:  # Flat layout when deployed as a Lambda function
+    from bloom import BloomFilter
+    from documents import Document, DocumentStore
+    from index import WordLinePair, collect_documents, create_positional_index
+    from handler import Handler, LocalHandler, form_quote
+    from postings import merge_postings
+    from terms import TermDictionary
+
+logger = logging.getLogger(__name__)
+
+
+def empty_delta() -> Dict[str, Any]:
+    return {"file_ids": [], "postings": {}, "positions": {}, "documents": {}}
+
+
+def merge_occurrences(
+    occurrences: Iterable[int], file_positions: Dict[Any, List[int]]
+) -> List[int]:
+    """Merge the positions of added quotes into sorted postings which repeat
+    a file ID once per occurrence, keeping the repeats ranking counts on
+    """
+    added = {
+        int(file_id): len(positions) for file_id, positions in file_positions.items()
+    }
+    return list(
+        merge(
+            (file_id for file_id in occurrences if int(file_id) not in added),
+            (file_id for file_id, count in sorted(added.items()) for _ in range(count)),
+        )
+    )
+
+
+def add_to_delta(delta: Dict, file_line_it: Iterator[WordLinePair]) -> Dict:
+    """Index (<file-id>, <line-from-file>) pairs into a delta segment.
+
+    Args:
+        delta: delta segment to update in place
+        file_line_it: lines from the quotes that were added
+
+    Returns:
+        the updated delta segment
+    """
+    delta = {**empty_delta(), **(delta or {})}
+    local_word_id_map: Dict[str, int] = defaultdict(itertools.count().__next__)
+    documents: Dict[int, Document] = {}
+    positional_index = create_positional_index(
+        collect_documents(file_line_it, documents), local_word_id_map
+    )
+    for file_id, document in documents.items():
+        delta["documents"][str(file_id)] = list(document)
+
+    file_ids = set(delta["file_ids"])
+    for word, local_id in local_word_id_map.items():
+        file_positions = positional_index[local_id]
+        file_ids.update(file_positions)
+        delta["postings"][word] = merge_postings(
+            delta["postings"].get(word, []), file_positions
+        )
+        word_positions = delta["positions"].setdefault(word, {})
+        for file_id, positions in file_positions.items():
+            word_positions[str(file_id)] = positions
+    delta["file_ids"] = sorted(file_ids)
+    return delta
+
+
+def prune_delta(delta: Dict, file_ids: Iterable[int]) -> Dict:
+    """Remove quotes that are covered by a newer main index from a delta"""
+    covered = set(file_ids)
+    delta = {**empty_delta(), **(delta or {})}
+    postings = {}
+    for word, word_file_ids in delta["postings"].items():
+        remaining = [ind for ind in word_file_ids if ind not in covered]
+        if remaining:
+            postings[word] = remaining
+    positions = {}
+    for word, file_positions in delta["positions"].items():
+        remaining = {
+            file_id: word_positions
+            for file_id, word_positions in file_positions.items()
+            if int(file_id) not in covered
+        }
+        if remaining:
+            positions[word] = remaining
+    return {
+        "file_ids": [ind for ind in delta["file_ids"] if ind not in covered],
+        "postings": postings,
+        "positions": positions,
+        "documents": {
+            file_id: document
+            for file_id, document in delta["documents"].items()
+            if int(file_id) not in covered
+        },
+    }
+
+
+def update_index(handler: Handler, file_ids: Iterable[int]):
+    """Index quotes into the delta segment. Only reads the given quotes."""
+    file_ids = list(file_ids)
+    file_line_pairs = list(handler.iterate_text_pairs(file_ids))
+    handler.update_delta(lambda delta: add_to_delta(delta, iter(file_line_pairs)))
+    logger.info(f"Added {len(file_ids)} quotes to delta segment")
+
+
+def add_quotes(handler: Handler, quotes: Iterable[Dict[str, Any]]) -> List[int]:
+    """Add a batch of quotes and make them searchable through the delta
+    segment, which is loaded and written once for the whole batch. Quotes are
+    indexed as written rather than read back from storage.
+
+    Args:
+        handler: handler to write the quotes and delta segment to
+        quotes: keyword arguments of `src.handler.form_quote` for each quote
+
+    Returns:
+        file IDs of the added quotes, in the order given
+    """
+    quotes = list(quotes)
+    if not quotes:
+        return []
+    file_ids = handler.add_quotes(quotes)
+    file_line_pairs = [
+        (file_id, line)
+        for file_id, quote in zip(file_ids, quotes)
+        for line in form_quote(**quote).splitlines()
+    ]
+    handler.update_delta(lambda delta: add_to_delta(delta, iter(file_line_pairs)))
+    logger.info(f"Added {len(file_ids)} quotes to delta segment")
+    return file_ids
+
+
+def add_quote(handler: Handler, **kwargs) -> int:
+    """Add a quote and make it searchable through the delta segment.
+
+    Returns:
+        file ID of the added quote
+    """
+    return add_quotes(handler, [kwargs])[0]
+
+
+def load_optional_index(
+    handler: Handler, prefix: str, manifest: Optional[Dict] = None
+) -> Optional[Dict]:
+    """Load a JSON index that older snapshots may not have, None if missing.
+    Reads the latest manifest unless one is given
+    """
+    if manifest is None:
+        manifest = handler.load_manifest()
+    if manifest and prefix not in manifest:
+        return None
+    if not (manifest or {}).get(prefix) and handler.latest_name(prefix) is None:
+        # Nothing written yet, as on a first build, which is not an error
+        logger.debug(f"No index with prefix: {prefix}")
+        return None
+    try:
+        return handler.load_index(prefix, manifest) or None
+    except (ValueError, NameError):
+        # No object with the prefix, `load_object` has nothing to parse
+        logger.info(f"No index with prefix: {prefix}")
+        return None
+
+
+def load_term_dictionary(handler: Handler) -> TermDictionary:
+    """Term dictionary seeded with the word IDs of the latest snapshot, so a
+    rebuild keeps them, empty if there is no snapshot yet
+    """
+    return TermDictionary(load_optional_index(handler, "word-ids"))
+
+
+def load_optional_filter(
+    handler: Handler, manifest: Optional[Dict] = None
+) -> Optional[BloomFilter]:
+    """Load the Bloom filter over the vocabulary, None for older snapshots
+    written without one
+    """
+    if manifest is None:
+        manifest = handler.load_manifest()
+    if manifest and "vocabulary" not in manifest:
+        return None
+    return handler.load_filter("vocabulary", manifest)
+
+
+def load_optional_documents(
+    handler: Handler, manifest: Optional[Dict] = None
+) -> Optional[DocumentStore]:
+    """Load the document store, None for older snapshots written without one"""
+    if manifest is None:
+        manifest = handler.load_manifest()
+    if manifest and "documents" not in manifest:
+        return None
+    return handler.load_documents("documents", manifest)
+
+
+def compact_index(handler: Handler):
+    """Fold the delta segment into a new main index snapshot.
+
+    New words are given word IDs after the largest existing word ID, in
+    sorted order.
+    The quotes themselves are not re-read.
+    """
+    delta = handler.load_delta()
+    if not delta or not delta["file_ids"]:
+        logger.info("Delta segment is empty, nothing to compact")
+        return
+
+    inverted_index = handler.load_index("index")
+    word_id_map = load_term_dictionary(handler)
+    positional_index = load_optional_index(handler, "positions")
+    word_id_map.add_terms(delta["postings"])
+    for word, file_ids in delta["postings"].items():
+        key = str(word_id_map[word])
+        inverted_index[key] = merge_occurrences(
+            inverted_index.get(key, []),
+            delta["positions"].get(word) or {file_id: [None] for file_id in file_ids},
+        )
+        if positional_index is not None:
+            positional_index.setdefault(key, {}).update(
+                delta["positions"].get(word, {})
+            )
+
+    # Documents of quotes added before the delta held them cannot be recovered
+    # without reading the quotes, the API parses those on demand instead
+    documents = load_optional_documents(handler)
+    if documents is not None:
+        documents = dict(documents)
+        for file_id, document in delta["documents"].items():
+            documents[int(file_id)] = Document(*document)
+
+    # Keep the snapshot sharded as it was built
+    shards = handler.load_manifest().get("shards", 1)
+    handler.write_snapshot(
+        inverted_index, word_id_map, positional_index, documents, shards
+    )
+    # Quotes may have been added while compacting, only remove what was folded in
+    handler.update_delta(lambda added: prune_delta(added, delta["file_ids"]))
+    logger.info(f"Compacted {len(delta['file_ids'])} quotes into main index")
+
+
+def main():
+    """Compact the local delta segment into the main index"""
+    compact_index(LocalHandler(Path(__file__).parent.parent / "quotes"))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,81 @@
 """Index.py contais functions for creating an inverted index."""
 
 from collections import defaultdict
-from typing import Iterator, Tuple, List, Dict, Union
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+from typing import (
+    Any,
+    Callable,
+    Iterator,
+    Tuple,
+    List,
+    Dict,
+    Mapping,
+    Optional,
+    Union,
+)
 import itertools
-import string
+import logging
+import os
 
-# Create a mapping from words to unique IDs
-# ~470,000 words in English, should be fine to store in memory
-WORD_ID_MAP: Dict[str, int] = defaultdict(itertools.count().__next__)
+try:
+    from src.documents import Document, parse_quote
+    from src.metrics import Histogram
+    from src.tokenizer import batch_word_ids, text_word_ids, tokenize
+except ImportError:  # Flat layout when deployed as a Lambda function
+    from documents import Document, parse_quote
+    from metrics import Histogram
+    from tokenizer import batch_word_ids, text_word_ids, tokenize
+
+logger = logging.getLogger(__name__)
+
+BUILD_PHASE_SECONDS = Histogram(
+    "index_build_phase_seconds",
+    "Duration of each phase of building an index",
+    buckets=(0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0),
+)
 
 # Type alias for clarity
 WordFilePair = Tuple[int, int]
 WordLinePair = Tuple[int, str]
+# Terms ordered by their local word ID, and the index using those IDs
+PartialIndex = Tuple[List[str], Dict[int, List[int]]]
+
+# Number of files tokenized together by `create_inverted_index`
+TOKENIZE_BATCH_SIZE = 256
 
 
-def get_text_word_ids(text: str) -> Iterator[int]:
+def get_text_word_ids(text: str, word_id_map: Dict[str, int]) -> Iterator[int]:
     """Get all the word IDs from a given text.
-    Punctuation is removed from the text, case is ignored.
+    Punctuation is removed from the text, case is ignored, see `src.tokenizer`.
 
     Stopwords are not removed, this was not mentioned in the spec.
 
     Args:
         text: Some string to get word IDs for
+        word_id_map: mapping to assign word IDs from
 
     Returns:
         iterator of all word IDs in text
     """
-    for word in text.split():
-        if word == "":
-            continue
-        # Remove punctuation, make string uniform
-        word = word.translate(str.maketrans("", "", string.punctuation)).lower()
-        yield WORD_ID_MAP[word]
+    return iter(text_word_ids(text, word_id_map))
+
+
+def get_text_words(text: str) -> Iterator[str]:
+    """Get all the normalized words from a given text.
+    Punctuation is removed from the text, case is ignored, see `src.tokenizer`.
+
+    Args:
+        text: Some string to get words for
+
+    Returns:
+        iterator of all words in text
+    """
+    return iter(tokenize(text))
 
 
 def get_word_file_pairs(
-    file_id: int, text: Union[str, bytes]
+    file_id: int, text: Union[str, bytes], word_id_map: Dict[str, int]
 ) -> Iterator[WordFilePair]:
     """Given a file-id its text contents, return an iterator with file-id
     and word-id pairs.
@@ -43,22 +83,48 @@ def get_word_file_pairs(
     Args:
         file_id: identifier for file
         text: text contents of file
+        word_id_map: mapping to assign word IDs from
 
     Returns:
         iterator of (word-id, file-id) pairs
     """
     file_id_it = itertools.repeat(file_id)
-    # S3 serves lines as bytes
+    word_id_it = get_text_word_ids(decode_line(text), word_id_map)
+    return zip(word_id_it, file_id_it)
+
+
+def decode_line(text: Union[str, bytes]) -> str:
+    """S3 serves lines as bytes"""
     try:
-        text = text.decode()
+        return text.decode()
     except (UnicodeDecodeError, AttributeError):
-        pass
-    word_id_it = get_text_word_ids(text)
-    return zip(word_id_it, file_id_it)
+        return text
+
+
+def iterate_file_texts(file_line_it: Iterator[WordLinePair]) -> Iterator[WordLinePair]:
+    """Join consecutive lines from the same file into (<file-id>, <text>) pairs"""
+    for file_id, lines in itertools.groupby(file_line_it, key=lambda pair: pair[0]):
+        yield file_id, "\n".join(decode_line(line) for _, line in lines)
+
+
+def collect_documents(
+    file_line_it: Iterator[WordLinePair], documents: Dict[int, Document]
+) -> Iterator[WordLinePair]:
+    """Pass (<file-id>, <line-from-file>) pairs through unchanged, parsing
+    the structured document of each file into `documents` as it goes, so
+    documents are built in the same pass over the corpus as the index
+    """
+    for file_id, pairs in itertools.groupby(file_line_it, key=lambda pair: pair[0]):
+        lines = list(pairs)
+        yield from lines
+        documents[file_id] = parse_quote(
+            "\n".join(decode_line(line) for _, line in lines)
+        )
 
 
 def create_inverted_index(
     file_line_it: Iterator[WordLinePair],
+    word_id_map: Dict[str, int],
 ) -> Dict[int, List[int]]:
     """Given an iterator producing pairs of (<file-id>, <line-from-file>), produce
     an inverted index containing a mapping for each word ID to the set of all file IDs
@@ -67,19 +133,272 @@ def create_inverted_index(
     Args:
         file_line_it: Iterator producing consecutive pairs of
         (<file-id>, <line-from-file>)
+        word_id_map: mapping to assign word IDs from
 
     Returns:
         mapping of word IDs to set of all file IDs that contain that word
           i.e. <word-id>: <all-associated-file-ids>
     """
     word_file_map = defaultdict(list)
-    for fname, line in file_line_it:
-        word_file_it = get_word_file_pairs(fname, line)
-        for word_id, file_id in word_file_it:
-            word_file_map[word_id].append(file_id)
+    file_text_it = iterate_file_texts(file_line_it)
+    # Includes reading the quotes, which are loaded lazily
+    with BUILD_PHASE_SECONDS.time(phase="tokenize"):
+        while True:
+            batch = list(itertools.islice(file_text_it, TOKENIZE_BATCH_SIZE))
+            if not batch:
+                break
+            word_ids_batch = batch_word_ids((text for _, text in batch), word_id_map)
+            for (file_id, _), word_ids in zip(batch, word_ids_batch):
+                for word_id in word_ids:
+                    word_file_map[word_id].append(file_id)
 
     # Sorting once complete is faster than maintaining a sorted list with bisect
-    for word_id in word_file_map.keys():
-        word_file_map[word_id].sort()
+    with BUILD_PHASE_SECONDS.time(phase="sort"):
+        for word_id in word_file_map.keys():
+            word_file_map[word_id].sort()
+
+    return word_file_map
+
+
+def create_positional_index(
+    file_line_it: Iterator[WordLinePair],
+    word_id_map: Dict[str, int],
+) -> Dict[int, Dict[int, List[int]]]:
+    """Given an iterator producing pairs of (<file-id>, <line-from-file>), produce
+    a positional index containing, for each word ID, the positions of the word
+    in every file that contains it.
+
+    Positions count words from the start of a file. A position is skipped
+    between lines so phrases do not match across them.
+
+    Args:
+        file_line_it: Iterator producing consecutive pairs of
+        (<file-id>, <line-from-file>)
+        word_id_map: mapping to assign word IDs from
+
+    Returns:
+        mapping of word IDs to mappings of file IDs to word positions
+          i.e. <word-id>: {<file-id>: <positions>}
+    """
+    positional_index: Dict[int, Dict[int, List[int]]] = defaultdict(dict)
+    next_positions: Dict[int, int] = defaultdict(int)
+    with BUILD_PHASE_SECONDS.time(phase="tokenize"):
+        for file_id, line in file_line_it:
+            position = next_positions[file_id]
+            for word_id in text_word_ids(decode_line(line), word_id_map):
+                positional_index[word_id].setdefault(file_id, []).append(position)
+                position += 1
+            next_positions[file_id] = position + 1
+
+    with BUILD_PHASE_SECONDS.time(phase="sort"):
+        for word_id, file_positions in positional_index.items():
+            positional_index[word_id] = dict(sorted(file_positions.items()))
+
+    return positional_index
+
+
+def postings_from_positions(
+    positional_index: Dict[int, Dict[int, List[int]]],
+) -> Dict[int, List[int]]:
+    """Derive the inverted index from a positional index, each file ID
+    appears once per occurrence as with `create_inverted_index`
+    """
+    return {
+        word_id: [
+            file_id for file_id, positions in file_positions.items() for _ in positions
+        ]
+        for word_id, file_positions in positional_index.items()
+    }
 
+
+def document_lengths(inverted_index: Mapping[Any, List[int]]) -> Dict[int, int]:
+    """Number of words in each file, counted from an inverted index where
+    each file ID appears once per occurrence of the word, for ranking
+    """
+    lengths: Dict[int, int] = defaultdict(int)
+    for file_ids in inverted_index.values():
+        for file_id in file_ids:
+            lengths[int(file_id)] += 1
+    return dict(sorted(lengths.items()))
+
+
+def build_partial_index(
+    file_line_it: Iterator[WordLinePair],
+    positional: bool = False,
+    documents: Optional[Dict[int, Document]] = None,
+) -> PartialIndex:
+    """Build an inverted index over part of the corpus with its own local
+    term dictionary, so it can be built in a separate process.
+
+    Args:
+        file_line_it: lines from part of the corpus
+        positional: build a positional index rather than an inverted index
+        documents: mapping to parse the structured document of each file into
+
+    Returns:
+        tuple of (<terms ordered by local word ID>, <local inverted index>)
+    """
+    if documents is not None:
+        file_line_it = collect_documents(file_line_it, documents)
+    local_word_id_map: Dict[str, int] = defaultdict(itertools.count().__next__)
+    build = create_positional_index if positional else create_inverted_index
+    partial_index = build(file_line_it, local_word_id_map)
+    # Dictionaries keep insertion order, which is the order IDs were assigned
+    return list(local_word_id_map), dict(partial_index)
+
+
+def merge_partial_indexes(
+    partial_indexes: List[PartialIndex], word_id_map: Dict[str, int]
+) -> Dict[int, List[int]]:
+    """Merge partial indexes into one index using global word IDs.
+
+    Partial indexes must cover contiguous, ascending ranges of file IDs and be
+    given in that order, so concatenating their postings keeps them sorted.
+
+    Words not yet in `word_id_map` are assigned IDs in sorted order, so the
+    IDs do not depend on how the corpus was partitioned or listed.
+
+    Args:
+        partial_indexes: partial indexes from `build_partial_index`
+        word_id_map: mapping which assigns global word IDs on lookup, such as
+        a `TermDictionary`
+
+    Returns:
+        mapping of global word IDs to sorted file IDs, or to file IDs
+        and positions for positional partial indexes
+    """
+    new_terms = {
+        term
+        for terms, _ in partial_indexes
+        for term in terms
+        if term not in word_id_map
+    }
+    for term in sorted(new_terms):
+        word_id_map[term]
+    word_file_map: Dict[int, Any] = {}
+    for terms, partial_index in partial_indexes:
+        for local_id, postings in partial_index.items():
+            word_id = word_id_map[terms[local_id]]
+            if isinstance(postings, dict):
+                word_file_map.setdefault(word_id, {}).update(postings)
+            else:
+                word_file_map.setdefault(word_id, []).extend(postings)
     return word_file_map
+
+
+def partition(items: List[Any], n_partitions: int) -> List[List[Any]]:
+    """Split a list into at most n contiguous, near equal partitions"""
+    size, remainder = divmod(len(items), n_partitions)
+    partitions = []
+    start = 0
+    for ind in range(n_partitions):
+        end = start + size + (ind < remainder)
+        if end > start:
+            partitions.append(items[start:end])
+        start = end
+    return partitions
+
+
+def _build_partition(
+    handler_factory: Callable[[], Any],
+    file_ids: List[int],
+    positional: bool,
+    with_documents: bool,
+    conn: Connection,
+):
+    """Process target building a partial index, and optionally the documents,
+    over some file IDs
+    """
+    handler = handler_factory()
+    documents: Optional[Dict[int, Document]] = {} if with_documents else None
+    partial_index = build_partial_index(
+        handler.iterate_text_pairs(file_ids), positional, documents
+    )
+    conn.send((partial_index, documents))
+    conn.close()
+
+
+def create_inverted_index_parallel(
+    handler_factory: Callable[[], Any],
+    word_id_map: Dict[str, int],
+    processes: Optional[int] = None,
+    positional: bool = False,
+    documents: Optional[Dict[int, Document]] = None,
+) -> Dict[int, Any]:
+    """Build an inverted index across several processes.
+
+    Quote files are split into contiguous ranges of file IDs, each process
+    builds a partial index over its range with a local term dictionary,
+    then the partial indexes are merged using global word IDs.
+
+    Processes communicate over pipes rather than with a `multiprocessing.Pool`,
+    as AWS Lambda does not provide the shared memory a pool relies on.
+
+    Args:
+        handler_factory: picklable callable returning a `Handler`, called
+        once in each process
+        word_id_map: mapping to assign global word IDs from, a `TermDictionary`
+        created for the build, seeded from the previous snapshot, see `src.terms`
+        processes: number of processes, defaults to the number of CPUs
+        positional: build a positional index rather than an inverted index
+        documents: mapping to parse the structured document of each file
+        into, in the same pass as indexing, see `src.documents`
+
+    Returns:
+        mapping of word IDs to sorted file IDs, or of word IDs to file IDs and
+        positions if `positional` is set
+    """
+    processes = processes or os.cpu_count() or 1
+    with BUILD_PHASE_SECONDS.time(phase="list"):
+        file_ids = handler_factory().list_file_ids()
+    partitions = partition(file_ids, processes)
+    logger.info(
+        f"Building index over {len(file_ids)} files in {len(partitions)} processes"
+    )
+
+    if len(partitions) <= 1:
+        partial_indexes = [
+            build_partial_index(
+                handler_factory().iterate_text_pairs(file_ids), positional, documents
+            )
+        ]
+        with BUILD_PHASE_SECONDS.time(phase="merge"):
+            return merge_partial_indexes(partial_indexes, word_id_map)
+
+    # Phases inside the processes are recorded in their own registries
+    with BUILD_PHASE_SECONDS.time(phase="build"):
+        workers = []
+        for file_id_range in partitions:
+            parent_conn, child_conn = Pipe(duplex=False)
+            process = Process(
+                target=_build_partition,
+                args=(
+                    handler_factory,
+                    file_id_range,
+                    positional,
+                    documents is not None,
+                    child_conn,
+                ),
+            )
+            process.start()
+            child_conn.close()
+            workers.append((process, parent_conn))
+
+        # Receive before joining, a process blocks until its pipe is drained
+        try:
+            results = [conn.recv() for _, conn in workers]
+        except EOFError:
+            raise RuntimeError("Index build process exited without a result")
+        for process, _ in workers:
+            process.join()
+            if process.exitcode != 0:
+                raise RuntimeError(f"Index build process failed: {process.exitcode}")
+
+    partial_indexes = []
+    for partial_index, partial_documents in results:
+        partial_indexes.append(partial_index)
+        if documents is not None:
+            documents.update(partial_documents)
+
+    with BUILD_PHASE_SECONDS.time(phase="merge"):
+        return merge_partial_indexes(partial_indexes, word_id_map)
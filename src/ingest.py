@@ -0,0 +1,156 @@
+"""Ingest.py contains bulk ingestion of quotes from a file, in either
+```
+{"lead_in": <lead-in>, "content": <content>, "source": <source>}
+```
+JSON lines, or the format of `manual/main.txt`: quotes as written by
+`src.handler.form_quote`, separated by blank lines.
+
+Every quote is read and validated before any is added, so a malformed line
+fails the ingestion as a whole. Quotes are then added in batches, each written
+in one go by the handler and indexed with a single update of the delta
+segment, see `src.incremental`.
+
+Usage: python -m src.ingest <path> [--format jsonl|text] [--batch-size N]
+"""
+
+from itertools import chain, islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+import argparse
+import json
+import logging
+import os
+
+try:
+    from src.documents import FIELDS, Document, parse_quote
+    from src.handler import AWSHandler, Handler, LocalHandler, create_s3_resource
+    from src.incremental import add_quotes
+except ImportError:  # Flat layout when deployed as a Lambda function
+    from documents import FIELDS, Document, parse_quote
+    from handler import AWSHandler, Handler, LocalHandler, create_s3_resource
+    from incremental import add_quotes
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def document_to_quote(document: Document) -> Dict[str, str]:
+    """Keyword arguments of `form_quote` which write a parsed quote back as it
+    was, without the '...' of the lead in or the quotes around the content
+    """
+    lead_in = document.lead_in[: -len("...")] if document.lead_in else ""
+    content = document.content
+    if len(content) >= 2 and content[0] == content[-1] == "'":
+        content = content[1:-1]
+    quote = {"lead_in": lead_in, "content": content}
+    # A quote without a source line ends with its content
+    if document.source and document.source != document.content:
+        quote["source"] = document.source
+    return quote
+
+
+def parse_text(lines: Iterable[str]) -> Iterator[Dict[str, str]]:
+    """Parse quotes separated by blank lines, skipping any without content"""
+    block: List[str] = []
+    # A final blank line ends the last quote
+    for line in chain(lines, [""]):
+        line = line.rstrip("\n")
+        if line.strip():
+            block.append(line)
+            continue
+        if block:
+            document = parse_quote("\n".join(block))
+            if document.content:
+                yield document_to_quote(document)
+            else:
+                logger.warning(f"Skipping quote without content: {block[0]}")
+            block = []
+
+
+def validate_quote(quote: Any) -> Dict[str, str]:
+    """Fields of a quote read from JSON, leaving out empty ones
+
+    Raises:
+        ValueError: if the quote is not an object of string fields with content
+    """
+    if not isinstance(quote, dict):
+        raise ValueError("Expected an object")
+    unexpected = sorted(set(quote) - set(FIELDS))
+    if unexpected:
+        raise ValueError(f"Unexpected fields: {', '.join(unexpected)}")
+    if not quote.get("content"):
+        raise ValueError("Missing content")
+    for field, value in quote.items():
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"Field {field} is not a string")
+    return {field: quote[field] for field in FIELDS if quote.get(field)}
+
+
+def parse_json_lines(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """Parse a quote from each non-empty JSON line
+
+    Raises:
+        ValueError: naming the line number, if a line is not a valid quote
+    """
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield validate_quote(json.loads(line))
+        except ValueError as e:  # Includes json.JSONDecodeError
+            raise ValueError(f"Line {line_number}: {e}") from e
+
+
+def read_quotes(path: Path, format: Optional[str] = None) -> Iterator[Dict]:
+    """Read quotes from a file, as JSON lines if the format is `jsonl` or,
+    by default, the file has a .jsonl or .json suffix, else as text
+    """
+    if format is None:
+        format = "jsonl" if Path(path).suffix in (".jsonl", ".json") else "text"
+    parse = parse_json_lines if format == "jsonl" else parse_text
+    with Path(path).open("r") as f:
+        yield from parse(f)
+
+
+def ingest(
+    handler: Handler,
+    quotes: Iterable[Dict[str, Any]],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> List[int]:
+    """Add quotes in batches of `batch_size`, with one index update per batch.
+    All quotes are read first, so a parsing error adds none of them.
+
+    Returns:
+        file IDs of the added quotes, in the order given
+    """
+    quotes = iter(list(quotes))
+    file_ids: List[int] = []
+    while True:
+        batch = list(islice(quotes, batch_size))
+        if not batch:
+            return file_ids
+        file_ids.extend(add_quotes(handler, batch))
+        logger.info(f"Ingested {len(file_ids)} quotes")
+
+
+def main():
+    """Ingest quotes into the local quotes, or into S3 if QUOTES_ENV=aws"""
+    parser = argparse.ArgumentParser(description="Bulk add quotes from a file")
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--format", choices=("jsonl", "text"))
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if os.getenv("QUOTES_ENV") == "aws":
+        handler: Handler = AWSHandler(create_s3_resource())
+    else:
+        handler = LocalHandler(Path(__file__).parent.parent / "quotes")
+    try:
+        ingest(handler, read_quotes(args.path, args.format), args.batch_size)
+    except ValueError as e:
+        parser.error(f"{args.path}: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,55 @@
 """Generate inverted index using AWS"""
-from datetime import datetime
 
-import boto3
+from typing import Dict
+import os
 
-from index import create_inverted_index, WORD_ID_MAP
-from handler import AWSHandler
+from documents import Document
+from index import (
+    create_inverted_index_parallel,
+    postings_from_positions,
+)
+from incremental import compact_index, load_term_dictionary, prune_delta
+from handler import AWSHandler, create_s3_resource
+from streaming import create_snapshot_streaming
+
+# If set, rebuild in a single process within this many MiB, see `streaming`.
+# Runs are spilled to /tmp, which needs room for about twice the index
+BUILD_MEMORY_MB = int(os.getenv("QUOTES_BUILD_MEMORY_MB", 0))
+# Number of shards to split the binary index into, see `shards`
+INDEX_SHARDS = int(os.getenv("QUOTES_INDEX_SHARDS", 1))
+
+
+def get_handler() -> AWSHandler:
+    """Create an AWS handler, called once in each index build process"""
+    s3 = create_s3_resource()
+    return AWSHandler(s3)
 
 
 def lambda_handler(event: None, context):
-    s3 = boto3.resource("s3")
-    handler = AWSHandler(s3)
+    """Rebuild the whole index, or only fold in added quotes if the
+    event is `{"action": "compact"}`
+    """
+    handler = get_handler()
 
-    file_text_it = handler.iterate_text_pairs()
-    inverted_index = create_inverted_index(file_text_it)
+    if event and event.get("action") == "compact":
+        compact_index(handler)
+        return
 
-    dt_str = datetime.now().strftime("%Y-%m-%d--%H:%M")
-    handler.write_index(f"index-{dt_str}", inverted_index)
-    handler.write_index(f"word-ids-{dt_str}", WORD_ID_MAP)
+    file_ids = handler.list_file_ids()
+    if BUILD_MEMORY_MB:
+        create_snapshot_streaming(handler, BUILD_MEMORY_MB * 2**20, shards=INDEX_SHARDS)
+    else:
+        # Words keep the IDs they had in the previous snapshot
+        word_id_map = load_term_dictionary(handler)
+        documents: Dict[int, Document] = {}
+        positional_index = create_inverted_index_parallel(
+            get_handler,
+            word_id_map=word_id_map,
+            positional=True,
+            documents=documents,
+        )
+        inverted_index = postings_from_positions(positional_index)
+        handler.write_snapshot(
+            inverted_index, word_id_map, positional_index, documents, INDEX_SHARDS
+        )
+    handler.update_delta(lambda delta: prune_delta(delta, file_ids))
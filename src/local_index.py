@@ -1,19 +1,47 @@
 """Generate inverted index using localhost"""
 
+from functools import partial
 from pathlib import Path
+from typing import Dict
+import os
 
-from src.index import create_inverted_index, WORD_ID_MAP
+from src.documents import Document
+from src.index import (
+    create_inverted_index_parallel,
+    postings_from_positions,
+)
+from src.incremental import load_term_dictionary, prune_delta
 from src.handler import LocalHandler
+from src.streaming import create_snapshot_streaming
+
+# If set, rebuild in a single process within this many MiB, see `src.streaming`
+BUILD_MEMORY_MB = int(os.getenv("QUOTES_BUILD_MEMORY_MB", 0))
+# Number of shards to split the binary index into, see `src.shards`
+INDEX_SHARDS = int(os.getenv("QUOTES_INDEX_SHARDS", 1))
 
 
 def main():
     quotes_path = Path(__file__).parent.parent / "quotes"
     handler = LocalHandler(quotes_path)
+    file_ids = handler.list_file_ids()
 
-    file_text_it = handler.iterate_text_pairs()
-    inverted_index = create_inverted_index(file_text_it)
-    handler.write_index("index", inverted_index)
-    handler.write_index("word-ids", WORD_ID_MAP)
+    if BUILD_MEMORY_MB:
+        create_snapshot_streaming(handler, BUILD_MEMORY_MB * 2**20, shards=INDEX_SHARDS)
+    else:
+        # Words keep the IDs they had in the previous snapshot
+        word_id_map = load_term_dictionary(handler)
+        documents: Dict[int, Document] = {}
+        positional_index = create_inverted_index_parallel(
+            partial(LocalHandler, quotes_path),
+            word_id_map=word_id_map,
+            positional=True,
+            documents=documents,
+        )
+        inverted_index = postings_from_positions(positional_index)
+        handler.write_snapshot(
+            inverted_index, word_id_map, positional_index, documents, INDEX_SHARDS
+        )
+    handler.update_delta(lambda delta: prune_delta(delta, file_ids))
 
 
 if __name__ == "__main__":
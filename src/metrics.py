@@ -0,0 +1,257 @@
+"""Metrics.py contains lightweight, Prometheus style metrics and their text
+exposition format, served by the API on `/metrics`.
+
+Metrics are updated in place under a lock per metric and only formatted
+when scraped, so instrumenting a hot path costs a clock read and a
+dictionary update. Label values should come from small, fixed sets such as
+route templates or operation names, never from user input.
+"""
+
+from bisect import bisect_left
+from functools import wraps
+from threading import Lock
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import math
+import time
+
+from cachetools import TTLCache
+
+Labels = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def label_key(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self.metrics: Dict[str, "Metric"] = {}
+        self.lock = Lock()
+
+    def register(self, metric: "Metric"):
+        # Replace rather than fail, modules may be imported under two names
+        # in the flat Lambda layout
+        with self.lock:
+            self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text format"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, registry: Optional[Registry] = None
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.lock = Lock()
+        (registry or REGISTRY).register(self)
+
+    def samples(self) -> Iterator[Tuple[str, Labels, float]]:
+        """(<name-suffix>, <labels>, <value>) for each sample"""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{format_labels(labels)} {format_value(value)}"
+            )
+        return lines
+
+
+class Counter(Metric):
+    """Monotonically increasing count, per set of label values"""
+
+    kind = "counter"
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self.values.get(label_key(labels), 0.0)
+
+    def samples(self) -> Iterator[Tuple[str, Labels, float]]:
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield "_total", labels, value
+
+
+class Gauge(Metric):
+    """Value which can go up and down, either set or read from a function
+    when scraped
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        function: Optional[Callable[[], float]] = None,
+        registry: Optional[Registry] = None,
+    ):
+        super().__init__(name, documentation, registry)
+        self.function = function
+        self.values: Dict[Labels, float] = {}
+
+    def set(self, value: float, **labels: Any):
+        with self.lock:
+            self.values[label_key(labels)] = value
+
+    def samples(self) -> Iterator[Tuple[str, Labels, float]]:
+        if self.function is not None:
+            yield "", (), self.function()
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield "", labels, value
+
+
+class Timer:
+    """Observe the duration of a block, or of every call of a function"""
+
+    def __init__(self, histogram: "Histogram", labels: Dict[str, Any]):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+    def __call__(self, func: Callable) -> Callable:
+        @wraps(func)
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            # A timer per call, calls may overlap across threads
+            with Timer(self.histogram, self.labels):
+                return func(*args, **kwargs)
+
+        return timed
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets, per set of
+    label values
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        registry: Optional[Registry] = None,
+    ):
+        super().__init__(name, documentation, registry)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set, a count for each bucket and one for +Inf, then the sum
+        self.values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, **labels: Any):
+        key = label_key(labels)
+        ind = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0.0] * (len(self.buckets) + 2)
+            counts[ind] += 1
+            counts[-1] += value
+
+    def time(self, **labels: Any) -> Timer:
+        return Timer(self, labels)
+
+    def count(self, **labels: Any) -> int:
+        counts = self.values.get(label_key(labels))
+        return 0 if counts is None else int(sum(counts[:-1]))
+
+    def samples(self) -> Iterator[Tuple[str, Labels, float]]:
+        with self.lock:
+            values = [(labels, list(counts)) for labels, counts in self.values.items()]
+        for labels, counts in values:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield "_bucket", labels + (("le", format_value(bound)),), cumulative
+            yield "_sum", labels, counts[-1]
+            yield "_count", labels, cumulative
+
+
+CACHE_LOOKUPS = Counter("cache_lookups", "Lookups of in-process caches by result")
+
+
+class CountedTTLCache(TTLCache):
+    """TTLCache counting hits and misses of `cachetools.cached` lookups"""
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.name = name
+
+    def __getitem__(self, key: Any) -> Any:
+        try:
+            value = super().__getitem__(key)
+        except KeyError:
+            CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+            raise
+        CACHE_LOOKUPS.inc(cache=self.name, result="hit")
+        return value
@@ -0,0 +1,136 @@
+"""Pack.py contains a packed corpus format, storing every quote in a single
+file or object rather than one object per quote.
+
+Layout (little-endian):
+
+    header  <4sHHQ>  magic, version, reserved, number of quotes
+    table   <QQI>    file ID, offset, length  (one per quote, sorted by file ID)
+    bodies           UTF-8 quote bodies, in the same order as the table
+
+The table sits at the front so a reader can fetch it with one ranged read and
+then read any quote by its own range. As bodies are in file ID order, a
+contiguous range of file IDs is also one contiguous range of bytes.
+"""
+
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+import logging
+import mmap
+import struct
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"QPAK"
+VERSION = 1
+# Fixed name of the packed corpus, locally and on S3
+PACK_KEY = "quotes.qpak"
+
+HEADER = struct.Struct("<4sHHQ")
+ENTRY = struct.Struct("<QQI")
+
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+
+def encode_pack(quotes: Iterable[Tuple[int, str]]) -> bytes:
+    """Pack (<file-id>, <quote>) pairs into a single packed corpus"""
+    quotes = sorted(quotes)
+    data_start = HEADER.size + ENTRY.size * len(quotes)
+    table = bytearray()
+    bodies = bytearray()
+    for file_id, quote in quotes:
+        body = quote.encode()
+        table += ENTRY.pack(file_id, data_start + len(bodies), len(body))
+        bodies += body
+    return HEADER.pack(MAGIC, VERSION, 0, len(quotes)) + bytes(table) + bytes(bodies)
+
+
+def table_size(buffer: Buffer) -> int:
+    """Size of the header and table in bytes, given at least the header"""
+    return HEADER.size + ENTRY.size * read_header(buffer)
+
+
+def read_header(buffer: Buffer) -> int:
+    """Validate the header of a packed corpus, returning the number of quotes"""
+    magic, version, _, n_quotes = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError(f"Not a packed corpus, bad magic: {magic!r}")
+    if version > VERSION:
+        raise ValueError(f"Unsupported packed corpus version: {version}")
+    return n_quotes
+
+
+class PackReader:
+    """Reader over a packed corpus held in a buffer, typically an mmap.
+
+    The buffer may hold only the header and table, in which case entries
+    can be looked up but quotes cannot be read.
+    """
+
+    def __init__(self, buffer: Buffer):
+        self.buffer = buffer
+        self.n_quotes = read_header(buffer)
+
+    @classmethod
+    def open(cls, path: Path) -> "PackReader":
+        """Memory-map a packed corpus file"""
+        with Path(path).open("rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def __len__(self) -> int:
+        return self.n_quotes
+
+    def entry_at(self, pos: int) -> Tuple[int, int, int]:
+        """(<file-id>, <offset>, <length>) of the quote at a table position"""
+        return ENTRY.unpack_from(self.buffer, HEADER.size + pos * ENTRY.size)
+
+    def entry(self, file_id: int) -> Optional[Tuple[int, int]]:
+        """Binary search the table for a file ID.
+
+        Returns:
+            (<offset>, <length>) of the quote, None if it is not in the pack
+        """
+        low, high = 0, self.n_quotes
+        while low < high:
+            mid = (low + high) // 2
+            if self.entry_at(mid)[0] < file_id:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.n_quotes:
+            found_id, offset, length = self.entry_at(low)
+            if found_id == file_id:
+                return offset, length
+        return None
+
+    def file_ids(self) -> List[int]:
+        return [self.entry_at(pos)[0] for pos in range(self.n_quotes)]
+
+    def get(self, file_id: int) -> Optional[str]:
+        """Read a quote by file ID, None if it is not in the pack"""
+        entry = self.entry(int(file_id))
+        if entry is None:
+            return None
+        offset, length = entry
+        return bytes(self.buffer[offset : offset + length]).decode()
+
+    def __iter__(self) -> Iterator[Tuple[int, str]]:
+        """Read every (<file-id>, <quote>) pair in one sequential pass"""
+        for pos in range(self.n_quotes):
+            file_id, offset, length = self.entry_at(pos)
+            yield file_id, bytes(self.buffer[offset : offset + length]).decode()
+
+
+def main():
+    """Pack the local quote files into a single packed corpus"""
+    from src.handler import LocalHandler
+
+    quotes_path = Path(__file__).parent.parent / "quotes"
+    quotes = [
+        (int(fname.stem), fname.read_text()) for fname in quotes_path.glob("*.txt")
+    ]
+    LocalHandler(quotes_path).write_pack(encode_pack(quotes))
+
+
+if __name__ == "__main__":
+    main()
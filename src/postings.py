@@ -0,0 +1,128 @@
+"""Postings.py contains a compact in-memory form of the inverted index.
+
+JSON loaded indexes are dictionaries of stringified word IDs to lists of
+Python ints which repeat a file ID once per occurrence of the word, so most
+of their memory is object overhead. `CompactPostings` holds the same
+information in three typed arrays, laid out as a compressed sparse row
+matrix of word IDs by file IDs:
+
+    offsets      u64 * (max word ID + 2)  start of each word's postings
+    file_ids     u32 * n                  distinct file IDs, sorted per word
+    frequencies  u32 * n                  occurrences of the word in each file
+
+costing 8 bytes per (word, file) pair and 8 per word ID.
+"""
+
+from array import array
+from collections.abc import Mapping
+from heapq import merge
+from itertools import groupby
+from typing import Any, Iterable, Iterator, List, Tuple, Union
+
+Key = Union[int, str]
+
+
+def merge_postings(*postings: Iterable[int]) -> List[int]:
+    """Merge sorted posting lists into one sorted list without duplicates"""
+    merged: List[int] = []
+    for file_id in merge(*postings):
+        if not merged or merged[-1] != file_id:
+            merged.append(file_id)
+    return merged
+
+
+def run_lengths(occurrences: Iterable[int]) -> Tuple[List[int], List[int]]:
+    """Split a sorted list which repeats a file ID once per occurrence into
+    the distinct file IDs and the number of occurrences of each
+    """
+    file_ids: List[int] = []
+    frequencies: List[int] = []
+    for file_id, group in groupby(occurrences):
+        file_ids.append(file_id)
+        frequencies.append(sum(1 for _ in group))
+    return file_ids, frequencies
+
+
+class CompactPostings(Mapping):
+    """Dictionary-like view of word IDs to distinct file IDs, backed by
+    typed arrays. Keys may be given as integers or, as with JSON loaded
+    indexes, strings. Values are zero-copy views of the arrays.
+    """
+
+    def __init__(self, offsets: array, file_ids: array, frequencies: array):
+        self.offsets = offsets
+        self.file_ids = file_ids
+        self.frequencies = frequencies
+        self._file_ids = memoryview(file_ids)
+        self._frequencies = memoryview(frequencies)
+        self.n_words = sum(
+            1
+            for word_id in range(len(offsets) - 1)
+            if offsets[word_id] != offsets[word_id + 1]
+        )
+
+    @classmethod
+    def from_occurrences(
+        cls, inverted_index: Mapping[Any, Iterable[int]]
+    ) -> "CompactPostings":
+        """Compact an inverted index of word IDs to sorted file IDs repeated
+        once per occurrence, as built by `src.index`
+        """
+        offsets = array("Q", [0])
+        file_ids = array("I")
+        frequencies = array("I")
+        for word_id, occurrences in sorted(
+            (int(word_id), occurrences)
+            for word_id, occurrences in inverted_index.items()
+        ):
+            # Word IDs without postings get an empty range
+            offsets.extend([len(file_ids)] * (word_id + 1 - len(offsets)))
+            distinct, counts = run_lengths(occurrences)
+            file_ids.extend(distinct)
+            frequencies.extend(counts)
+            offsets.append(len(file_ids))
+        return cls(offsets, file_ids, frequencies)
+
+    def _range(self, word_id: Key) -> Tuple[int, int]:
+        word_id = int(word_id)
+        if not 0 <= word_id < len(self.offsets) - 1:
+            raise KeyError(word_id)
+        start, end = self.offsets[word_id], self.offsets[word_id + 1]
+        if start == end:
+            raise KeyError(word_id)
+        return start, end
+
+    def __getitem__(self, word_id: Key) -> memoryview:
+        start, end = self._range(word_id)
+        return self._file_ids[start:end]
+
+    def entry(self, word_id: Key) -> Tuple[memoryview, memoryview]:
+        """Distinct file IDs containing a word and the occurrences in each"""
+        start, end = self._range(word_id)
+        return self._file_ids[start:end], self._frequencies[start:end]
+
+    def document_frequency(self, word_id: Key) -> int:
+        """Number of distinct files containing a word, 0 if there are none"""
+        try:
+            start, end = self._range(word_id)
+        except KeyError:
+            return 0
+        return end - start
+
+    def __iter__(self) -> Iterator[int]:
+        return (
+            word_id
+            for word_id in range(len(self.offsets) - 1)
+            if self.offsets[word_id] != self.offsets[word_id + 1]
+        )
+
+    def __len__(self) -> int:
+        return self.n_words
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the arrays"""
+        return sum(
+            len(arr) * arr.itemsize
+            for arr in (self.offsets, self.file_ids, self.frequencies)
+        )
@@ -0,0 +1,85 @@
+"""Profiler.py contains an optional sampling profiler for finding where time
+goes under real load.
+
+A daemon thread periodically records the stack of every other thread and
+counts identical stacks. Results are in the folded format read by
+flamegraph tools, one `frame;frame;frame <count>` line per stack. Nothing
+runs unless the profiler is started.
+"""
+
+from collections import Counter
+from threading import Event, Lock, Thread, get_ident
+from types import FrameType
+from typing import List, Optional
+import sys
+
+# Deep recursion is truncated rather than recorded frame by frame
+MAX_DEPTH = 64
+
+
+def frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def fold_stack(frame: Optional[FrameType]) -> str:
+    """Fold a stack into a single `outermost;...;innermost` line"""
+    names: List[str] = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Sample the stacks of all threads every `interval` seconds"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread: Optional[Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None
+
+    def sample(self):
+        """Record the current stack of every thread other than the profiler"""
+        own_thread = get_ident()
+        frames = sys._current_frames()
+        with self.lock:
+            self.samples += 1
+            for thread_id, frame in frames.items():
+                if thread_id != own_thread:
+                    self.stacks[fold_stack(frame)] += 1
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def reset(self):
+        with self.lock:
+            self.stacks.clear()
+            self.samples = 0
+
+    def folded(self) -> str:
+        """Sampled stacks in the folded format, most frequent first"""
+        with self.lock:
+            stacks = self.stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
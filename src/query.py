@@ -0,0 +1,258 @@
+"""Query.py contains a parser and evaluator for boolean and phrase queries.
+
+Supported syntax, operators are case sensitive so lowercase words still match:
+    war peace           both words, AND is implied between terms
+    war AND peace       both words
+    war OR peace        either word
+    war NOT peace       the first word without the second
+    "war and peace"     the exact phrase
+    (war OR peace) NOT tolstoy
+    source:tolstoy      a word, or with quotes a phrase, in one field of the
+                        quote, see `src.documents.SEARCH_FIELDS`
+
+Postings are sorted lists of file IDs, so intersections gallop through the
+longer list rather than building sets.
+"""
+
+from abc import abstractmethod
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple, Union
+import re
+
+try:
+    from src.documents import SEARCH_FIELDS
+    from src.postings import merge_postings
+    from src.tokenizer import tokenize
+except ImportError:  # Flat layout when deployed as a Lambda function
+    from documents import SEARCH_FIELDS
+    from postings import merge_postings
+    from tokenizer import tokenize
+
+# Query syntax tree, e.g. ("and", ("term", "war"), ("phrase", ["war", "and"])),
+# or ("field", "source", ["leo", "tolstoy"]) for a field
+Node = Tuple[Union[str, "Node", List[str]], ...]
+Token = Tuple[str, Union[str, List[str], Tuple[str, List[str]]]]
+
+TOKEN_PATTERN = re.compile(
+    rf'(?:(?P<field>{"|".join(SEARCH_FIELDS)}):)?'
+    r'(?:"(?P<phrase>[^"]*)"|(?P<word>[^\s()"]+))|(?P<paren>[()])'
+)
+OPERATORS = {"AND", "OR", "NOT"}
+
+
+class QueryError(ValueError):
+    """Raised when a query cannot be parsed"""
+
+
+class Searchable:
+    """Interface for the postings a query is evaluated against"""
+
+    @abstractmethod
+    def postings(self, word: str) -> List[int]:
+        """Sorted file IDs, without duplicates, of files containing a word"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def positions(self, word: str) -> Dict[int, List[int]]:
+        """Word positions for each file containing a word, empty if the
+        index has no positions
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def all_file_ids(self) -> List[int]:
+        """Sorted file IDs of every indexed file, used to negate queries"""
+        raise NotImplementedError
+
+    def field_postings(self, field: str, words: List[str]) -> List[int]:
+        """Sorted file IDs of files with the words consecutively in one field
+        of their structured document, see `src.documents`
+        """
+        raise QueryError(f"Searching the {field} field is not supported")
+
+
+def gallop(seq: Sequence[int], target: int, low: int = 0) -> int:
+    """Find the first index at or after `low` whose value is not less than
+    target, by doubling steps from `low` and then bisecting
+    """
+    bound = 1
+    while low + bound < len(seq) and seq[low + bound] < target:
+        bound *= 2
+    return bisect_left(seq, target, low, min(low + bound + 1, len(seq)))
+
+
+def intersect(a: Sequence[int], b: Sequence[int]) -> List[int]:
+    """Intersect two sorted posting lists, galloping through the longer one"""
+    if len(a) > len(b):
+        a, b = b, a
+    result: List[int] = []
+    low = 0
+    for file_id in a:
+        low = gallop(b, file_id, low)
+        if low == len(b):
+            break
+        if b[low] == file_id and (not result or result[-1] != file_id):
+            result.append(file_id)
+    return result
+
+
+def difference(a: Sequence[int], b: Sequence[int]) -> List[int]:
+    """File IDs in sorted list `a` which are not in sorted list `b`"""
+    result: List[int] = []
+    low = 0
+    for file_id in a:
+        low = gallop(b, file_id, low)
+        if low == len(b) or b[low] != file_id:
+            result.append(file_id)
+    return result
+
+
+def tokenize_query(query: str) -> List[Token]:
+    """Split a query into (<kind>, <value>) tokens, normalizing words in
+    the same way as the index
+    """
+    tokens: List[Token] = []
+    for match in TOKEN_PATTERN.finditer(query):
+        field, phrase, word, paren = match.group("field", "phrase", "word", "paren")
+        if paren:
+            tokens.append(("paren", paren))
+        elif field:
+            words = tokenize(word if phrase is None else phrase)
+            if words:
+                tokens.append(("field", (field, words)))
+        elif word in OPERATORS:
+            tokens.append(("op", word))
+        elif word:
+            normalized = tokenize(word)
+            if normalized:
+                tokens.append(("term", normalized[0]))
+        else:
+            words = tokenize(phrase or "")
+            if words:
+                tokens.append(("phrase", words))
+    return tokens
+
+
+def parse_query(query: str) -> Node:
+    """Parse a query string into a syntax tree.
+
+    Grammar, AND binds tighter than OR:
+        or_expr  := and_expr ("OR" and_expr)*
+        and_expr := not_expr (["AND"] not_expr)*
+        not_expr := "NOT" not_expr | atom
+        atom     := "(" or_expr ")" | phrase | term | field
+    """
+    tokens = tokenize_query(query)
+    if not tokens:
+        raise QueryError(f"Empty query: '{query}'")
+    pos = 0
+
+    def peek() -> Token:
+        return tokens[pos] if pos < len(tokens) else ("end", "")
+
+    def advance() -> Token:
+        nonlocal pos
+        token = peek()
+        pos += 1
+        return token
+
+    def or_expr() -> Node:
+        node = and_expr()
+        while peek() == ("op", "OR"):
+            advance()
+            node = ("or", node, and_expr())
+        return node
+
+    def and_expr() -> Node:
+        node = not_expr()
+        while peek()[0] in ("term", "phrase", "field") or peek() in (
+            ("op", "AND"),
+            ("op", "NOT"),
+            ("paren", "("),
+        ):
+            if peek() == ("op", "AND"):
+                advance()
+            node = ("and", node, not_expr())
+        return node
+
+    def not_expr() -> Node:
+        if peek() == ("op", "NOT"):
+            advance()
+            return ("not", not_expr())
+        return atom()
+
+    def atom() -> Node:
+        kind, value = advance()
+        if (kind, value) == ("paren", "("):
+            node = or_expr()
+            if advance() != ("paren", ")"):
+                raise QueryError(f"Unbalanced parentheses in query: '{query}'")
+            return node
+        if kind == "term":
+            return ("term", value)
+        if kind == "phrase":
+            return ("phrase", value)
+        if kind == "field":
+            field, words = value
+            return ("field", field, words)
+        raise QueryError(f"Unexpected '{value}' in query: '{query}'")
+
+    node = or_expr()
+    if pos != len(tokens):
+        raise QueryError(f"Unexpected '{peek()[1]}' in query: '{query}'")
+    return node
+
+
+def phrase_file_ids(words: List[str], index: Searchable) -> List[int]:
+    """File IDs containing the words consecutively. Without positions in the
+    index, falls back to files containing all of the words.
+    """
+    candidates = index.postings(words[0])
+    for word in words[1:]:
+        candidates = intersect(candidates, index.postings(word))
+    if len(words) == 1 or not candidates:
+        return candidates
+
+    word_positions = [index.positions(word) for word in words]
+    if not all(word_positions):
+        return candidates
+
+    matches = []
+    for file_id in candidates:
+        later = [set(positions.get(file_id, ())) for positions in word_positions[1:]]
+        for start in word_positions[0].get(file_id, ()):
+            if all(
+                start + offset in later[offset - 1] for offset in range(1, len(words))
+            ):
+                matches.append(file_id)
+                break
+    return matches
+
+
+def evaluate(node: Node, index: Searchable) -> List[int]:
+    """Evaluate a query syntax tree to a sorted list of file IDs"""
+    kind = node[0]
+    if kind == "term":
+        return index.postings(node[1])
+    if kind == "phrase":
+        return phrase_file_ids(node[1], index)
+    if kind == "field":
+        return index.field_postings(node[1], node[2])
+    if kind == "or":
+        return merge_postings(evaluate(node[1], index), evaluate(node[2], index))
+    if kind == "not":
+        return difference(index.all_file_ids(), evaluate(node[1], index))
+    if kind == "and":
+        left, right = node[1], node[2]
+        # Avoid materializing every file ID for `a NOT b`
+        if right[0] == "not":
+            return difference(evaluate(left, index), evaluate(right[1], index))
+        if left[0] == "not":
+            return difference(evaluate(right, index), evaluate(left[1], index))
+        return intersect(evaluate(left, index), evaluate(right, index))
+    raise QueryError(f"Unknown query node: {kind}")
+
+
+def search(query: str, index: Searchable) -> List[int]:
+    """Parse and evaluate a query, returning sorted matching file IDs"""
+    return evaluate(parse_query(query), index)
@@ -0,0 +1,106 @@
+"""Quote_cache.py contains an in-process cache of quote bodies in front of
+`Handler.load_quote`.
+
+Quotes are small and never change once written, so they can be cached by
+file ID without invalidation. The cache is bounded by the total size of the
+cached quotes in bytes and evicts the least recently used quotes first.
+"""
+
+from itertools import groupby
+from threading import Lock
+from typing import Dict, Optional, Union
+import logging
+
+from cachetools import LRUCache
+
+from src.handler import Handler
+
+logger = logging.getLogger(__name__)
+
+
+def quote_size(quote: str) -> int:
+    """Size of a cached quote in bytes"""
+    return len(quote.encode())
+
+
+class QuoteCache:
+    """Byte-size bounded LRU cache of quote bodies keyed by file ID"""
+
+    def __init__(self, handler: Handler, maxsize: int = 32 * 1024 * 1024):
+        """
+        Args:
+            handler: handler quotes are loaded from on a miss
+            maxsize: maximum total size of cached quotes in bytes
+        """
+        self.handler = handler
+        self.cache: LRUCache = LRUCache(maxsize=maxsize, getsizeof=quote_size)
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+    def get(self, file_id: Union[int, str]) -> str:
+        """Get a quote by file ID, loading it from the handler on a miss"""
+        quote = self.lookup(file_id)
+        if quote is None:
+            quote = self.load(file_id)
+        return quote
+
+    def lookup(self, file_id: Union[int, str]) -> Optional[str]:
+        """Get a quote by file ID if it is cached, without blocking on a load"""
+        with self.lock:
+            quote = self.cache.get(int(file_id))
+            if quote is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return quote
+
+    def load(self, file_id: Union[int, str]) -> str:
+        """Load a quote from the handler and cache it"""
+        # Load outside the lock so one slow load does not block other readers
+        quote = self.handler.load_quote(int(file_id))
+        if quote:
+            self.put(int(file_id), quote)
+        return quote
+
+    def put(self, file_id: int, quote: str):
+        with self.lock:
+            try:
+                self.cache[file_id] = quote
+            except ValueError:
+                logger.debug(f"Quote {file_id} is larger than the whole cache")
+
+    def preload(self) -> int:
+        """Fetch every quote in one pass over the handler and cache as many
+        as fit, rather than paying a round trip for each on first request.
+
+        Returns:
+            number of quotes loaded
+        """
+        loaded = 0
+        pairs = self.handler.iterate_text_pairs()
+        for file_id, lines in groupby(pairs, key=lambda pair: pair[0]):
+            # S3 serves lines as bytes
+            quote = "\n".join(
+                line.decode() if isinstance(line, bytes) else line for _, line in lines
+            )
+            self.put(file_id, quote)
+            loaded += 1
+        logger.info(f"Preloaded {loaded} quotes, {len(self)} fit in the cache")
+        return loaded
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """Hit and miss counters along with the current size of the cache"""
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / requests if requests else 0.0,
+                "quotes": len(self.cache),
+                "bytes": self.cache.currsize,
+                "maxsize": self.cache.maxsize,
+            }
@@ -0,0 +1,156 @@
+"""Ranking.py contains relevance ranking of query matches with BM25.
+
+The score of a matching file is summed over the words of the query, other
+than negated words, as
+```
+idf(word) * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / average_length))
+```
+where tf is the number of times the word occurs in the file. Only files
+matching the query are scored, and the top k are selected with a heap rather
+than sorting every match, as common words match most of the corpus.
+"""
+
+from abc import abstractmethod
+from bisect import bisect_right
+from heapq import nlargest
+from typing import List, Sequence, Tuple
+import math
+
+from src.query import Node, Searchable, evaluate, gallop, parse_query
+
+K1 = 1.2
+B = 0.75
+
+
+class Rankable(Searchable):
+    """Interface for the statistics a query is ranked with"""
+
+    @abstractmethod
+    def term_frequencies(self, word: str, file_ids: Sequence[int]) -> List[int]:
+        """Number of occurrences of a word in each of the sorted file IDs"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def document_length(self, file_id: int) -> int:
+        """Number of words in a file"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def document_count(self) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def average_document_length(self) -> float:
+        raise NotImplementedError
+
+
+def count_occurrences(occurrences: Sequence[int], file_ids: Sequence[int]) -> List[int]:
+    """Count each of the sorted file IDs in a sorted list which repeats a file
+    ID once per occurrence, galloping rather than scanning the whole list
+    """
+    counts = []
+    low = 0
+    for file_id in file_ids:
+        low = gallop(occurrences, file_id, low)
+        high = bisect_right(occurrences, file_id, low)
+        counts.append(high - low)
+        low = high
+    return counts
+
+
+def lookup_frequencies(
+    postings: Sequence[int], frequencies: Sequence[int], file_ids: Sequence[int]
+) -> List[int]:
+    """Frequency of each of the sorted file IDs from distinct sorted postings
+    and their frequencies, 0 for file IDs not in the postings
+    """
+    counts = []
+    low = 0
+    for file_id in file_ids:
+        low = gallop(postings, file_id, low)
+        found = low < len(postings) and postings[low] == file_id
+        counts.append(frequencies[low] if found else 0)
+    return counts
+
+
+def query_terms(node: Node) -> List[str]:
+    """Words a query matches on, leaving out negated words"""
+    kind = node[0]
+    if kind == "term":
+        return [node[1]]
+    if kind == "phrase":
+        return list(node[1])
+    if kind == "field":
+        # Every field is in the main index too, so the words still score
+        return list(node[2])
+    if kind == "not":
+        return []
+    terms = query_terms(node[1]) + query_terms(node[2])
+    # Keep the first occurrence of each word
+    return list(dict.fromkeys(terms))
+
+
+def idf(n_documents: int, document_frequency: int) -> float:
+    """Inverse document frequency, never negative even for words in more than
+    half of the documents
+    """
+    return math.log(
+        1 + (n_documents - document_frequency + 0.5) / (document_frequency + 0.5)
+    )
+
+
+def bm25_scores(
+    words: List[str], file_ids: Sequence[int], index: Rankable
+) -> List[float]:
+    """BM25 score of each of the sorted file IDs for the given words"""
+    average_length = index.average_document_length() or 1.0
+    norms = [
+        K1 * (1 - B + B * index.document_length(file_id) / average_length)
+        for file_id in file_ids
+    ]
+    n_documents = index.document_count()
+    scores = [0.0] * len(file_ids)
+    for word in words:
+        document_frequency = len(index.postings(word))
+        if not document_frequency:
+            continue
+        weight = idf(n_documents, document_frequency)
+        term_frequencies = index.term_frequencies(word, file_ids)
+        for pos, tf in enumerate(term_frequencies):
+            if tf:
+                scores[pos] += weight * tf * (K1 + 1) / (tf + norms[pos])
+    return scores
+
+
+def rank(
+    query: str, index: Rankable, k: int = 10, offset: int = 0
+) -> Tuple[int, List[Tuple[int, float]]]:
+    """Evaluate a query and rank its matches by BM25.
+
+    Args:
+        query: query, see `src.query` for the syntax
+        index: index to evaluate and rank against
+        k: number of matches to return
+        offset: number of higher ranked matches to skip, for pagination
+
+    Returns:
+        tuple of (<number-of-matches>, <(file-id, score) pairs, best first>)
+
+    Raises:
+        QueryError: if the query cannot be parsed
+    """
+    node = parse_query(query)
+    file_ids = evaluate(node, index)
+    return len(file_ids), rank_matches(node, file_ids, index, k, offset)
+
+
+def rank_matches(
+    node: Node, file_ids: Sequence[int], index: Rankable, k: int = 10, offset: int = 0
+) -> List[Tuple[int, float]]:
+    """Rank the sorted file IDs matching an evaluated query, see `rank`"""
+    scores = bm25_scores(query_terms(node), file_ids, index)
+    # Ties go to the lower file ID
+    top = nlargest(
+        offset + k, zip(file_ids, scores), key=lambda pair: (pair[1], -pair[0])
+    )
+    return top[offset:]
@@ -0,0 +1,85 @@
+"""Reload.py contains a background refresher which swaps in a new index
+snapshot without restarting the process.
+
+A snapshot is versioned by the `version` in the handler's manifest. The
+refresher polls the manifest and, when its version changes, loads the new
+snapshot from that same manifest off the request path, so the version
+recorded always describes the snapshot loaded. It then replaces the current
+snapshot with a single reference assignment. Requests which read `current` once therefore keep a consistent
+view of a single snapshot, even if a reload completes while they run.
+"""
+
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, Generic, Optional, TypeVar
+import logging
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Reloader(Generic[T]):
+    """Hold the current snapshot and replace it when its version changes"""
+
+    def __init__(
+        self,
+        load: Callable[[Dict], T],
+        load_manifest: Callable[[], Dict],
+        version: Callable[[Dict], Optional[str]],
+    ):
+        """
+        Args:
+            load: function loading the full snapshot a manifest describes
+            load_manifest: cheap function returning the latest manifest
+            version: function returning the version of a manifest, None if
+                it cannot tell
+        """
+        self.load = load
+        self.load_manifest = load_manifest
+        self.version_of = version
+        # Only one reload at a time, readers never take the lock
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread: Optional[Thread] = None
+        manifest = self.load_manifest()
+        self.version = self.version_of(manifest)
+        self.current: T = self.load(manifest)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Load and swap in the latest snapshot if its version has changed,
+        or unconditionally if forced.
+
+        Returns:
+            whether a new snapshot was swapped in
+        """
+        with self.lock:
+            manifest = self.load_manifest()
+            version = self.version_of(manifest)
+            if not force and (version is None or version == self.version):
+                return False
+            snapshot = self.load(manifest)
+            self.current, self.version = snapshot, version
+        logger.info(f"Reloaded index snapshot, version: {version}")
+        return True
+
+    def poll(self, interval: float):
+        while not self.stopped.wait(interval):
+            try:
+                self.refresh()
+            except Exception:
+                # Keep serving the current snapshot and try again next time
+                logger.error("Failed to reload index snapshot", exc_info=True)
+
+    def start(self, interval: float):
+        """Poll for a new snapshot every `interval` seconds on a daemon thread"""
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = Thread(target=self.poll, args=(interval,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,129 @@
+"""Response_cache.py contains a cache of parsed quotes and rendered pages, so
+the work of serving a popular quote is done once per index version rather
+than on every request.
+
+Entries are evicted least recently used beyond `maxsize` or after `ttl`
+seconds, and all at once when the index version changes. Pages carry an
+ETag derived from their content, so clients and CDNs can revalidate rather
+than download them again.
+
+`RandomPool` keeps a few values per index version to pick from at random,
+so error pages can show a random quote without loading one from storage. One
+in every `refresh_every` samples of a full pool is a miss, whose fresh value
+replaces a random slot, so a pool smaller than the corpus still cycles through
+all of it.
+"""
+
+from random import choice, randrange
+from threading import Lock
+from typing import Any, Hashable, List, NamedTuple, Optional
+import hashlib
+
+from src.metrics import CountedTTLCache
+
+
+class Rendered(NamedTuple):
+    body: str
+    etag: str
+
+
+def make_etag(body: str) -> str:
+    """Strong ETag of a response body"""
+    return '"' + hashlib.blake2b(body.encode(), digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether an If-None-Match header matches an ETag, weakly as RFC 7232
+    requires for GET requests
+    """
+    if if_none_match.strip() == "*":
+        return True
+    tags = (strip_weak(tag.strip()) for tag in if_none_match.split(","))
+    return strip_weak(etag) in tags
+
+
+def strip_weak(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+class ResponseCache:
+    """LRU and TTL bounded cache of values for a single index version"""
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 60 * 60):
+        self.cache = CountedTTLCache("responses", maxsize=maxsize, ttl=ttl)
+        self.lock = Lock()
+        self.version: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+    def check_version(self, version: Optional[str]):
+        # Called under the lock. Keys include the version too, so a request
+        # still using the previous version cannot mix values across versions
+        if version != self.version:
+            self.cache.clear()
+            self.version = version
+
+    def get(self, version: Optional[str], key: Hashable) -> Any:
+        """Get a value cached for an index version, None if there is none"""
+        with self.lock:
+            self.check_version(version)
+            try:
+                return self.cache[version, key]
+            except KeyError:
+                return None
+
+    def put(self, version: Optional[str], key: Hashable, value: Any):
+        """Cache a value computed against an index version"""
+        with self.lock:
+            self.check_version(version)
+            self.cache[version, key] = value
+
+
+class RandomPool:
+    """Up to `maxsize` values for a single index version, to sample from once
+    the pool is full, rotating one value in every `refresh_every` samples
+    """
+
+    def __init__(self, maxsize: int = 32, refresh_every: int = 4):
+        self.maxsize = maxsize
+        self.refresh_every = refresh_every
+        self.values: List[Any] = []
+        self.samples = 0
+        self.lock = Lock()
+        self.version: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def check_version(self, version: Optional[str]):
+        # Called under the lock
+        if version != self.version:
+            self.values = []
+            self.samples = 0
+            self.version = version
+
+    def sample(self, version: Optional[str]) -> Any:
+        """A random value of an index version, None until the pool is full
+        and then once every `refresh_every` samples, for the caller to `add`
+        a fresh value
+        """
+        with self.lock:
+            self.check_version(version)
+            if len(self.values) < self.maxsize:
+                return None
+            self.samples += 1
+            if self.refresh_every and self.samples % self.refresh_every == 0:
+                return None
+            return choice(self.values)
+
+    def add(self, version: Optional[str], value: Any):
+        """Add a value computed against an index version, replacing a random
+        one once the pool is full
+        """
+        with self.lock:
+            self.check_version(version)
+            if len(self.values) < self.maxsize:
+                self.values.append(value)
+            elif self.maxsize:
+                self.values[randrange(self.maxsize)] = value
@@ -0,0 +1,156 @@
+"""Shards.py contains a term partitioned form of the binary index, for
+corpora whose index outgrows what each API worker should hold.
+
+Words are assigned to shards by word ID, which are dense and stable across
+rebuilds (see `src.terms`), so `word_id % n_shards` spreads them evenly.
+A snapshot written with shards has, in place of a single binary index:
+
+    terms      binary index of every term with its document frequency but no
+               postings, for word ID lookups and suggestions
+    shard-<n>  binary index of the postings and positions of each shard's words
+
+The API maps the small terms index up front and each shard only when a
+query first needs one of its words, so cold start and memory follow the
+shards queries actually use.
+"""
+
+from collections.abc import Mapping
+from threading import Lock
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+try:
+    from src.binary_index import BinaryIndex, encode_index
+except ImportError:  # Flat layout when deployed as a Lambda function
+    from binary_index import BinaryIndex, encode_index
+
+TERMS_PREFIX = "terms"
+
+
+def shard_prefix(shard: int) -> str:
+    """Snapshot prefix of a shard"""
+    return f"shard-{shard}"
+
+
+def shard_of(word_id: Union[int, str], n_shards: int) -> int:
+    return int(word_id) % n_shards
+
+
+def split_index(
+    inverted_index: Mapping,
+    word_id_map: Mapping,
+    positional_index: Optional[Mapping],
+    n_shards: int,
+) -> List[Tuple[Dict, Dict, Optional[Dict]]]:
+    """Split an index into the (<inverted-index>, <word-id-map>,
+    <positional-index>) of each shard. Keys are kept as given, integers or
+    JSON strings.
+    """
+    shards: List[Tuple[Dict, Dict, Optional[Dict]]] = [
+        ({}, {}, None if positional_index is None else {}) for _ in range(n_shards)
+    ]
+    for word_id, file_ids in inverted_index.items():
+        shards[shard_of(word_id, n_shards)][0][word_id] = file_ids
+    for word, word_id in word_id_map.items():
+        shards[shard_of(word_id, n_shards)][1][word] = word_id
+    for word_id, file_positions in (positional_index or {}).items():
+        shards[shard_of(word_id, n_shards)][2][word_id] = file_positions
+    return shards
+
+
+def encode_shards(
+    inverted_index: Mapping,
+    word_id_map: Mapping,
+    positional_index: Optional[Mapping],
+    n_shards: int,
+) -> Tuple[bytes, List[bytes]]:
+    """Serialize an index as a terms index and a binary index per shard"""
+    terms = encode_index(inverted_index, word_id_map, with_postings=False)
+    shards = [
+        encode_index(*shard)
+        for shard in split_index(
+            inverted_index, word_id_map, positional_index, n_shards
+        )
+    ]
+    return terms, shards
+
+
+class ShardedIndex:
+    """Term partitioned index whose shards are loaded on first use"""
+
+    def __init__(
+        self,
+        terms: BinaryIndex,
+        n_shards: int,
+        load_shard: Callable[[int], Optional[BinaryIndex]],
+    ):
+        """
+        Args:
+            terms: terms index of the snapshot
+            n_shards: number of shards the snapshot was written with
+            load_shard: load the binary index of a shard, None if missing
+        """
+        self.terms = terms
+        self.n_shards = n_shards
+        self.load_shard = load_shard
+        self.shards: Dict[int, Optional[BinaryIndex]] = {}
+        # A lock per shard, so loading one shard does not hold up the others
+        self.locks = [Lock() for _ in range(n_shards)]
+
+    def shard(self, word_id: Union[int, str]) -> Optional[BinaryIndex]:
+        """Binary index of the shard holding a word ID, loading it if needed"""
+        ind = shard_of(word_id, self.n_shards)
+        if ind not in self.shards:
+            with self.locks[ind]:
+                if ind not in self.shards:
+                    self.shards[ind] = self.load_shard(ind)
+        return self.shards[ind]
+
+    @property
+    def loaded(self) -> int:
+        return len(self.shards)
+
+    def postings_map(self) -> "ShardedPostingsMap":
+        return ShardedPostingsMap(self)
+
+    def positions_map(self) -> "ShardedPositionsMap":
+        return ShardedPositionsMap(self)
+
+
+class ShardedPostingsMap(Mapping):
+    """Dictionary-like view of word IDs to file IDs over a sharded index,
+    as `src.binary_index.PostingsMap`
+    """
+
+    def __init__(self, index: ShardedIndex):
+        self.index = index
+
+    def view(self, shard: BinaryIndex) -> Mapping:
+        return shard.postings_map()
+
+    def _shard_map(self, word_id: Union[int, str]) -> Mapping:
+        shard = self.index.shard(word_id)
+        if shard is None:
+            raise KeyError(word_id)
+        return self.view(shard)
+
+    def __getitem__(self, word_id: Union[int, str]) -> List[int]:
+        return self._shard_map(word_id)[word_id]
+
+    def entry(self, word_id: Union[int, str]) -> Tuple[List[int], List[int]]:
+        return self._shard_map(word_id).entry(word_id)
+
+    def __iter__(self) -> Iterator[int]:
+        # Every term is in the terms index, iterating loads no shards
+        return iter(self.index.terms.postings_map())
+
+    def __len__(self) -> int:
+        return len(self.index.terms)
+
+
+class ShardedPositionsMap(ShardedPostingsMap):
+    """Dictionary-like view of word IDs to file IDs and word positions over a
+    sharded index, as `src.binary_index.PositionsMap`
+    """
+
+    def view(self, shard: BinaryIndex) -> Mapping:
+        return shard.positions_map()
@@ -0,0 +1,419 @@
+"""Streaming.py contains a bounded-memory index build, for rebuilding corpora
+too large to index in memory, such as inside a fixed Lambda memory size.
+
+Word positions are accumulated per word until an estimate of their size
+reaches a memory budget, then spilled to a temporary file as a run sorted by
+term. Runs are k-way merged term by term, in the order of the binary index's
+term dictionary, and every object of a snapshot is written as the merge goes:
+
+    index, positions  JSON objects, written entry by entry
+    binary index      posting and position blobs written to temporary files,
+                      then copied in behind the section table, or with shards
+                      a terms index and a binary index per shard, each written
+                      the same way, see `src.shards`
+    documents         written with `src.documents.DocumentWriter`
+
+What stays in memory grows with the vocabulary and the number of quotes,
+for the word IDs, term dictionary, offsets and document lengths, rather than
+with the size of the corpus. Finished files are handed to
+`Handler.write_file`, which uploads them to S3 in multipart chunks.
+"""
+
+from array import array
+from datetime import datetime
+from heapq import merge
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple, Union
+import json
+import logging
+import mmap
+import tempfile
+
+try:
+    from src.binary_index import (
+        WIDX_ENTRY,
+        decode_varint,
+        encode_positions,
+        encode_postings,
+        encode_varint,
+        read_positions,
+        write_sections,
+    )
+    from src.bloom import encode_filter
+    from src.deletions import encode_deletions
+    from src.documents import DocumentWriter, parse_quote
+    from src.handler import Handler
+    from src.incremental import load_term_dictionary
+    from src.index import BUILD_PHASE_SECONDS, WordLinePair, decode_line
+    from src.shards import TERMS_PREFIX, shard_of, shard_prefix
+    from src.tokenizer import tokenize
+except ImportError:  # Flat layout when deployed as a Lambda function
+    from binary_index import (
+        WIDX_ENTRY,
+        decode_varint,
+        encode_positions,
+        encode_postings,
+        encode_varint,
+        read_positions,
+        write_sections,
+    )
+    from bloom import encode_filter
+    from deletions import encode_deletions
+    from documents import DocumentWriter, parse_quote
+    from handler import Handler
+    from incremental import load_term_dictionary
+    from index import BUILD_PHASE_SECONDS, WordLinePair, decode_line
+    from shards import TERMS_PREFIX, shard_of, shard_prefix
+    from tokenizer import tokenize
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_BUDGET = 64 * 2**20
+# Estimated cost of a word's entry in a run, and of each (file ID, position)
+# pair held in its array
+WORD_BYTES = 200
+PAIR_BYTES = 8
+
+FilePositions = Dict[int, List[int]]
+# Words with the (<file-id>, <position>) pairs of each, flattened
+Run = Dict[str, array]
+
+
+def group_positions(pairs: array) -> FilePositions:
+    """Group flattened (<file-id>, <position>) pairs by file ID"""
+    file_positions: FilePositions = {}
+    for ind in range(0, len(pairs), 2):
+        file_positions.setdefault(pairs[ind], []).append(pairs[ind + 1])
+    return file_positions
+
+
+def spill_run(run: Run, path: Path):
+    """Write a run sorted by term, each term followed by its encoded positions"""
+    with path.open("wb") as f:
+        for word in sorted(run):
+            term = word.encode()
+            f.write(encode_varint(len(term)) + term)
+            f.write(encode_positions(group_positions(run[word])))
+
+
+def iterate_run(path: Path) -> Iterator[Tuple[str, FilePositions]]:
+    """Read back a run written by `spill_run`, in term order"""
+    with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        pos = 0
+        while pos < len(buf):
+            length, pos = decode_varint(buf, pos)
+            word = buf[pos : pos + length].decode()
+            file_positions, pos = read_positions(buf, pos + length)
+            yield word, file_positions
+
+
+def merge_runs(paths: List[Path]) -> Iterator[Tuple[str, FilePositions]]:
+    """K-way merge runs into the positions of every word, in term order"""
+    runs = [
+        ((word, ind, file_positions) for word, file_positions in iterate_run(path))
+        for ind, path in enumerate(paths)
+    ]
+    # A word is at most once per run, so the run index breaks every tie
+    for word, entries in groupby(merge(*runs, key=itemgetter(0, 1)), itemgetter(0)):
+        file_positions: FilePositions = {}
+        for _, _, run_positions in entries:
+            file_positions.update(run_positions)
+        # Quotes are not always read in file ID order
+        yield word, dict(sorted(file_positions.items()))
+
+
+def spill_runs(
+    file_line_it: Iterator[WordLinePair],
+    directory: Path,
+    memory_budget: int,
+    lengths: Dict[int, int],
+    documents: Optional[DocumentWriter] = None,
+) -> List[Path]:
+    """Accumulate word positions from (<file-id>, <line-from-file>) pairs,
+    spilling a run whenever their estimated size reaches the memory budget.
+
+    Positions are counted as in `src.index.create_positional_index`. Runs
+    are keyed by word, IDs are assigned as they are merged.
+
+    Returns:
+        paths of the runs, in the order they were spilled
+    """
+    paths: List[Path] = []
+    run: Run = {}
+    run_bytes = 0
+
+    def spill():
+        nonlocal run, run_bytes
+        path = Path(directory) / f"run-{len(paths)}"
+        with BUILD_PHASE_SECONDS.time(phase="spill"):
+            spill_run(run, path)
+        paths.append(path)
+        run, run_bytes = {}, 0
+
+    for file_id, pairs in groupby(file_line_it, key=itemgetter(0)):
+        lines = [decode_line(line) for _, line in pairs]
+        if documents is not None:
+            documents.add(file_id, parse_quote("\n".join(lines)))
+        position = 0
+        n_words = 0
+        for line in lines:
+            for word in tokenize(line):
+                pairs_array = run.get(word)
+                if pairs_array is None:
+                    pairs_array = run[word] = array("I")
+                    run_bytes += WORD_BYTES
+                pairs_array.extend((file_id, position))
+                run_bytes += PAIR_BYTES
+                position += 1
+                n_words += 1
+            position += 1
+        lengths[file_id] = lengths.get(file_id, 0) + n_words
+        # Spill between files, so the positions of a file are in one run
+        if run_bytes >= memory_budget:
+            spill()
+    if run:
+        spill()
+    return paths
+
+
+class JSONObjectWriter:
+    """Write a JSON object to a file one entry at a time"""
+
+    def __init__(self, f: IO[str]):
+        self.f = f
+        self.f.write("{")
+        self.empty = True
+
+    def write(self, key: str, value: Any):
+        if not self.empty:
+            self.f.write(", ")
+        self.f.write(json.dumps(key) + ": " + json.dumps(value))
+        self.empty = False
+
+    def close(self):
+        self.f.write("}")
+        self.f.close()
+
+
+class BinaryIndexWriter:
+    """Write a binary index from words given in term order, see
+    `src.binary_index` for the layout
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        prefix: str,
+        with_postings: bool = True,
+        with_positions: bool = True,
+        with_deletions: bool = False,
+    ):
+        """
+        Args:
+            directory: where to write the index and its blobs until finished
+            prefix: snapshot prefix of the index, naming its files
+            with_postings, with_deletions: as for `encode_index`
+            with_positions: write the positions of every word
+        """
+        self.path = Path(directory) / f"{prefix}.qidx"
+        self.with_postings = with_postings
+        self.with_positions = with_positions
+        self.with_deletions = with_deletions
+        self.postings_path = Path(directory) / f"{prefix}.PBLB"
+        self.positions_path = Path(directory) / f"{prefix}.XBLB"
+        self.postings_blob = self.postings_path.open("wb")
+        self.positions_blob = self.positions_path.open("wb")
+        self.term_offsets = array("I", [0])
+        self.term_blob = bytearray()
+        self.term_ids = array("I")
+        self.term_frequencies = array("I")
+        self.postings_offsets = array("Q", [0])
+        self.positions_offsets = array("Q", [0])
+
+    def add(
+        self,
+        word: str,
+        word_id: int,
+        occurrences: List[int],
+        file_positions: FilePositions,
+    ):
+        """Add the postings and positions of the next word in term order"""
+        self.term_blob += word.encode()
+        self.term_offsets.append(len(self.term_blob))
+        self.term_ids.append(word_id)
+        self.term_frequencies.append(len(file_positions))
+        postings = encode_postings(occurrences if self.with_postings else [])
+        self.postings_blob.write(postings)
+        self.postings_offsets.append(self.postings_offsets[-1] + len(postings))
+        if self.with_positions:
+            positions = encode_positions(file_positions)
+            self.positions_blob.write(positions)
+            self.positions_offsets.append(self.positions_offsets[-1] + len(positions))
+
+    def terms(self) -> List[str]:
+        """Every term added so far, in term order"""
+        offsets = self.term_offsets
+        return [
+            self.term_blob[offsets[pos] : offsets[pos + 1]].decode()
+            for pos in range(len(offsets) - 1)
+        ]
+
+    def finish(self) -> Path:
+        """Close the blobs and write the binary index, returning its path"""
+        self.postings_blob.close()
+        self.positions_blob.close()
+
+        id_positions = sorted(
+            (word_id, pos) for pos, word_id in enumerate(self.term_ids)
+        )
+        # Sections in the same order as `encode_index`
+        sections: Dict[bytes, Union[bytes, Path]] = {
+            b"TOFF": self.term_offsets.tobytes(),
+            b"TBLB": bytes(self.term_blob),
+            b"TIDS": self.term_ids.tobytes(),
+            b"POFF": self.postings_offsets.tobytes(),
+            b"PBLB": self.postings_path,
+            b"WIDX": b"".join(WIDX_ENTRY.pack(*entry) for entry in id_positions),
+            b"TDFQ": self.term_frequencies.tobytes(),
+        }
+        if self.with_positions:
+            sections[b"XOFF"] = self.positions_offsets.tobytes()
+            sections[b"XBLB"] = self.positions_path
+        if self.with_deletions:
+            sections[b"FDEL"] = encode_deletions(self.terms())
+        write_sections(self.path, sections)
+        return self.path
+
+
+class SnapshotWriter:
+    """Write the JSON index, JSON positions and binary index of a snapshot
+    from words given in term order. With shards, the binary index is written
+    as a terms index and a binary index per shard, as `encode_shards` would
+    """
+
+    def __init__(self, directory: Path, shards: int = 1):
+        self.directory = Path(directory)
+        self.shards = shards
+        self.index = JSONObjectWriter((self.directory / "index.json").open("w"))
+        self.positions = JSONObjectWriter((self.directory / "positions.json").open("w"))
+        self.binary_indexes: Dict[str, BinaryIndexWriter] = {}
+        if shards > 1:
+            self.binary_indexes[TERMS_PREFIX] = BinaryIndexWriter(
+                self.directory, TERMS_PREFIX, with_postings=False, with_positions=False
+            )
+            for shard in range(shards):
+                prefix = shard_prefix(shard)
+                self.binary_indexes[prefix] = BinaryIndexWriter(self.directory, prefix)
+        else:
+            self.binary_indexes["binary-index"] = BinaryIndexWriter(
+                self.directory, "binary-index"
+            )
+
+    def add(self, word: str, word_id: int, file_positions: FilePositions):
+        """Add the positions of the next word in term order"""
+        occurrences = [
+            file_id for file_id, positions in file_positions.items() for _ in positions
+        ]
+        self.index.write(str(word_id), occurrences)
+        self.positions.write(str(word_id), file_positions)
+        if self.shards > 1:
+            self.binary_indexes[TERMS_PREFIX].add(
+                word, word_id, occurrences, file_positions
+            )
+            prefix = shard_prefix(shard_of(word_id, self.shards))
+        else:
+            prefix = "binary-index"
+        self.binary_indexes[prefix].add(word, word_id, occurrences, file_positions)
+
+    def finish(self) -> Dict[str, Path]:
+        """Close every file and write the binary indexes.
+
+        Returns:
+            mapping of snapshot prefixes to the files written for them
+        """
+        self.index.close()
+        self.positions.close()
+        files = {
+            "index": self.directory / "index.json",
+            "positions": self.directory / "positions.json",
+        }
+        for prefix, writer in self.binary_indexes.items():
+            files[prefix] = writer.finish()
+        return files
+
+
+def write_json(path: Path, obj: Any) -> Path:
+    with path.open("w") as f:
+        json.dump(obj, f)
+    return path
+
+
+def create_snapshot_streaming(
+    handler: Handler,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+    word_id_map: Optional[Dict] = None,
+    directory: Optional[Path] = None,
+    shards: int = 1,
+) -> Dict:
+    """Rebuild the whole index from the quotes of a handler and write it as a
+    new snapshot, with memory use bounded by a budget rather than by the size
+    of the corpus. Writes the same objects as `Handler.write_snapshot`.
+
+    Args:
+        handler: handler to read quotes from and write the snapshot to
+        memory_budget: approximate bytes of word positions held before
+            spilling a run to temporary storage
+        word_id_map: mapping which assigns word IDs on lookup, defaults to
+            the term dictionary of the latest snapshot, see `src.terms`
+        directory: where to keep runs and files until they are written,
+            defaults to the system temporary directory
+        shards: number of shards to split the binary index into, see
+            `src.shards`
+
+    Returns:
+        the manifest of the new snapshot
+    """
+    if word_id_map is None:
+        word_id_map = load_term_dictionary(handler)
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        tmp_path = Path(tmp)
+        lengths: Dict[int, int] = {}
+        documents = DocumentWriter(tmp_path)
+        with BUILD_PHASE_SECONDS.time(phase="tokenize"):
+            runs = spill_runs(
+                handler.iterate_text_pairs(),
+                tmp_path,
+                memory_budget,
+                lengths,
+                documents,
+            )
+        logger.info(
+            f"Indexed {len(lengths)} files into {len(runs)} runs "
+            f"with a budget of {memory_budget} bytes"
+        )
+
+        with BUILD_PHASE_SECONDS.time(phase="merge"):
+            writer = SnapshotWriter(tmp_path, shards)
+            for word, file_positions in merge_runs(runs):
+                writer.add(word, word_id_map[word], file_positions)
+            files = writer.finish()
+            for run in runs:
+                run.unlink()
+            files["word-ids"] = write_json(tmp_path / "word-ids.json", word_id_map)
+            files["vocabulary"] = tmp_path / "vocabulary.qblm"
+            files["vocabulary"].write_bytes(encode_filter(word_id_map))
+            files["doc-lengths"] = write_json(
+                tmp_path / "doc-lengths.json", dict(sorted(lengths.items()))
+            )
+            documents.finish(tmp_path / "documents.qdoc")
+            files["documents"] = tmp_path / "documents.qdoc"
+
+        manifest = {"version": datetime.now().isoformat()}
+        for prefix, path in files.items():
+            manifest[prefix] = handler.write_file(prefix, path)
+        if shards > 1:
+            manifest["shards"] = shards
+    handler.write_manifest(manifest)
+    return manifest
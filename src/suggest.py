@@ -0,0 +1,126 @@
+"""Suggest.py contains prefix completion of indexed words, for autocomplete.
+
+The term dictionary is kept as a sorted array, a flattened trie in which the
+words starting with a prefix form one contiguous range found by binary
+search. Completions are ranked by the number of quotes containing them.
+
+Short prefixes cover a large share of the vocabulary, so their top
+completions are precomputed on the first suggestion. Longer prefixes cover
+few enough words to select from with a heap on each request.
+"""
+
+from array import array
+from bisect import bisect_left
+from heapq import nlargest
+from threading import Lock
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+try:
+    from src.binary_index import BinaryIndex, count_distinct
+except ImportError:  # Flat layout when deployed as a Lambda function
+    from binary_index import BinaryIndex, count_distinct
+
+# Sorts after every character, so `prefix + LAST_CHAR` bounds the range of
+# words starting with `prefix`
+LAST_CHAR = "\U0010ffff"
+
+
+class Suggester:
+    """Complete prefixes to the indexed words found in the most quotes"""
+
+    def __init__(
+        self,
+        terms: Sequence[str],
+        frequencies: Sequence[int],
+        k: int = 10,
+        precomputed_length: int = 2,
+    ):
+        """
+        Args:
+            terms: every indexed word, sorted
+            frequencies: number of quotes containing each word in `terms`
+            k: number of completions precomputed for short prefixes
+            precomputed_length: longest prefix to precompute completions for
+        """
+        self.terms = terms
+        self.frequencies = frequencies
+        self.k = k
+        self.precomputed_length = precomputed_length
+        self._top: Optional[Dict[str, array]] = None
+        self.lock = Lock()
+
+    @property
+    def top(self) -> Dict[str, array]:
+        # Precomputed on first use, so loading an index does not pay for it
+        if self._top is None:
+            with self.lock:
+                if self._top is None:
+                    self._top = self.precompute(self.precomputed_length)
+        return self._top
+
+    @classmethod
+    def from_binary_index(cls, index: BinaryIndex, **kwargs) -> "Suggester":
+        """Suggest from the memory-mapped term dictionary of a binary index"""
+        return cls(index.terms(), index.document_frequencies(), **kwargs)
+
+    @classmethod
+    def from_index(
+        cls, inverted_index: Mapping, word_id_map: Mapping, **kwargs
+    ) -> "Suggester":
+        """Suggest from a JSON loaded inverted index and word ID map"""
+        terms = sorted(word_id_map)
+        frequencies = array(
+            "L",
+            (
+                count_distinct(inverted_index.get(str(word_id_map[term]), []))
+                for term in terms
+            ),
+        )
+        return cls(terms, frequencies, **kwargs)
+
+    def _best(self, positions: Sequence[int], k: int) -> List[int]:
+        # Ties go to the alphabetically first word
+        return nlargest(k, positions, key=lambda pos: (self.frequencies[pos], -pos))
+
+    def precompute(self, max_length: int) -> Dict[str, array]:
+        """Top term positions for every prefix up to a given length, in one
+        pass over the sorted terms, where each prefix is a contiguous group
+        """
+        top = {}
+        groups: Dict[int, Tuple[str, List[int]]] = {}
+        for pos in range(len(self.terms)):
+            term = self.terms[pos]
+            for length in range(1, min(len(term), max_length) + 1):
+                prefix = term[:length]
+                if length not in groups or groups[length][0] != prefix:
+                    if length in groups:
+                        done_prefix, done_positions = groups[length]
+                        top[done_prefix] = array(
+                            "L", self._best(done_positions, self.k)
+                        )
+                    groups[length] = (prefix, [])
+                groups[length][1].append(pos)
+        for prefix, positions in groups.values():
+            top[prefix] = array("L", self._best(positions, self.k))
+        return top
+
+    def prefix_range(self, prefix: str) -> Tuple[int, int]:
+        """Positions [start, end) of the terms starting with a prefix"""
+        start = bisect_left(self.terms, prefix)
+        end = bisect_left(self.terms, prefix + LAST_CHAR, start)
+        return start, end
+
+    def suggest(self, prefix: str, k: int = 10) -> List[Tuple[str, int]]:
+        """Complete a prefix to the words found in the most quotes.
+
+        Returns:
+            up to k (<word>, <number-of-quotes>) pairs, most frequent first
+        """
+        if not prefix or k <= 0:
+            return []
+        if prefix in self.top and k <= self.k:
+            positions = self.top[prefix][:k]
+        else:
+            start, end = self.prefix_range(prefix)
+            positions = self._best(range(start, end), k)
+        return [(self.terms[pos], self.frequencies[pos]) for pos in positions]
@@ -0,0 +1,39 @@
+"""Terms.py contains the term dictionary assigning word IDs.
+
+IDs are stable across rebuilds: a dictionary is seeded with the word IDs of
+the previous snapshot, which keep their IDs, and new words are appended after
+the largest ID. Builds assign new words in sorted order with `add_terms`, so
+the IDs of a build depend only on the words in the corpus, not on the order
+quotes were listed in or on lookups made earlier in the process.
+"""
+
+from typing import Iterable, List, Mapping, Optional, Union
+
+
+class TermDictionary(dict):
+    """Mapping of words to word IDs which assigns the next ID to a word on
+    its first lookup, like a counting `defaultdict`. A plain dict, so it can
+    be written as JSON with the rest of a snapshot.
+    """
+
+    def __init__(self, word_ids: Optional[Mapping[str, Union[int, str]]] = None):
+        super().__init__(
+            (word, int(word_id)) for word, word_id in (word_ids or {}).items()
+        )
+        self.next_id = max(self.values(), default=-1) + 1
+
+    def __missing__(self, word: str) -> int:
+        word_id = self[word] = self.next_id
+        self.next_id += 1
+        return word_id
+
+    def add_terms(self, words: Iterable[str]) -> List[str]:
+        """Assign IDs to the words not yet in the dictionary, in sorted order.
+
+        Returns:
+            the new words, sorted
+        """
+        new_words = sorted({word for word in words if word not in self})
+        for word in new_words:
+            self[word]
+        return new_words
@@ -0,0 +1,62 @@
+"""Tokenizer.py contains the text normalization shared by index builds and
+query parsing, so the words a query looks up are always normalized in the
+same way as the words that were indexed.
+
+Text is normalized once per document rather than once per word:
+    1. Unicode NFKC normalization, so e.g. ligatures and full-width letters
+       match their plain forms
+    2. case folding, a more aggressive, Unicode-aware `lower`
+    3. removal of punctuation and symbols in any script, along with `_`
+and the result is split on whitespace.
+"""
+
+from array import array
+from typing import Dict, Iterable, List
+import re
+import unicodedata
+
+# Anything which is neither a word character nor whitespace, in any script.
+# Underscores count as word characters in regular expressions, but as
+# punctuation in `string.punctuation`, which earlier versions stripped
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]|_")
+
+# Typecode of word ID arrays, unsigned 32 bit
+WORD_ID_TYPECODE = "L" if array("I").itemsize < 4 else "I"
+
+
+def normalize(text: str) -> str:
+    """Normalize a whole text, leaving whitespace in place"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return PUNCTUATION_PATTERN.sub("", text)
+
+
+def tokenize(text: str) -> List[str]:
+    """Normalized words in a text, in order"""
+    return normalize(text).split()
+
+
+def text_word_ids(text: str, word_id_map: Dict[str, int]) -> array:
+    """Word IDs of the normalized words in a text, as an array. New words are
+    assigned IDs if the mapping assigns them, e.g. a counting defaultdict.
+    """
+    return array(WORD_ID_TYPECODE, [word_id_map[word] for word in tokenize(text)])
+
+
+def batch_word_ids(texts: Iterable[str], word_id_map: Dict[str, int]) -> List[array]:
+    """Word ID arrays for many texts, normalizing all of them in one pass.
+
+    Texts are joined and normalized together, then split back apart, which
+    avoids per-text overhead when tokenizing a batch of short quotes.
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+    # Form feeds are whitespace but are kept as separators by normalization
+    separator = "\f"
+    normalized = normalize(
+        separator.join(text.replace(separator, " ") for text in texts)
+    )
+    return [
+        array(WORD_ID_TYPECODE, [word_id_map[word] for word in part.split()])
+        for part in normalized.split(separator)
+    ]
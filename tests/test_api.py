@@ -1,4 +1,18 @@
-from src.api import split_quote, Quote
+from fastapi.testclient import TestClient
+
+from src.api import (
+    MAX_SEARCH_LIMIT,
+    MAX_SUGGEST_LIMIT,
+    IndexSearcher,
+    Quote,
+    app,
+    create_snapshot,
+    get_quote_cache,
+    quote_cache_stat,
+    split_quote,
+)
+from src.bloom import BloomFilter, encode_filter
+from src.documents import Document, DocumentStore, encode_documents
 
 
 def test_split_quote_lead_in():
@@ -24,3 +38,115 @@ Horace, Ars Poetica"""
         source="Horace, Ars Poetica",
     )
     assert res == expected_res
+
+
+def test_create_snapshot():
+    inverted_index = {"1": [1, 3, 3], "2": [2, 3], "3": [10]}
+    snapshot = create_snapshot(inverted_index, {}, {})
+    assert list(snapshot.file_ids) == [1, 2, 3, 10]
+    assert list(snapshot.lengths) == [1, 1, 3, 1]
+    assert snapshot.total_length == 6
+    # Repeated file IDs are compacted into frequencies
+    assert list(snapshot.inverted_index["1"]) == [1, 3]
+    assert snapshot.inverted_index.document_frequency(2) == 2
+
+    snapshot = create_snapshot(inverted_index, {}, {}, {"3": 4, "1": 2})
+    assert list(snapshot.file_ids) == [1, 3]
+    assert list(snapshot.lengths) == [2, 4]
+
+
+def test_index_searcher_statistics():
+    snapshot = create_snapshot({"0": [1, 1, 2], "1": [2]}, {"war": 0, "peace": 1}, {})
+    delta = {
+        "file_ids": [3],
+        "postings": {"war": [3]},
+        "positions": {"war": {"3": [0, 2]}, "and": {"3": [1]}},
+    }
+    searcher = IndexSearcher(snapshot, delta)
+    assert searcher.postings("war") == [1, 2, 3]
+    assert searcher.term_frequencies("war", [1, 2, 3]) == [2, 1, 2]
+    assert [searcher.document_length(ind) for ind in (1, 2, 3, 4)] == [2, 2, 3, 0]
+    assert searcher.document_count() == 3
+    assert searcher.average_document_length() == 7 / 3
+
+
+def test_index_searcher_documents():
+    documents = DocumentStore(
+        encode_documents([(1, Document("", "'War.'", "Leo Tolstoy"))])
+    )
+    snapshot = create_snapshot({"0": [1]}, {"war": 0}, {}, documents=documents)
+    delta = {
+        "file_ids": [2],
+        "postings": {},
+        "positions": {},
+        "documents": {"2": ["", "'Peace.'", "Tolstoy"]},
+    }
+    searcher = IndexSearcher(snapshot, delta)
+    assert searcher.document(1) == ("", "'War.'", "Leo Tolstoy")
+    assert searcher.document(2) == ("", "'Peace.'", "Tolstoy")
+    assert searcher.document(3) is None
+    assert searcher.field_postings("source", ["tolstoy"]) == [1, 2]
+    assert searcher.field_postings("source", ["leo", "tolstoy"]) == [1]
+
+
+class CountingMap(dict):
+    """Word ID map which counts its lookups"""
+
+    lookups = 0
+
+    def get(self, *args):
+        self.lookups += 1
+        return super().get(*args)
+
+
+def test_index_searcher_vocabulary_filter():
+    word_id_map = CountingMap({"war": 0, "peace": 1})
+    vocabulary = BloomFilter(encode_filter(word_id_map, false_positive_rate=0.001))
+    snapshot = create_snapshot(
+        {"0": [1], "1": [2]}, word_id_map, {}, vocabulary=vocabulary
+    )
+    delta = {"file_ids": [3], "postings": {"love": [3]}, "positions": {}}
+    searcher = IndexSearcher(snapshot, delta)
+    assert searcher.postings("war") == [1]
+    assert word_id_map.lookups == 1
+    # Rejected by the filter without a lookup, added quotes are still found
+    assert searcher.postings("love") == [3]
+    assert searcher.positions("love") == {}
+    assert word_id_map.lookups == 1
+
+
+def test_search_rejects_invalid_pages():
+    client = TestClient(app)
+    response = client.get("/api/search", params={"q": "war", "limit": -1})
+    assert response.status_code == 422
+    params = {"q": "war", "limit": MAX_SEARCH_LIMIT + 1}
+    assert client.get("/api/search", params=params).status_code == 422
+    params = {"q": "war", "order": "random", "offset": 10}
+    response = client.get("/api/search", params=params)
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Random order does not take an offset"}
+
+
+def test_suggest_rejects_invalid_limits():
+    client = TestClient(app)
+    for limit in (-1, 0, MAX_SUGGEST_LIMIT + 1):
+        response = client.get("/suggest", params={"q": "wa", "limit": limit})
+        assert response.status_code == 422
+    response = client.get("/suggest", params={"q": "wa", "limit": MAX_SUGGEST_LIMIT})
+    assert response.status_code == 200
+
+
+def test_quote_cache_stat_before_cache_exists():
+    created = dict(get_quote_cache.cache)
+    get_quote_cache.cache.clear()
+    try:
+        assert quote_cache_stat("bytes")() == 0
+        # Scraping the gauge does not create, and so preload, the cache
+        assert not get_quote_cache.cache
+
+        get_quote_cache()
+        assert quote_cache_stat("misses")() == 0
+        assert get_quote_cache.cache
+    finally:
+        get_quote_cache.cache.clear()
+        get_quote_cache.cache.update(created)
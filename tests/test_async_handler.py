@@ -0,0 +1,79 @@
+from threading import Lock
+import asyncio
+import time
+
+from src.async_handler import AsyncHandler
+from src.handler import LocalHandler
+
+
+async def load_quotes(async_handler, file_ids):
+    """Load quotes concurrently, as the API loads a page of results"""
+    load_quote = async_handler.handler.load_quote
+    return await asyncio.gather(*(async_handler.run(load_quote, i) for i in file_ids))
+
+
+class SlowHandler(LocalHandler):
+    """Handler whose quote loads block, counting how many run at once"""
+
+    def __init__(self, local_path, delay):
+        super().__init__(local_path)
+        self.delay = delay
+        self.lock = Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def load_quote(self, file_id):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+        return f"quote {file_id}"
+
+
+def test_run(tmp_path):
+    (tmp_path / "1.txt").write_text("foo\nbar")
+    async_handler = AsyncHandler(LocalHandler(tmp_path))
+    try:
+        handler = async_handler.handler
+        assert asyncio.run(async_handler.run(handler.load_quote, 1)) == "foo\nbar"
+        assert asyncio.run(async_handler.run(handler.list_file_ids)) == [1]
+    finally:
+        async_handler.close()
+
+
+def test_loads_do_not_block_event_loop(tmp_path):
+    async_handler = AsyncHandler(SlowHandler(tmp_path, delay=0.2), max_workers=4)
+
+    async def load_while_ticking():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        quotes = await load_quotes(async_handler, [1, 2, 3, 4])
+        ticker.cancel()
+        return quotes, ticks
+
+    try:
+        quotes, ticks = asyncio.run(load_while_ticking())
+    finally:
+        async_handler.close()
+    assert quotes == ["quote 1", "quote 2", "quote 3", "quote 4"]
+    # Loads ran concurrently while the loop kept serving other tasks
+    assert async_handler.handler.max_running == 4
+    assert ticks >= 5
+
+
+def test_bounded_concurrency(tmp_path):
+    async_handler = AsyncHandler(SlowHandler(tmp_path, delay=0.01), max_workers=2)
+    try:
+        asyncio.run(load_quotes(async_handler, range(10)))
+    finally:
+        async_handler.close()
+    assert async_handler.handler.max_running == 2
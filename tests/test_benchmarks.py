@@ -0,0 +1,35 @@
+import json
+
+from benchmarks.compare import compare
+from benchmarks.corpus import Corpus
+from benchmarks.run import latency_stats, percentile
+from src.handler import LocalHandler
+
+
+def test_corpus_is_reproducible(tmp_path):
+    quotes = list(Corpus(20, seed=1).quotes())
+    assert quotes == list(Corpus(20, seed=1).quotes())
+    assert quotes != list(Corpus(20, seed=2).quotes())
+    assert [file_id for file_id, _ in quotes] == list(range(1, 21))
+
+    Corpus(20, seed=1).write_local(tmp_path, pack=True)
+    assert LocalHandler(tmp_path).load_quote(3) == quotes[2][1]
+
+
+def test_percentile():
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert latency_stats([0.001, 0.003])["mean_ms"] == 2
+
+
+def test_compare(tmp_path):
+    def write(path, p50_ms, per_second):
+        results = {"get_quotes": {"n": 10, "p50_ms": p50_ms, "per_second": per_second}}
+        scenario = {"quotes": 10, "backend": "local", "results": results}
+        path.write_text(json.dumps({"meta": {}, "scenarios": [scenario]}))
+
+    write(tmp_path / "old.json", 1.0, 100.0)
+    write(tmp_path / "new.json", 1.1, 50.0)
+    _, regressions = compare(tmp_path / "old.json", tmp_path / "new.json", 0.2)
+    assert regressions == ["10/local/get_quotes.per_second"]
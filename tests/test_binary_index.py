@@ -0,0 +1,98 @@
+import pytest
+
+from src.binary_index import (
+    BinaryIndex,
+    convert_json_index,
+    decode_postings,
+    decode_varint,
+    encode_index,
+    encode_positions,
+    encode_postings,
+    encode_varint,
+    pack_sections,
+    read_positions,
+    write_sections,
+)
+
+INVERTED_INDEX = {0: [1, 4], 1: [1, 3, 300], 2: [2], 3: []}
+WORD_ID_MAP = {"this": 0, "is": 1, "über": 2, "unused": 3}
+
+
+@pytest.mark.parametrize("value", [0, 1, 127, 128, 300, 2**32])
+def test_varint_roundtrip(value):
+    encoded = encode_varint(value)
+    assert decode_varint(encoded, 0) == (value, len(encoded))
+
+
+def test_read_positions_in_sequence():
+    first, second = {1: [0, 2], 5: [1]}, {2: [3]}
+    buffer = encode_positions(first) + encode_positions(second)
+    positions, pos = read_positions(buffer, 0)
+    assert positions == first
+    assert read_positions(buffer, pos) == (second, len(buffer))
+
+
+def test_postings_roundtrip():
+    file_ids = [1, 3, 3, 200, 100000]
+    assert decode_postings(encode_postings(file_ids), 0) == file_ids
+
+
+def test_lookup():
+    index = BinaryIndex(encode_index(INVERTED_INDEX, WORD_ID_MAP))
+    assert len(index) == 4
+    assert index.word_id("is") == 1
+    assert index.word_id("über") == 2
+    assert index.word_id("missing") is None
+    assert index.postings(1) == [1, 3, 300]
+    assert index.postings(3) == []
+    assert index.postings(10) is None
+
+
+def test_mapping_views():
+    index = BinaryIndex(encode_index(INVERTED_INDEX, WORD_ID_MAP))
+    assert dict(index.word_id_map()) == WORD_ID_MAP
+    postings = index.postings_map()
+    assert postings["1"] == postings[1] == [1, 3, 300]
+    assert postings.get("10") is None
+    assert dict(postings) == INVERTED_INDEX
+    assert postings.entry(1) == ([1, 3, 300], [1, 1, 1])
+
+
+def test_convert_json_index():
+    json_index = {str(word_id): ids for word_id, ids in INVERTED_INDEX.items()}
+    data = convert_json_index(json_index, WORD_ID_MAP)
+    assert data == encode_index(INVERTED_INDEX, WORD_ID_MAP)
+
+
+def test_open_mmap(tmp_path):
+    path = tmp_path / "binary-index.qidx"
+    path.write_bytes(encode_index(INVERTED_INDEX, WORD_ID_MAP))
+    index = BinaryIndex.open(path)
+    assert index.postings(index.word_id("this")) == [1, 4]
+    index.close()
+
+
+def test_write_sections(tmp_path):
+    section = tmp_path / "PBLB"
+    section.write_bytes(b"postings")
+    write_sections(tmp_path / "index.qidx", {b"TOFF": b"terms", b"PBLB": section})
+    assert (tmp_path / "index.qidx").read_bytes() == pack_sections(
+        {b"TOFF": b"terms", b"PBLB": b"postings"}
+    )
+
+
+def test_bad_magic():
+    with pytest.raises(ValueError):
+        BinaryIndex(b"JSON" + bytes(64))
+
+
+def test_positions():
+    positional_index = {"0": {"1": [0], "4": [2, 5]}, "1": {"3": [1]}}
+    index = BinaryIndex(encode_index(INVERTED_INDEX, WORD_ID_MAP, positional_index))
+    assert index.positions(0) == {1: [0], 4: [2, 5]}
+    assert index.positions(2) == {}
+    assert index.positions_map()["1"] == {3: [1]}
+
+    index = BinaryIndex(encode_index(INVERTED_INDEX, WORD_ID_MAP))
+    assert index.positions(0) is None
+    assert len(index.positions_map()) == 0
@@ -0,0 +1,30 @@
+import pytest
+
+from src.bloom import BloomFilter, encode_filter
+
+
+def test_membership():
+    words = [f"word{ind}" for ind in range(1000)]
+    bloom_filter = BloomFilter(encode_filter(words))
+    # No false negatives
+    assert all(word in bloom_filter for word in words)
+    false_positives = sum(f"other{ind}" in bloom_filter for ind in range(10000))
+    assert false_positives < 300
+
+
+def test_open(tmp_path):
+    path = tmp_path / "vocabulary.qblm"
+    path.write_bytes(encode_filter(["war", "peace"], false_positive_rate=0.001))
+    bloom_filter = BloomFilter.open(path)
+    assert "war" in bloom_filter and "peace" in bloom_filter
+    assert "love" not in bloom_filter
+
+
+def test_empty():
+    bloom_filter = BloomFilter(encode_filter([]))
+    assert "war" not in bloom_filter
+
+
+def test_bad_magic():
+    with pytest.raises(ValueError):
+        BloomFilter(b"QIDX" + encode_filter(["war"])[4:])
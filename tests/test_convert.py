@@ -0,0 +1,33 @@
+from src.convert import convert_snapshot
+from src.handler import AWSHandler, LocalHandler
+from tests.test_handler import (  # noqa: F401
+    aws_credentials,
+    bucket_name,
+    region,
+    s3_resource,
+    s3_test,
+)
+
+
+def test_convert_snapshot(tmp_path):
+    handler = LocalHandler(tmp_path)
+    handler.write_snapshot({0: [1, 1]}, {"war": 0}, {0: {1: [0, 2]}}, shards=2)
+    name = convert_snapshot(handler)
+
+    manifest = handler.load_manifest()
+    assert manifest["binary-index"] == name
+    assert not {"shards", "terms", "shard-0", "shard-1"} & set(manifest)
+    index = handler.load_binary_index("binary-index")
+    assert index.positions(index.word_id("war")) == {1: [0, 2]}
+
+
+def test_convert_snapshot_aws(s3_resource, bucket_name, s3_test):
+    handler = AWSHandler(s3_resource)
+    handler.write_snapshot({0: [1]}, {"war": 0})
+    first = convert_snapshot(handler)
+    assert handler.load_binary_index("binary-index").postings(0) == [1]
+
+    # A later conversion is not served the cached download of the first
+    handler.write_snapshot({0: [2]}, {"war": 0})
+    assert convert_snapshot(handler) != first
+    assert handler.load_binary_index("binary-index").postings(0) == [2]
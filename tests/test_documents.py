@@ -0,0 +1,74 @@
+import pytest
+
+from src.documents import (
+    Document,
+    DocumentStore,
+    DocumentWriter,
+    contains_phrase,
+    encode_documents,
+    parse_quote,
+)
+
+DOCUMENTS = {
+    3: Document("On war...", "'War and peace.'", "Leo Tolstoy"),
+    1: Document("", "'Sometimes even good Homer nods off.'", "Horace, Ars Poetica"),
+    7: Document("", "'Peace, ünïcode.'", "Tolstoy"),
+}
+
+
+def test_parse_quote():
+    assert parse_quote("On chess...\n'Study the endgame.'\nCapablanca") == Document(
+        "On chess...", "'Study the endgame.'", "Capablanca"
+    )
+    assert parse_quote("'Homer nods off.'\nHorace") == Document(
+        "", "'Homer nods off.'", "Horace"
+    )
+
+
+def test_encode_and_read():
+    store = DocumentStore(encode_documents(DOCUMENTS.items()))
+    assert len(store) == 3
+    assert store.get(7) == DOCUMENTS[7]
+    assert store.get("3") == DOCUMENTS[3]
+    assert store.get(2) is None
+    assert store.get(8) is None
+    assert list(store) == sorted(DOCUMENTS.items())
+
+
+def test_document_writer(tmp_path):
+    writer = DocumentWriter(tmp_path)
+    for file_id, document in DOCUMENTS.items():
+        writer.add(file_id, document)
+    assert len(writer) == len(DOCUMENTS)
+    writer.finish(tmp_path / "documents.qdoc")
+    assert (tmp_path / "documents.qdoc").read_bytes() == encode_documents(
+        DOCUMENTS.items()
+    )
+    assert [path.name for path in tmp_path.iterdir()] == ["documents.qdoc"]
+
+
+def test_empty_store():
+    store = DocumentStore(encode_documents([]))
+    assert len(store) == 0
+    assert store.get(1) is None
+    assert store.field_postings("source", ["tolstoy"]) == []
+
+
+def test_bad_magic():
+    with pytest.raises(ValueError):
+        DocumentStore(b"QIDX" + bytes(12))
+
+
+def test_field_postings():
+    store = DocumentStore(encode_documents(DOCUMENTS.items()))
+    assert store.field_postings("source", ["tolstoy"]) == [3, 7]
+    assert store.field_postings("source", ["leo", "tolstoy"]) == [3]
+    assert store.field_postings("source", ["tolstoy", "leo"]) == []
+    assert store.field_postings("lead_in", ["war"]) == [3]
+    assert store.field_postings("source", ["war"]) == []
+
+
+def test_contains_phrase():
+    assert contains_phrase(["a", "b", "c"], ["b", "c"])
+    assert not contains_phrase(["a", "b", "c"], ["a", "c"])
+    assert not contains_phrase(["a"], ["a", "b"])
@@ -0,0 +1,87 @@
+import pytest
+
+from src.binary_index import BinaryIndex, encode_index
+from src.fuzzy import FuzzyMatcher, correct_query, deletes, edit_distance
+from src.query import parse_query
+
+from tests.test_query import INDEX
+
+TERMS = ["and", "peace", "piece", "tolstoy", "war", "warp"]
+FREQUENCIES = [2, 3, 1, 1, 3, 1]
+
+
+def test_deletes():
+    assert deletes("war", 1) == {"war", "ar", "wr", "wa"}
+    assert "w" in deletes("war", 2)
+    assert deletes("a", 2) == {"a", ""}
+
+
+@pytest.mark.parametrize(
+    "a,b,expected",
+    [
+        ("war", "war", 0),
+        ("war", "wart", 1),
+        ("peace", "paece", 1),
+        ("peace", "piece", 2),
+        ("tolstoy", "tolstio", 2),
+        ("war", "peace", 3),
+    ],
+)
+def test_edit_distance(a, b, expected):
+    assert edit_distance(a, b, 2) == expected
+
+
+def test_lookup():
+    matcher = FuzzyMatcher(TERMS, FREQUENCIES)
+    assert matcher.lookup("paece") == [("peace", 1), ("piece", 1)]
+    # Equally close words are ordered by how common they are
+    assert [term for term, _ in matcher.lookup("wxr")] == ["war", "warp"]
+    assert matcher.best("tolstio") == "tolstoy"
+    assert matcher.best("dostoevsky") is None
+
+
+def test_lookup_from_binary_index():
+    word_id_map = {term: word_id for word_id, term in enumerate(TERMS)}
+    inverted_index = {
+        word_id: list(range(frequency)) for word_id, frequency in enumerate(FREQUENCIES)
+    }
+    index = BinaryIndex(encode_index(inverted_index, word_id_map, with_deletions=True))
+    matcher = FuzzyMatcher.from_binary_index(index)
+    # The deletion index is read from the binary index, not rebuilt
+    assert matcher._deletions is not None
+    assert list(matcher.deletions) == list(FuzzyMatcher(TERMS, FREQUENCIES).deletions)
+    assert matcher.lookup("paece") == [("peace", 1), ("piece", 1)]
+
+    index = BinaryIndex(encode_index(inverted_index, word_id_map))
+    matcher = FuzzyMatcher.from_binary_index(index)
+    assert matcher._deletions is None
+    assert matcher.best("tolstio") == "tolstoy"
+
+
+def test_warm_builds_deletions():
+    matcher = FuzzyMatcher(TERMS, FREQUENCIES)
+    matcher.warm()
+    # Waits for the background build rather than starting another
+    assert list(matcher.deletions) == list(FuzzyMatcher(TERMS, FREQUENCIES).deletions)
+
+
+def test_long_words_beyond_prefix():
+    matcher = FuzzyMatcher(["internationalization"], [1], prefix_length=4)
+    assert matcher.best("internationalisation") == "internationalization"
+    assert matcher.best("itnernationalization") == "internationalization"
+
+
+def test_correct_query():
+    matcher = FuzzyMatcher(TERMS, FREQUENCIES)
+    node, corrections = correct_query(
+        parse_query('"wra and paece" NOT tolstoy'), INDEX, matcher
+    )
+    assert node == (
+        "and",
+        ("phrase", ["war", "and", "peace"]),
+        ("not", ("term", "tolstoy")),
+    )
+    assert corrections == {"wra": "war", "paece": "peace"}
+
+    node, corrections = correct_query(parse_query("war"), INDEX, matcher)
+    assert (node, corrections) == (("term", "war"), {})
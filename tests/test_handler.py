@@ -1,12 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import json
 import os
 
 import pytest
 import boto3
+from botocore.exceptions import ClientError, EndpointConnectionError
 from moto import mock_s3
 
-from src.handler import LocalHandler, AWSHandler, form_quote
+from src.handler import (
+    COUNTER_KEY,
+    S3_REQUESTS,
+    LocalHandler,
+    AWSHandler,
+    form_quote,
+    instrument_s3_client,
+)
+from src.binary_index import encode_index
+from src.documents import Document, encode_documents
+from src.pack import encode_pack
 
 
 def test_form_quote():
@@ -90,6 +102,24 @@ def test_local_add_quote(tmp_path):
     assert "'some other quote'\nSeb, This test\n" == res
 
 
+def test_local_add_quotes(tmp_path):
+    (tmp_path / "2.txt").write_text("'Some quote'")
+    (tmp_path / "10.txt").write_text("'Some other quote'")
+    handler = LocalHandler(tmp_path)
+    # IDs follow the largest file ID, not the last file listed
+    assert handler.add_quotes([{"content": "a"}, {"content": "b"}]) == [11, 12]
+    assert handler.load_quote(12) == "'b'\nAnonymous\n"
+
+    # Later IDs come from the counter, without listing files
+    handler.list_file_ids = None
+    assert handler.add_quote(content="c") == 13
+    assert handler.allocate_file_ids(0) == range(14, 14)
+
+    with pytest.raises(ValueError):
+        handler.add_quotes([{"content": "d"}, {"content": ""}])
+    assert not (tmp_path / "14.txt").exists()
+
+
 @pytest.fixture
 def s3_resource():
     with mock_s3():
@@ -175,9 +205,366 @@ def test_aws_load_latest_index(s3_resource, bucket_name, s3_test, s3_index):
 
 def test_aws_add_quote(s3_resource, bucket_name, s3_test):
     index_handler = AWSHandler(s3_resource)
-    index_handler.add_quote(content="Test quote")
+    assert index_handler.add_quote(content="Test quote") == 1
 
-    bucket = s3_resource.Bucket(bucket_name)
-    for f in bucket.objects.all():
-        obj = f.get()
+    obj = s3_resource.Object(bucket_name, "1.txt").get()
     assert obj["Body"].read().decode() == "'Test quote'\nAnonymous"
+
+
+def test_aws_add_quotes(s3_resource, bucket_name, s3_test):
+    s3_resource.Object(bucket_name, "9.txt").put(Body="'Old quote'\nAnonymous")
+    index_handler = AWSHandler(s3_resource, max_workers=4)
+    quotes = [{"content": f"quote {ind}"} for ind in range(10)]
+    # The counter starts after existing quotes, then IDs come from it alone
+    assert index_handler.add_quotes(quotes) == list(range(10, 20))
+    assert index_handler.allocate_file_ids(3) == range(20, 23)
+    assert index_handler.load_quote(19) == "'quote 9'\nAnonymous"
+
+
+def test_aws_allocate_file_ids_retries(s3_resource, bucket_name, s3_test):
+    index_handler = AWSHandler(s3_resource)
+    client = s3_resource.meta.client
+    put_object = client.put_object
+    calls = []
+
+    def conflicting_put(**kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            # Another writer allocates IDs between the read and the write
+            put_object(Bucket=bucket_name, Key=COUNTER_KEY, Body='{"next_file_id": 5}')
+            raise ClientError({"Error": {"Code": "PreconditionFailed"}}, "PutObject")
+        return put_object(**kwargs)
+
+    client.put_object = conflicting_put
+    assert index_handler.allocate_file_ids(2) == range(5, 7)
+    assert "IfNoneMatch" in calls[0] and "IfMatch" in calls[1]
+
+
+def test_local_binary_index(tmp_path):
+    index_handler = LocalHandler(tmp_path)
+    assert index_handler.load_binary_index("binary-index") is None
+
+    index_handler.write_binary_index(
+        "binary-index", encode_index({0: [1, 2]}, {"foo": 0})
+    )
+    index = index_handler.load_binary_index("binary-index")
+    assert index.postings(index.word_id("foo")) == [1, 2]
+
+
+def test_aws_binary_index(s3_resource, bucket_name, s3_test):
+    index_handler = AWSHandler(s3_resource)
+    assert index_handler.load_binary_index("binary-index") is None
+
+    index_handler.write_binary_index(
+        "binary-index-test.qidx", encode_index({0: [1, 2]}, {"foo": 0})
+    )
+    index = index_handler.load_binary_index("binary-index")
+    assert index.postings(index.word_id("foo")) == [1, 2]
+    index = index_handler.open_binary_index("binary-index-test.qidx")
+    assert index.postings(index.word_id("foo")) == [1, 2]
+    assert index_handler.open_binary_index("binary-index-missing.qidx") is None
+
+
+def test_local_iterate_text_pairs_file_ids(tmp_path):
+    for file_id in (1, 2, 10):
+        (tmp_path / f"{file_id}.txt").write_text(f"quote {file_id}")
+
+    index_handler = LocalHandler(tmp_path)
+    assert index_handler.list_file_ids() == [1, 2, 10]
+    res = list(index_handler.iterate_text_pairs([2, 10]))
+    assert res == [(2, "quote 2"), (10, "quote 10")]
+
+
+def test_aws_iterate_text_pairs_file_ids(s3_resource, bucket_name, s3_test):
+    for file_id in (1, 2, 10):
+        s3_resource.Object(bucket_name, f"{file_id}.txt").put(Body=f"quote {file_id}")
+    s3_resource.Object(bucket_name, "index-test").put(Body="{}")
+
+    index_handler = AWSHandler(s3_resource)
+    assert index_handler.list_file_ids() == [1, 2, 10]
+    res = list(index_handler.iterate_text_pairs([2, 10]))
+    assert res == [(2, b"quote 2"), (10, b"quote 10")]
+
+
+def test_aws_delta(s3_resource, bucket_name, s3_test):
+    index_handler = AWSHandler(s3_resource)
+    assert index_handler.load_delta() == {}
+
+    delta = {"file_ids": [1], "postings": {"foo": [1]}}
+    index_handler.write_delta(delta)
+    assert index_handler.load_delta() == delta
+
+
+def test_local_load_quote(tmp_path):
+    for file_id in (1, 10, 100):
+        (tmp_path / f"{file_id}.txt").write_text(f"quote {file_id}")
+
+    index_handler = LocalHandler(tmp_path)
+    assert index_handler.load_quote(1) == "quote 1"
+    assert index_handler.load_quote(2) == ""
+
+
+def test_local_snapshot_manifest(tmp_path):
+    index_handler = LocalHandler(tmp_path)
+    # A stale snapshot which sorts after the manifest's snapshot
+    (tmp_path / "index-zzz.json").write_text(json.dumps({"0": [9]}))
+    (tmp_path / "binary-index-zzz.qidx").write_bytes(encode_index({0: [9]}, {"foo": 0}))
+
+    index_handler.write_snapshot({0: [1]}, {"foo": 0})
+    manifest = index_handler.load_manifest()
+    assert set(manifest) == {
+        "version",
+        "index",
+        "word-ids",
+        "binary-index",
+        "doc-lengths",
+        "vocabulary",
+    }
+    assert index_handler.load_index("index") == {"0": [1]}
+    assert index_handler.load_index("doc-lengths") == {"1": 1}
+    index = index_handler.load_binary_index("binary-index")
+    assert index.postings(0) == [1]
+    vocabulary = index_handler.load_filter("vocabulary")
+    assert "foo" in vocabulary
+
+
+def test_aws_load_quote(s3_resource, bucket_name, s3_test):
+    for file_id in (1, 10, 100):
+        s3_resource.Object(bucket_name, f"{file_id}.txt").put(Body=f"quote {file_id}")
+
+    index_handler = AWSHandler(s3_resource)
+    assert index_handler.load_quote(1) == "quote 1"
+    assert index_handler.load_quote(2) == ""
+
+
+def test_aws_snapshot_manifest(s3_resource, bucket_name, s3_test, s3_index):
+    index_handler = AWSHandler(s3_resource)
+    assert index_handler.load_manifest() == {}
+
+    index_handler.write_snapshot({0: [1]}, {"foo": 0})
+    manifest = index_handler.load_manifest()
+    assert manifest["index"].startswith("index-")
+    assert index_handler.load_index("index") == {"0": [1]}
+    assert index_handler.load_index("word-ids") == {"foo": 0}
+
+
+def test_aws_iterate_text_pairs_concurrent(s3_resource, bucket_name, s3_test):
+    for file_id in range(1, 51):
+        s3_resource.Object(bucket_name, f"{file_id}.txt").put(Body=f"quote\n{file_id}")
+
+    index_handler = AWSHandler(s3_resource, max_workers=4)
+    res = list(index_handler.iterate_text_pairs(range(1, 51)))
+
+    expected = [
+        pair
+        for file_id in range(1, 51)
+        for pair in ((file_id, b"quote"), (file_id, str(file_id).encode()))
+    ]
+    assert res == expected
+
+
+def test_aws_fetch_object_retries(s3_resource, bucket_name, s3_test, monkeypatch):
+    s3_resource.Object(bucket_name, "1.txt").put(Body="foo")
+    index_handler = AWSHandler(s3_resource)
+    index_handler.retry_delay = 0
+
+    client = s3_resource.meta.client
+    get_object = client.get_object
+    calls = []
+
+    def flaky_get_object(**kwargs):
+        calls.append(kwargs)
+        if len(calls) < 3:
+            raise EndpointConnectionError(endpoint_url="https://s3")
+        return get_object(**kwargs)
+
+    monkeypatch.setattr(client, "get_object", flaky_get_object)
+    assert index_handler.fetch_object("1.txt") == b"foo"
+    assert len(calls) == 3
+
+
+def test_local_pack(tmp_path):
+    handler = LocalHandler(tmp_path)
+    handler.write_pack(encode_pack([(1, "foo\nbar"), (2, "baz")]))
+    (tmp_path / "3.txt").write_text("qux")
+
+    assert handler.list_file_ids() == [1, 2, 3]
+    assert handler.load_quote(2) == "baz"
+    assert list(handler.iterate_text_pairs()) == [
+        (1, "foo"),
+        (1, "bar"),
+        (2, "baz"),
+        (3, "qux"),
+    ]
+    assert list(handler.iterate_text_pairs([3, 2])) == [(2, "baz"), (3, "qux")]
+    assert handler.add_quote(content="new", source="Seb") == 4
+
+
+def test_aws_pack(s3_resource, bucket_name, s3_test):
+    handler = AWSHandler(s3_resource)
+    handler.write_pack(encode_pack([(1, "foo\nbar"), (2, "baz"), (4, "quux")]))
+    s3_resource.Object(bucket_name, "3.txt").put(Body="qux")
+
+    assert handler.list_file_ids() == [1, 2, 3, 4]
+    assert handler.load_quote(4) == "quux"
+    assert handler.load_quote(3) == "qux"
+    assert list(handler.iterate_text_pairs()) == [
+        (1, b"foo"),
+        (1, b"bar"),
+        (2, b"baz"),
+        (4, b"quux"),
+        (3, b"qux"),
+    ]
+    assert list(handler.iterate_text_pairs([2, 3, 4])) == [
+        (2, b"baz"),
+        (4, b"quux"),
+        (3, b"qux"),
+    ]
+
+
+def test_aws_metrics(s3_resource, bucket_name, s3_test):
+    instrument_s3_client(s3_resource.meta.client)
+    s3_resource.Object(bucket_name, "1.txt").put(Body="foo")
+    handler = AWSHandler(s3_resource)
+    before = S3_REQUESTS.value(operation="GetObject", outcome="success")
+    failed = S3_REQUESTS.value(operation="GetObject", outcome="error")
+
+    assert handler.load_quote(1) == "foo"
+    assert handler.load_quote(2) == ""
+    assert S3_REQUESTS.value(operation="GetObject", outcome="success") == before + 1
+    assert S3_REQUESTS.value(operation="GetObject", outcome="error") > failed
+
+
+def test_local_documents(tmp_path):
+    handler = LocalHandler(tmp_path)
+    assert handler.load_documents("documents") is None
+
+    documents = {2: Document("", "'foo'", "Bar"), 1: Document("On...", "'baz'", "")}
+    handler.write_snapshot({"0": [1, 2]}, {"foo": 0}, None, documents)
+    assert "documents" in handler.load_manifest()
+    store = handler.load_documents("documents")
+    assert list(store) == sorted(documents.items())
+
+
+def test_aws_documents(s3_resource, bucket_name, s3_test):
+    handler = AWSHandler(s3_resource)
+    assert handler.load_documents("documents") is None
+
+    handler.write_documents(
+        "documents-test.qdoc", encode_documents([(1, Document("", "'foo'", "Bar"))])
+    )
+    assert handler.load_documents("documents").get(1) == ("", "'foo'", "Bar")
+
+
+def test_local_write_file(tmp_path):
+    handler = LocalHandler(tmp_path / "quotes")
+    (tmp_path / "quotes").mkdir()
+    path = tmp_path / "built.json"
+    path.write_text("{}")
+    name = handler.write_file("index", path)
+    assert name.startswith("index-") and name.endswith(".json")
+    assert not path.exists()
+    assert (tmp_path / "quotes" / name).read_text() == "{}"
+
+
+def test_aws_write_file(s3_resource, bucket_name, s3_test, tmp_path):
+    handler = AWSHandler(s3_resource)
+    path = tmp_path / "binary-index.qidx"
+    data = encode_index({0: [1]}, {"foo": 0})
+    path.write_bytes(data)
+    s3_key = handler.write_file("binary-index", path)
+    assert s3_key.startswith("binary-index-") and s3_key.endswith(".qidx")
+    assert s3_resource.Object(bucket_name, s3_key).get()["Body"].read() == data
+
+
+def test_local_update_delta_concurrent(tmp_path):
+    handler = LocalHandler(tmp_path)
+
+    def add(file_id):
+        handler.update_delta(
+            lambda delta: {"file_ids": delta.get("file_ids", []) + [file_id]}
+        )
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(add, range(40)))
+    assert sorted(handler.load_delta()["file_ids"]) == list(range(40))
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_local_latest_name(tmp_path):
+    handler = LocalHandler(tmp_path)
+    assert handler.latest_name("index") is None
+    handler.write_index("index", {"foo": [1]})
+    first = handler.latest_name("index")
+    handler.write_index("index", {"foo": [2]})
+    assert handler.latest_name("index") > first
+
+
+def test_aws_latest_name(s3_resource, bucket_name, s3_test):
+    handler = AWSHandler(s3_resource)
+    assert handler.latest_name("index") is None
+    handler.write_index("index-2021-05-27--12:00", {"foo": [1]})
+    handler.write_index("index-2021-05-28--12:00", {"foo": [2]})
+    assert handler.latest_name("index") == "index-2021-05-28--12:00"
+
+
+def test_local_manifest_read_while_written(tmp_path):
+    handler = LocalHandler(tmp_path)
+    manifest = {"version": "1", **{f"shard-{i}": "x" * 100 for i in range(10_000)}}
+    handler.write_manifest(manifest)
+
+    def write(_):
+        handler.write_manifest(manifest)
+
+    def read(_):
+        # Never a partially written file
+        assert handler.load_manifest() == manifest
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        writes = executor.map(write, range(20))
+        reads = executor.map(read, range(100))
+        list(writes), list(reads)
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_aws_update_delta(s3_resource, bucket_name, s3_test):
+    index_handler = AWSHandler(s3_resource)
+    assert index_handler.update_delta(lambda delta: {"file_ids": [1]}) == {
+        "file_ids": [1]
+    }
+    assert index_handler.load_delta() == {"file_ids": [1]}
+
+
+def test_client_supports_conditional_writes():
+    # Ingestion and delta updates rely on conditional puts, which botocore
+    # only accepts from 1.35.69, see the Pipfile
+    client = boto3.client("s3", region_name="us-east-1")
+    members = client.meta.service_model.operation_model("PutObject").input_shape
+    assert {"IfMatch", "IfNoneMatch"} <= set(members.members)
+
+
+def test_aws_snapshots_in_the_same_minute(s3_resource, bucket_name, s3_test):
+    index_handler = AWSHandler(s3_resource)
+    index_handler.write_snapshot({0: [1]}, {"foo": 0})
+    first = index_handler.load_binary_index("binary-index")
+    index_handler.write_snapshot({0: [2]}, {"foo": 0})
+    # A new name, so the cached download of the first is not served
+    assert index_handler.load_binary_index("binary-index").postings(0) == [2]
+    assert first.postings(0) == [1]
+
+
+def test_aws_stream_pack(s3_resource, bucket_name, s3_test, monkeypatch):
+    quotes = [(1, "foo\nbar"), (2, ""), (3, "baz"), (5, "quux " * 10)]
+    handler = AWSHandler(s3_resource)
+    handler.write_pack(encode_pack(quotes))
+    # Quotes straddle chunks, and chunks hold several quotes
+    monkeypatch.setattr("src.handler.PACK_CHUNK_SIZE", 4)
+    pack = handler.load_pack_table()
+    assert [
+        (file_id, data.decode()) for file_id, data in handler.stream_pack(pack)
+    ] == quotes
+    assert list(handler.iterate_text_pairs())[:3] == [
+        (1, b"foo"),
+        (1, b"bar"),
+        (3, b"baz"),
+    ]
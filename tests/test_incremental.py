@@ -0,0 +1,132 @@
+import json
+
+from src.documents import Document
+from src.handler import LocalHandler
+from src.incremental import (
+    add_quote,
+    add_quotes,
+    add_to_delta,
+    compact_index,
+    empty_delta,
+    load_term_dictionary,
+    merge_occurrences,
+    prune_delta,
+)
+
+
+def test_add_to_delta():
+    delta = add_to_delta(empty_delta(), iter(((3, "Foo, bar"), (1, b"bar"))))
+    assert delta == {
+        "file_ids": [1, 3],
+        "postings": {"foo": [3], "bar": [1, 3]},
+        "positions": {"foo": {"3": [0]}, "bar": {"1": [0], "3": [1]}},
+        "documents": {"3": ["", "", "Foo, bar"], "1": ["", "", "bar"]},
+    }
+
+
+def test_prune_delta():
+    delta = {
+        "file_ids": [1, 3],
+        "postings": {"foo": [3], "bar": [1, 3]},
+        "positions": {"foo": {"3": [0]}, "bar": {"1": [0], "3": [1]}},
+        "documents": {"3": ["", "", "Foo, bar"], "1": ["", "", "bar"]},
+    }
+    assert prune_delta(delta, [3]) == {
+        "file_ids": [1],
+        "postings": {"bar": [1]},
+        "positions": {"bar": {"1": [0]}},
+        "documents": {"1": ["", "", "bar"]},
+    }
+
+
+def test_add_quote_and_compact(tmp_path):
+    (tmp_path / "1.txt").write_text("'Some quote'\nAuthor")
+    (tmp_path / "index-2021-01-01--00:00.json").write_text(
+        json.dumps({"0": [1], "1": [1], "2": [1]})
+    )
+    (tmp_path / "word-ids-2021-01-01--00:00.json").write_text(
+        json.dumps({"some": 0, "quote": 1, "author": 2})
+    )
+    (tmp_path / "positions-2021-01-01--00:00.json").write_text(
+        json.dumps({"0": {"1": [0]}, "1": {"1": [1]}, "2": {"1": [3]}})
+    )
+    handler = LocalHandler(tmp_path)
+
+    file_id = add_quote(handler, content="another quote", source="Author")
+    assert file_id == 2
+    delta = handler.load_delta()
+    assert delta["file_ids"] == [2]
+    assert delta["postings"] == {"another": [2], "quote": [2], "author": [2]}
+    assert delta["positions"]["author"] == {"2": [3]}
+
+    compact_index(handler)
+    assert handler.load_delta() == empty_delta()
+    index = handler.load_binary_index("binary-index")
+    assert index.postings(index.word_id("quote")) == [1, 2]
+    assert index.postings(index.word_id("another")) == [2]
+    assert index.word_id("another") == 3
+    assert index.positions(index.word_id("quote")) == {1: [1], 2: [1]}
+
+
+def test_add_quotes_one_delta_write(tmp_path):
+    (tmp_path / "1.txt").write_text("'Some quote'\nAuthor")
+    handler = LocalHandler(tmp_path)
+    writes = []
+    write_delta = handler.write_delta
+    handler.write_delta = lambda delta: writes.append(delta) or write_delta(delta)
+
+    quotes = [{"content": f"quote {ind}", "source": "Author"} for ind in range(5)]
+    assert add_quotes(handler, quotes) == [2, 3, 4, 5, 6]
+    assert len(writes) == 1
+    delta = handler.load_delta()
+    assert delta["file_ids"] == [2, 3, 4, 5, 6]
+    assert delta["postings"]["quote"] == [2, 3, 4, 5, 6]
+    assert delta["documents"]["6"] == ["", "'quote 4'", "Author"]
+    assert add_quotes(handler, []) == []
+
+
+def test_merge_occurrences():
+    assert merge_occurrences([1, 1, 4], {"2": [0, 3], "5": [1]}) == [1, 1, 2, 2, 4, 5]
+
+
+def test_compact_keeps_term_frequencies(tmp_path):
+    (tmp_path / "1.txt").write_text("'War is war is war'\nAuthor")
+    handler = LocalHandler(tmp_path)
+    handler.write_snapshot(
+        {"0": [1, 1, 1], "1": [1, 1], "2": [1]}, {"war": 0, "is": 1, "author": 2}, {}
+    )
+
+    add_quote(handler, content="war war and peace", source="Author")
+    compact_index(handler)
+    assert handler.load_index("index")["0"] == [1, 1, 1, 2, 2]
+    assert handler.load_index("doc-lengths") == {"1": 6, "2": 5}
+
+
+def test_compact_documents(tmp_path):
+    (tmp_path / "1.txt").write_text("'Some quote'\nAuthor")
+    handler = LocalHandler(tmp_path)
+    handler.write_snapshot(
+        {"0": [1]}, {"quote": 0}, None, {1: Document("", "'Some quote'", "Author")}
+    )
+
+    add_quote(handler, lead_in="On more", content="another quote", source="Writer")
+    assert handler.load_delta()["documents"] == {
+        "2": ["On more...", "'another quote'", "Writer"]
+    }
+
+    compact_index(handler)
+    documents = handler.load_documents("documents")
+    assert documents.get(1) == ("", "'Some quote'", "Author")
+    assert documents.get(2) == ("On more...", "'another quote'", "Writer")
+
+
+def test_load_term_dictionary(tmp_path, caplog):
+    handler = LocalHandler(tmp_path)
+    assert load_term_dictionary(handler) == {}
+    # A first build has no word IDs to load, which is not an error
+    assert not [record for record in caplog.records if record.levelname == "ERROR"]
+
+    handler.write_snapshot({"0": [1], "4": [1]}, {"war": 0, "peace": 4}, {})
+    terms = load_term_dictionary(handler)
+    assert terms == {"war": 0, "peace": 4}
+    assert terms["and"] == 5
@@ -1,53 +1,67 @@
 import unittest
-from collections import defaultdict
-import itertools
+from functools import partial
+from pathlib import Path
+import tempfile
 
 from src import index
+from src.handler import LocalHandler
+from src.terms import TermDictionary
 
 
 class BasicTestCase(unittest.TestCase):
-    """Base test class to override the module level variable
-    WORD_ID_MAP for each test
+    """Base test class creating a word ID map for each test, as each build
+    creates its own
     """
 
     def setUp(self):
-        index.WORD_ID_MAP = defaultdict(itertools.count().__next__)
+        self.word_id_map = TermDictionary()
 
 
 class TestWordToId(BasicTestCase):
     def test(self):
-        self.assertEqual(0, index.WORD_ID_MAP["foo"])
-        self.assertEqual(1, index.WORD_ID_MAP["bar"])
-        self.assertEqual(0, index.WORD_ID_MAP["foo"])
-        self.assertEqual(0, index.WORD_ID_MAP["foo"])
-        self.assertEqual(2, index.WORD_ID_MAP["baz"])
+        self.assertEqual(0, self.word_id_map["foo"])
+        self.assertEqual(1, self.word_id_map["bar"])
+        self.assertEqual(0, self.word_id_map["foo"])
+        self.assertEqual(0, self.word_id_map["foo"])
+        self.assertEqual(2, self.word_id_map["baz"])
+
+    def test_builds_do_not_share_word_ids(self):
+        index.create_inverted_index(iter(((1, "foo bar"),)), self.word_id_map)
+        word_id_map = TermDictionary()
+        self.assertDictEqual(
+            {0: [2]},
+            dict(index.create_inverted_index(iter(((2, "baz"),)), word_id_map)),
+        )
+        self.assertEqual({"baz": 0}, word_id_map)
 
 
 class TestGetTextWordIds(BasicTestCase):
     def test_empty(self):
-        it = index.get_text_word_ids("")
+        it = index.get_text_word_ids("", self.word_id_map)
         with self.assertRaises(StopIteration):
             next(it)
 
     def test(self):
-        it = index.get_text_word_ids("this is a line index this line")
+        it = index.get_text_word_ids("this is a line index this line", self.word_id_map)
         for ind in range(0, 5):
             self.assertEqual(ind, next(it))
 
     def test_dirty(self):
-        it = index.get_text_word_ids('This is a line. Index this "line"')
+        it = index.get_text_word_ids(
+            'This is a line. Index this "line"', self.word_id_map
+        )
         for ind in range(0, 5):
             self.assertEqual(ind, next(it))
 
 
 class TestGetWordFilePairs(BasicTestCase):
     def test_empty(self):
-        it = index.get_word_file_pairs(1, "")
+        it = index.get_word_file_pairs(1, "", self.word_id_map)
         with self.assertRaises(StopIteration):
             next(it)
 
     def test(self):
-        it = index.get_word_file_pairs(1, "this is a line")
+        it = index.get_word_file_pairs(1, "this is a line", self.word_id_map)
         for ind in range(4):
             self.assertEqual((ind, 1), next(it))
 
@@ -56,6 +70,7 @@ class TestGetWordFilePairs(BasicTestCase):
             2,
             """this is a line
 this is another line""",
+            self.word_id_map,
         )
         self.assertEqual((0, 2), next(it))
         self.assertEqual((1, 2), next(it))
@@ -92,5 +107,97 @@ class TestCreateInvertedIndex(BasicTestCase):
             10: [3],
         }
         self.assertDictEqual(
-            expected_output, dict(index.create_inverted_index(file_line_it))
+            expected_output,
+            dict(index.create_inverted_index(file_line_it, self.word_id_map)),
+        )
+
+
+class TestPartition(unittest.TestCase):
+    def test(self):
+        self.assertEqual([[1, 2], [3, 4], [5]], index.partition([1, 2, 3, 4, 5], 3))
+
+    def test_more_partitions_than_items(self):
+        self.assertEqual([[1], [2]], index.partition([1, 2], 4))
+
+
+class TestParallelInvertedIndex(BasicTestCase):
+    def write_quotes(self, path):
+        for file_id, text in enumerate(
+            (
+                "this is a file containing some lines",
+                "yet more lines here",
+                "here is another file",
+                "this is a file containing some lines",
+            ),
+            start=1,
+        ):
+            (path / f"{file_id}.txt").write_text(text)
+
+    def test_merge_partial_indexes(self):
+        partial_1 = index.build_partial_index(iter(((1, "foo bar"), (2, "bar"))))
+        partial_2 = index.build_partial_index(iter(((3, "baz bar"),)))
+        self.assertEqual((["foo", "bar"], {0: [1], 1: [1, 2]}), partial_1)
+
+        merged = index.merge_partial_indexes([partial_1, partial_2], self.word_id_map)
+        # New words are assigned IDs in sorted order
+        self.assertDictEqual({0: [1, 2, 3], 1: [3], 2: [1]}, dict(merged))
+        self.assertEqual({"bar": 0, "baz": 1, "foo": 2}, self.word_id_map)
+
+    def test_merge_keeps_existing_ids(self):
+        partial_1 = index.build_partial_index(iter(((1, "foo bar"), (2, "bar"))))
+        word_id_map = TermDictionary({"foo": 7})
+        merged = index.merge_partial_indexes([partial_1], word_id_map)
+        self.assertDictEqual({7: [1], 8: [1, 2]}, dict(merged))
+        self.assertEqual({"foo": 7, "bar": 8}, word_id_map)
+
+    def test_matches_sequential(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir)
+            self.write_quotes(path)
+            sequential = index.create_inverted_index(
+                LocalHandler(path).iterate_text_pairs(), self.word_id_map
+            )
+            sequential = {
+                word: sequential[word_id] for word, word_id in self.word_id_map.items()
+            }
+
+            word_id_map = TermDictionary()
+            parallel = index.create_inverted_index_parallel(
+                partial(LocalHandler, path), word_id_map, processes=3
+            )
+            parallel = {
+                word: parallel[word_id] for word, word_id in word_id_map.items()
+            }
+
+        self.assertDictEqual(sequential, parallel)
+
+    def test_documents(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir)
+            (path / "1.txt").write_text("On war...\n'War and peace.'\nTolstoy")
+            (path / "2.txt").write_text("'Peace.'\nAnonymous")
+            (path / "3.txt").write_text("'War.'\nAnonymous")
+            documents = {}
+            index.create_inverted_index_parallel(
+                partial(LocalHandler, path),
+                self.word_id_map,
+                processes=2,
+                documents=documents,
+            )
+
+        self.assertEqual(
+            ("On war...", "'War and peace.'", "Tolstoy"), tuple(documents[1])
+        )
+        self.assertEqual([1, 2, 3], sorted(documents))
+
+
+class TestCreatePositionalIndex(BasicTestCase):
+    def test(self):
+        file_line_it = iter(((2, "foo bar"), (1, "bar"), (2, "bar baz")))
+        expected_output = {0: {2: [0]}, 1: {1: [0], 2: [1, 3]}, 2: {2: [4]}}
+        positional_index = index.create_positional_index(file_line_it, self.word_id_map)
+        self.assertDictEqual(expected_output, dict(positional_index))
+        self.assertDictEqual(
+            {0: [2], 1: [1, 2, 2], 2: [2]},
+            index.postings_from_positions(positional_index),
         )
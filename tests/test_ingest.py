@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from src.handler import LocalHandler, form_quote
+from src.ingest import ingest, parse_json_lines, parse_text, read_quotes
+
+TEXT = """On war...
+'War is peace.'
+George Orwell
+
+'Freedom is slavery.'
+George Orwell
+
+
+'Ignorance is strength.'
+"""
+
+
+def test_parse_text():
+    quotes = list(parse_text(TEXT.splitlines(keepends=True)))
+    assert quotes == [
+        {"lead_in": "On war", "content": "War is peace.", "source": "George Orwell"},
+        {"lead_in": "", "content": "Freedom is slavery.", "source": "George Orwell"},
+        {"lead_in": "", "content": "Ignorance is strength."},
+    ]
+    # Quotes are written back as they were read
+    assert form_quote(**quotes[0]) == TEXT.split("\n\n")[0]
+
+
+def test_parse_json_lines():
+    lines = [
+        json.dumps({"content": "War is peace.", "source": "George Orwell"}),
+        "",
+        json.dumps({"lead_in": None, "content": "Freedom is slavery."}),
+    ]
+    assert list(parse_json_lines(lines)) == [
+        {"content": "War is peace.", "source": "George Orwell"},
+        {"content": "Freedom is slavery."},
+    ]
+
+
+def test_ingest_batches(tmp_path):
+    quotes_path = tmp_path / "quotes"
+    quotes_path.mkdir()
+    handler = LocalHandler(quotes_path)
+    path = tmp_path / "main.txt"
+    path.write_text(TEXT)
+
+    file_ids = ingest(handler, read_quotes(path), batch_size=2)
+    assert file_ids == [1, 2, 3]
+    assert handler.load_quote(3) == "'Ignorance is strength.'\nAnonymous\n"
+    delta = handler.load_delta()
+    assert delta["file_ids"] == [1, 2, 3]
+    assert delta["postings"]["orwell"] == [1, 2]
+
+
+@pytest.mark.parametrize(
+    "line, error",
+    [
+        ('{"source": "George Orwell"}', "Line 2: Missing content"),
+        ('{"content": "War is peace.", "author": "Orwell"}', "Line 2: Unexpected"),
+        ('{"content": ["War is peace."]}', "Line 2: Field content"),
+        ('["War is peace."]', "Line 2: Expected an object"),
+        ('{"content": "War is peace."', "Line 2: Expecting"),
+    ],
+)
+def test_ingest_rejects_invalid_lines(tmp_path, line, error):
+    quotes_path = tmp_path / "quotes"
+    quotes_path.mkdir()
+    handler = LocalHandler(quotes_path)
+    path = tmp_path / "quotes.jsonl"
+    path.write_text(json.dumps({"content": "Freedom is slavery."}) + "\n" + line)
+
+    with pytest.raises(ValueError, match=error):
+        ingest(handler, read_quotes(path), batch_size=1)
+    # The valid first line was not added either
+    assert handler.list_file_ids() == []
@@ -0,0 +1,86 @@
+from cachetools import cached
+import pytest
+
+from src.metrics import (
+    CACHE_LOOKUPS,
+    CountedTTLCache,
+    Counter,
+    Gauge,
+    Histogram,
+    Registry,
+)
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def test_counter(registry):
+    counter = Counter("requests", "Requests", registry=registry)
+    counter.inc(route="/")
+    counter.inc(2, route="/")
+    counter.inc(route='/"q"')
+    assert counter.value(route="/") == 3
+    assert counter.value(route="/missing") == 0
+    assert registry.render() == (
+        "# HELP requests Requests\n"
+        "# TYPE requests counter\n"
+        'requests_total{route="/"} 3.0\n'
+        'requests_total{route="/\\"q\\""} 1.0\n'
+    )
+
+
+def test_gauge(registry):
+    Gauge("size", "Size", lambda: 5, registry=registry)
+    assert registry.render().endswith("size 5.0\n")
+
+
+def test_histogram(registry):
+    histogram = Histogram("latency", "Latency", buckets=(0.1, 1), registry=registry)
+    histogram.observe(0.05, phase="rank")
+    histogram.observe(0.1, phase="rank")
+    histogram.observe(5, phase="rank")
+    with histogram.time(phase="load"):
+        pass
+    assert histogram.count(phase="rank") == 3
+    assert histogram.count(phase="load") == 1
+
+    lines = registry.render().splitlines()
+    assert lines[:7] == [
+        "# HELP latency Latency",
+        "# TYPE latency histogram",
+        'latency_bucket{phase="rank",le="0.1"} 2.0',
+        'latency_bucket{phase="rank",le="1.0"} 2.0',
+        'latency_bucket{phase="rank",le="+Inf"} 3.0',
+        'latency_sum{phase="rank"} 5.15',
+        'latency_count{phase="rank"} 3.0',
+    ]
+
+
+def test_histogram_decorator(registry):
+    histogram = Histogram("calls", "Calls", registry=registry)
+
+    @histogram.time(func="double")
+    def double(value):
+        return value * 2
+
+    assert double(2) == 4
+    assert double(3) == 6
+    assert histogram.count(func="double") == 2
+
+
+def test_counted_ttl_cache():
+    calls = []
+
+    @cached(cache=CountedTTLCache("test", maxsize=10, ttl=60))
+    def load(key):
+        calls.append(key)
+        return key
+
+    hits = CACHE_LOOKUPS.value(cache="test", result="hit")
+    misses = CACHE_LOOKUPS.value(cache="test", result="miss")
+    assert [load(1), load(1), load(2)] == [1, 1, 2]
+    assert calls == [1, 2]
+    assert CACHE_LOOKUPS.value(cache="test", result="hit") == hits + 1
+    assert CACHE_LOOKUPS.value(cache="test", result="miss") == misses + 2
@@ -0,0 +1,35 @@
+import pytest
+
+from src.pack import HEADER, PackReader, encode_pack, table_size
+
+QUOTES = [(3, "third\nquote"), (1, "first"), (2, "über")]
+
+
+def test_pack_roundtrip():
+    reader = PackReader(encode_pack(QUOTES))
+    assert len(reader) == 3
+    assert reader.file_ids() == [1, 2, 3]
+    assert list(reader) == sorted(QUOTES)
+    assert reader.get(2) == "über"
+    assert reader.get(4) is None
+
+
+def test_table_only():
+    data = encode_pack(QUOTES)
+    size = table_size(data[: HEADER.size])
+    reader = PackReader(data[:size])
+    offset, length = reader.entry(3)
+    assert data[offset : offset + length].decode() == "third\nquote"
+    # Bodies are contiguous in file ID order
+    assert reader.entry(1)[0] == size
+
+
+def test_open_mmap(tmp_path):
+    path = tmp_path / "quotes.qpak"
+    path.write_bytes(encode_pack(QUOTES))
+    assert PackReader.open(path).get(1) == "first"
+
+
+def test_bad_magic():
+    with pytest.raises(ValueError):
+        PackReader(b"QIDX" + bytes(32))
@@ -0,0 +1,53 @@
+import pytest
+
+from src.postings import CompactPostings, merge_postings, run_lengths
+
+OCCURRENCES = {"0": [1, 1, 4], "2": [3], "3": [1, 3, 3, 3, 300]}
+
+
+def test_merge_postings():
+    assert merge_postings([1, 3, 3, 5], [2, 3], []) == [1, 2, 3, 5]
+
+
+def test_run_lengths():
+    assert run_lengths([1, 1, 3, 4, 4, 4]) == ([1, 3, 4], [2, 1, 3])
+    assert run_lengths([]) == ([], [])
+
+
+def test_compact_postings():
+    postings = CompactPostings.from_occurrences(OCCURRENCES)
+    assert list(postings["0"]) == list(postings[0]) == [1, 4]
+    assert list(postings[3]) == [1, 3, 300]
+    file_ids, frequencies = postings.entry(3)
+    assert (list(file_ids), list(frequencies)) == ([1, 3, 300], [1, 3, 1])
+    assert postings.document_frequency("3") == 3
+
+
+@pytest.mark.parametrize("word_id", [1, "1", 4, -1])
+def test_missing_word(word_id):
+    postings = CompactPostings.from_occurrences(OCCURRENCES)
+    assert postings.get(word_id) is None
+    assert word_id not in postings
+    assert postings.document_frequency(word_id) == 0
+    with pytest.raises(KeyError):
+        postings.entry(word_id)
+
+
+def test_mapping():
+    postings = CompactPostings.from_occurrences(OCCURRENCES)
+    assert list(postings) == [0, 2, 3]
+    assert len(postings) == 3
+    assert {word_id: list(ids) for word_id, ids in postings.items()} == {
+        0: [1, 4],
+        2: [3],
+        3: [1, 3, 300],
+    }
+    # Offsets for word IDs 0 to 3 and the end, then a file ID and frequency
+    # for each distinct (word, file) pair
+    assert postings.nbytes == 5 * 8 + 6 * 4 + 6 * 4
+
+
+def test_empty():
+    postings = CompactPostings.from_occurrences({})
+    assert len(postings) == 0
+    assert postings.get(0) is None
@@ -0,0 +1,40 @@
+from threading import Event, Thread
+
+from src.profiler import SamplingProfiler, fold_stack
+
+
+def wait_for(event):
+    event.wait()
+
+
+def test_fold_stack():
+    assert fold_stack(None) == ""
+
+
+def test_sample_other_threads():
+    event = Event()
+    thread = Thread(target=wait_for, args=(event,))
+    thread.start()
+    profiler = SamplingProfiler()
+    try:
+        profiler.sample()
+        profiler.sample()
+    finally:
+        event.set()
+        thread.join()
+
+    assert profiler.samples == 2
+    stacks = [line for line in profiler.folded().splitlines() if "wait_for" in line]
+    assert len(stacks) == 1
+    assert stacks[0].endswith(" 2")
+
+    profiler.reset()
+    assert profiler.folded() == ""
+
+
+def test_start_stop():
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    assert profiler.running
+    profiler.stop()
+    assert not profiler.running
@@ -0,0 +1,108 @@
+import pytest
+
+from src.query import (
+    QueryError,
+    Searchable,
+    difference,
+    gallop,
+    intersect,
+    parse_query,
+    search,
+)
+
+
+class DictSearchable(Searchable):
+    """Searchable over a positional index keyed by word"""
+
+    def __init__(self, positional_index):
+        self.positional_index = positional_index
+
+    def postings(self, word):
+        return sorted(self.positional_index.get(word, {}))
+
+    def positions(self, word):
+        return self.positional_index.get(word, {})
+
+    def all_file_ids(self):
+        return sorted({ind for pos in self.positional_index.values() for ind in pos})
+
+
+INDEX = DictSearchable(
+    {
+        "war": {1: [0], 2: [0], 3: [2]},
+        "and": {1: [1], 3: [1]},
+        "peace": {1: [2], 3: [0], 4: [0]},
+        "tolstoy": {1: [4]},
+    }
+)
+
+
+def test_gallop():
+    seq = [1, 3, 5, 7, 9, 11, 13]
+    assert gallop(seq, 0) == 0
+    assert gallop(seq, 7) == 3
+    assert gallop(seq, 8, 2) == 4
+    assert gallop(seq, 14) == len(seq)
+
+
+def test_intersect():
+    assert intersect([1, 5, 9], list(range(0, 100))) == [1, 5, 9]
+    assert intersect([2, 4, 6, 8], [1, 4, 4, 8, 10]) == [4, 8]
+    assert intersect([], [1, 2]) == []
+
+
+def test_difference():
+    assert difference([1, 2, 3, 4], [2, 4, 6]) == [1, 3]
+
+
+def test_parse_query():
+    assert parse_query("War peace") == ("and", ("term", "war"), ("term", "peace"))
+    assert parse_query('"war and" OR NOT peace') == (
+        "or",
+        ("phrase", ["war", "and"]),
+        ("not", ("term", "peace")),
+    )
+
+
+def test_parse_field_query():
+    assert parse_query("source:Tolstoy war") == (
+        "and",
+        ("field", "source", ["tolstoy"]),
+        ("term", "war"),
+    )
+    assert parse_query('NOT lead_in:"On war"') == (
+        "not",
+        ("field", "lead_in", ["on", "war"]),
+    )
+    # Unknown fields and fields without a value are plain words
+    assert parse_query("source:") == ("term", "source")
+
+
+def test_field_search_unsupported():
+    with pytest.raises(QueryError):
+        search("source:tolstoy", INDEX)
+
+
+@pytest.mark.parametrize("query", ["", "(war", "war)", "war OR", "AND"])
+def test_parse_query_invalid(query):
+    with pytest.raises(QueryError):
+        parse_query(query)
+
+
+@pytest.mark.parametrize(
+    "query,expected",
+    [
+        ("war", [1, 2, 3]),
+        ("war AND peace", [1, 3]),
+        ("war peace", [1, 3]),
+        ("war OR tolstoy", [1, 2, 3]),
+        ("peace NOT war", [4]),
+        ("NOT war", [4]),
+        ('"war and peace"', [1]),
+        ('"peace and war"', [3]),
+        ("(war OR peace) NOT tolstoy", [2, 3, 4]),
+        ("missing", []),
+    ],
+)
+def test_search(query, expected):
+    assert search(query, INDEX) == expected
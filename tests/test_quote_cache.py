@@ -0,0 +1,55 @@
+from src.handler import LocalHandler
+from src.quote_cache import QuoteCache
+
+
+def write_quotes(path, n_quotes):
+    for file_id in range(1, n_quotes + 1):
+        (path / f"{file_id}.txt").write_text(f"'Quote {file_id}'\nAuthor")
+
+
+def test_hits_and_misses(tmp_path):
+    write_quotes(tmp_path, 2)
+    quote_cache = QuoteCache(LocalHandler(tmp_path))
+
+    assert quote_cache.get(1) == "'Quote 1'\nAuthor"
+    assert quote_cache.get("1") == "'Quote 1'\nAuthor"
+    assert quote_cache.get(2) == "'Quote 2'\nAuthor"
+    stats = quote_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["quotes"]) == (1, 2, 2)
+
+    # Cached quotes are served without touching storage
+    (tmp_path / "1.txt").unlink()
+    assert quote_cache.get(1) == "'Quote 1'\nAuthor"
+
+
+def test_evicts_least_recently_used_by_size(tmp_path):
+    write_quotes(tmp_path, 3)
+    quote_size = len("'Quote 1'\nAuthor".encode())
+    quote_cache = QuoteCache(LocalHandler(tmp_path), maxsize=2 * quote_size)
+
+    quote_cache.get(1)
+    quote_cache.get(2)
+    quote_cache.get(1)
+    quote_cache.get(3)
+    assert sorted(quote_cache.cache) == [1, 3]
+    assert quote_cache.stats()["bytes"] == 2 * quote_size
+
+
+def test_preload(tmp_path):
+    write_quotes(tmp_path, 3)
+    quote_cache = QuoteCache(LocalHandler(tmp_path))
+
+    assert quote_cache.preload() == 3
+    assert quote_cache.get(2) == "'Quote 2'\nAuthor"
+    assert quote_cache.stats()["misses"] == 0
+
+
+def test_lookup_without_loading(tmp_path):
+    write_quotes(tmp_path, 1)
+    quote_cache = QuoteCache(LocalHandler(tmp_path))
+
+    assert quote_cache.lookup(1) is None
+    assert quote_cache.load(1) == "'Quote 1'\nAuthor"
+    assert quote_cache.lookup("1") == "'Quote 1'\nAuthor"
+    stats = quote_cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
@@ -0,0 +1,101 @@
+import pytest
+
+from src.query import QueryError
+from src.ranking import (
+    Rankable,
+    count_occurrences,
+    idf,
+    lookup_frequencies,
+    query_terms,
+    rank,
+)
+from src.query import parse_query
+
+
+class DictRankable(Rankable):
+    """Rankable over a mapping of file IDs to their words"""
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def postings(self, word):
+        return sorted(ind for ind, words in self.documents.items() if word in words)
+
+    def positions(self, word):
+        return {}
+
+    def all_file_ids(self):
+        return sorted(self.documents)
+
+    def term_frequencies(self, word, file_ids):
+        return [self.documents[ind].count(word) for ind in file_ids]
+
+    def document_length(self, file_id):
+        return len(self.documents[file_id])
+
+    def document_count(self):
+        return len(self.documents)
+
+    def average_document_length(self):
+        return sum(map(len, self.documents.values())) / len(self.documents)
+
+
+INDEX = DictRankable(
+    {
+        1: ["the", "war"],
+        2: ["the", "war", "war", "and", "peace"],
+        3: ["the", "peace"],
+        4: ["the", "war", "is", "over", "the", "long", "war", "of", "the", "world"],
+        5: ["the", "end"],
+    }
+)
+
+
+def test_count_occurrences():
+    assert count_occurrences([1, 1, 3, 4, 4, 4, 9], [1, 2, 4, 9, 10]) == [2, 0, 3, 1, 0]
+
+
+def test_lookup_frequencies():
+    assert lookup_frequencies([1, 3, 4, 9], [2, 1, 3, 1], [1, 2, 4, 9, 10]) == [
+        2,
+        0,
+        3,
+        1,
+        0,
+    ]
+
+
+def test_query_terms():
+    node = parse_query('war OR "war and peace" NOT end')
+    assert query_terms(node) == ["war", "and", "peace"]
+
+
+def test_idf_is_positive():
+    assert idf(5, 5) > 0
+    assert idf(5, 1) > idf(5, 4)
+
+
+def test_rank():
+    total, top = rank("war", INDEX, k=2)
+    assert total == 3
+    # Two occurrences in a medium length quote beat one in a short quote
+    assert [file_id for file_id, _ in top] == [2, 1]
+    assert top[0][1] > top[1][1] > 0
+
+
+def test_rank_pages():
+    total, everything = rank("the", INDEX, k=5)
+    assert total == 5
+    _, page = rank("the", INDEX, k=2, offset=2)
+    assert page == everything[2:4]
+
+
+def test_rank_rare_words_count_more():
+    _, top = rank("war OR peace", INDEX, k=5)
+    assert top[0][0] == 2
+    assert [file_id for file_id, _ in top][-1] == 4
+
+
+def test_rank_invalid():
+    with pytest.raises(QueryError):
+        rank("(war", INDEX)
@@ -0,0 +1,77 @@
+import time
+
+from src.reload import Reloader
+
+
+class Source:
+    """Snapshots which are only replaced when the version is bumped"""
+
+    def __init__(self):
+        self.version = "1"
+        self.loads = 0
+
+    def load_manifest(self):
+        return {"version": self.version}
+
+    def load(self, manifest):
+        self.loads += 1
+        return {"version": manifest["version"]}
+
+
+def manifest_version(manifest):
+    return manifest["version"]
+
+
+def test_refresh_on_new_version():
+    source = Source()
+    reloader = Reloader(source.load, source.load_manifest, manifest_version)
+    snapshot = reloader.current
+    assert snapshot == {"version": "1"}
+
+    assert not reloader.refresh()
+    assert source.loads == 1
+
+    source.version = "2"
+    assert reloader.refresh()
+    assert reloader.current == {"version": "2"}
+    assert reloader.version == "2"
+    # Readers holding the old snapshot are unaffected
+    assert snapshot == {"version": "1"}
+
+
+def test_force_refresh():
+    source = Source()
+    reloader = Reloader(source.load, source.load_manifest, lambda manifest: None)
+    assert not reloader.refresh()
+    assert reloader.refresh(force=True)
+    assert source.loads == 2
+
+
+def test_background_poll():
+    source = Source()
+    reloader = Reloader(source.load, source.load_manifest, manifest_version)
+    reloader.start(0.01)
+    source.version = "2"
+    deadline = time.monotonic() + 5
+    while reloader.version != "2" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    reloader.stop()
+    assert reloader.current == {"version": "2"}
+
+
+def test_version_of_loaded_manifest():
+    source = Source()
+
+    def load(manifest):
+        # A new snapshot is published while this one loads
+        source.version = "3"
+        return {"version": manifest["version"]}
+
+    reloader = Reloader(load, source.load_manifest, manifest_version)
+    source.version = "2"
+    assert reloader.refresh()
+    # Labelled with the version it was loaded from, so "3" is still picked up
+    assert reloader.current == {"version": "2"}
+    assert reloader.version == "2"
+    assert reloader.refresh()
+    assert reloader.version == "3"
@@ -0,0 +1,74 @@
+from random import choice
+
+from src.response_cache import RandomPool, ResponseCache, etag_matches, make_etag
+
+
+def test_get_and_put():
+    response_cache = ResponseCache()
+    assert response_cache.get("1", ("quote", 1)) is None
+    response_cache.put("1", ("quote", 1), "foo")
+    assert response_cache.get("1", ("quote", 1)) == "foo"
+    assert response_cache.get("1", ("quote", 2)) is None
+
+
+def test_invalidated_by_version():
+    response_cache = ResponseCache()
+    response_cache.put("1", "key", "foo")
+    assert response_cache.get("2", "key") is None
+    assert len(response_cache) == 0
+
+    # Values of the previous version are never served for the current one
+    response_cache.put("1", "key", "foo")
+    assert response_cache.get("2", "key") is None
+
+
+def test_evicts_beyond_maxsize():
+    response_cache = ResponseCache(maxsize=2)
+    for key in range(3):
+        response_cache.put("1", key, key)
+    assert len(response_cache) == 2
+
+
+def test_etags():
+    etag = make_etag("<html></html>")
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag == make_etag("<html></html>")
+    assert etag != make_etag("<html> </html>")
+
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+
+
+def test_random_pool():
+    pool = RandomPool(maxsize=2, refresh_every=0)
+    pool.add("1", "foo")
+    # Nothing is sampled until the pool is full
+    assert pool.sample("1") is None
+    pool.add("1", "bar")
+    assert pool.sample("1") in ("foo", "bar")
+    # Once full, values replace others
+    pool.add("1", "baz")
+    assert len(pool) == 2
+    assert "baz" in pool.values
+
+    assert pool.sample("2") is None
+    assert len(pool) == 0
+
+
+def test_random_pool_covers_corpus():
+    corpus = list(range(10))
+    pool = RandomPool(maxsize=2, refresh_every=3)
+    served = set()
+    loads = 0
+    for _ in range(1000):
+        value = pool.sample("1")
+        if value is None:
+            value = choice(corpus)
+            pool.add("1", value)
+            loads += 1
+        served.add(value)
+    assert served == set(corpus)
+    # Two in three samples are still served from the pool
+    assert loads < 400
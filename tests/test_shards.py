@@ -0,0 +1,118 @@
+import pytest
+
+from src.api import IndexSearcher, create_snapshot
+from src.binary_index import BinaryIndex, encode_index
+from src.handler import LocalHandler
+from src.incremental import empty_delta
+from src.shards import ShardedIndex, encode_shards, shard_of, split_index
+from src.suggest import Suggester
+
+INVERTED_INDEX = {"0": [1, 1, 2], "1": [2], "2": [3], "3": [1, 3]}
+WORD_ID_MAP = {"war": 0, "peace": 1, "and": 2, "the": 3}
+POSITIONAL_INDEX = {
+    "0": {"1": [0, 2], "2": [1]},
+    "1": {"2": [0]},
+    "2": {"3": [0]},
+    "3": {"1": [1], "3": [1]},
+}
+
+
+def test_split_index():
+    shards = split_index(INVERTED_INDEX, WORD_ID_MAP, POSITIONAL_INDEX, 2)
+    assert shards[0] == (
+        {"0": [1, 1, 2], "2": [3]},
+        {"war": 0, "and": 2},
+        {"0": POSITIONAL_INDEX["0"], "2": POSITIONAL_INDEX["2"]},
+    )
+    assert shards[1][1] == {"peace": 1, "the": 3}
+
+
+def sharded_index(n_shards, loads=None):
+    terms, shards = encode_shards(
+        INVERTED_INDEX, WORD_ID_MAP, POSITIONAL_INDEX, n_shards
+    )
+
+    def load_shard(shard):
+        if loads is not None:
+            loads.append(shard)
+        return BinaryIndex(shards[shard])
+
+    return ShardedIndex(BinaryIndex(terms), n_shards, load_shard)
+
+
+def test_terms_index():
+    terms, _ = encode_shards(INVERTED_INDEX, WORD_ID_MAP, POSITIONAL_INDEX, 2)
+    terms = BinaryIndex(terms)
+    assert dict(terms.word_id_map()) == WORD_ID_MAP
+    # Document frequencies without postings
+    assert terms.document_frequency_at(terms.find("war")) == 2
+    assert terms.postings(0) == []
+    assert len(terms) == 4
+
+
+def test_lazy_loading():
+    loads = []
+    index = sharded_index(3, loads)
+    postings = index.postings_map()
+    assert sorted(postings) == [0, 1, 2, 3]
+    assert loads == []
+
+    assert postings["3"] == [1, 3]
+    assert loads == [shard_of(3, 3)]
+    assert postings[0] == [1, 1, 2]
+    assert postings.entry(0) == ([1, 2], [2, 1])
+    # Each shard is loaded once
+    assert loads == [0]
+    assert index.positions_map()[1] == {2: [0]}
+    assert loads == [0, 1]
+    assert index.loaded == 2
+
+
+def test_missing_shard():
+    index = ShardedIndex(BinaryIndex(encode_index({}, {})), 2, lambda shard: None)
+    assert index.postings_map().get(1) is None
+
+
+@pytest.mark.parametrize("n_shards", [2, 5])
+def test_searcher_matches_unsharded(n_shards):
+    terms = BinaryIndex(
+        encode_shards(INVERTED_INDEX, WORD_ID_MAP, POSITIONAL_INDEX, n_shards)[0]
+    )
+    index = sharded_index(n_shards)
+    sharded = IndexSearcher(
+        create_snapshot(
+            index.postings_map(),
+            terms.word_id_map(),
+            index.positions_map(),
+            {"1": 3, "2": 2, "3": 2},
+            Suggester.from_binary_index(terms),
+        ),
+        empty_delta(),
+    )
+    unsharded = IndexSearcher(
+        create_snapshot(INVERTED_INDEX, WORD_ID_MAP, POSITIONAL_INDEX), empty_delta()
+    )
+    for word in WORD_ID_MAP:
+        assert sharded.postings(word) == unsharded.postings(word)
+        assert sharded.term_frequencies(word, [1, 2, 3]) == (
+            unsharded.term_frequencies(word, [1, 2, 3])
+        )
+        assert sharded.positions(word) == unsharded.positions(word)
+
+
+def test_local_sharded_snapshot(tmp_path):
+    handler = LocalHandler(tmp_path)
+    handler.write_snapshot(INVERTED_INDEX, WORD_ID_MAP, POSITIONAL_INDEX, shards=2)
+    manifest = handler.load_manifest()
+    assert manifest["shards"] == 2
+    assert "binary-index" not in manifest
+    assert dict(handler.load_binary_index("terms").word_id_map()) == WORD_ID_MAP
+    load_shard = handler.shard_loader(manifest)
+    assert load_shard(1).postings(3) == [1, 3]
+    assert load_shard(1).postings(0) is None
+
+    # A newer snapshot does not change the shards of the older one
+    handler.write_manifest({**manifest, "shard-1": "missing.qidx", "shards": 3})
+    assert load_shard(1).postings(3) == [1, 3]
+    assert handler.shard_loader(handler.load_manifest())(1) is None
+    assert handler.shard_loader(handler.load_manifest())(2) is None
@@ -0,0 +1,125 @@
+from functools import partial
+
+import pytest
+
+from src.binary_index import BinaryIndex, encode_index
+from src.handler import LocalHandler
+from src.index import create_inverted_index_parallel, document_lengths
+from src.index import postings_from_positions
+from src.shards import encode_shards
+from src.streaming import create_snapshot_streaming, merge_runs, spill_runs
+from src.terms import TermDictionary
+
+QUOTES = {
+    3: "'The war and the peace'\nLeo Tolstoy",
+    1: "On war...\n'War is peace'\nGeorge Orwell",
+    2: "'Über alles'\nAnonymous",
+    10: "'Peace, peace, peace'\nAnonymous",
+}
+
+
+def write_quotes(path):
+    for file_id, quote in QUOTES.items():
+        (path / f"{file_id}.txt").write_text(quote)
+
+
+def in_memory_build(path, word_id_map):
+    positional_index = create_inverted_index_parallel(
+        partial(LocalHandler, path), word_id_map, 1, positional=True
+    )
+    return postings_from_positions(positional_index), positional_index
+
+
+@pytest.mark.parametrize("memory_budget", [1, 10**9])
+def test_merged_runs_match_in_memory_build(tmp_path, memory_budget):
+    write_quotes(tmp_path)
+    handler = LocalHandler(tmp_path)
+    word_id_map = TermDictionary()
+    _, positional_index = in_memory_build(tmp_path, word_id_map)
+
+    run_dir = tmp_path / "runs"
+    run_dir.mkdir()
+    lengths = {}
+    runs = spill_runs(handler.iterate_text_pairs(), run_dir, memory_budget, lengths)
+    # A budget of a byte spills after every file
+    assert len(runs) == (len(QUOTES) if memory_budget == 1 else 1)
+    merged = {word_id_map[word]: positions for word, positions in merge_runs(runs)}
+    assert merged == positional_index
+    assert lengths == document_lengths(postings_from_positions(positional_index))
+
+
+def test_streaming_snapshot(tmp_path):
+    write_quotes(tmp_path)
+    handler = LocalHandler(tmp_path)
+    word_id_map = TermDictionary()
+    manifest = create_snapshot_streaming(handler, 1, word_id_map)
+
+    assert handler.load_manifest() == manifest
+    memory_word_id_map = TermDictionary()
+    inverted_index, positional_index = in_memory_build(tmp_path, memory_word_id_map)
+    # Both builds assign IDs in sorted order
+    assert word_id_map == memory_word_id_map
+    assert list(word_id_map) == sorted(word_id_map)
+    # JSON round tripped keys are strings
+    assert handler.load_index("index") == {
+        str(word_id): file_ids for word_id, file_ids in inverted_index.items()
+    }
+    assert handler.load_index("positions") == {
+        str(word_id): {str(file_id): pos for file_id, pos in file_positions.items()}
+        for word_id, file_positions in positional_index.items()
+    }
+    assert handler.load_index("word-ids") == word_id_map
+    assert handler.load_index("doc-lengths") == {"1": 7, "2": 3, "3": 7, "10": 4}
+    assert handler.load_documents("documents").get(1) == (
+        "On war...",
+        "'War is peace'",
+        "George Orwell",
+    )
+
+    expected = BinaryIndex(
+        encode_index(inverted_index, word_id_map, positional_index)
+    ).buffer
+    assert handler.load_binary_index("binary-index").buffer[:] == expected
+    vocabulary = handler.load_filter("vocabulary")
+    assert all(word in vocabulary for word in word_id_map)
+    # Only the snapshot is left behind, runs and temporary files are removed
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_streaming_snapshot_sharded(tmp_path):
+    write_quotes(tmp_path)
+    handler = LocalHandler(tmp_path)
+    word_id_map = TermDictionary()
+    manifest = create_snapshot_streaming(handler, 1, word_id_map, shards=3)
+    assert manifest["shards"] == 3
+    assert "binary-index" not in manifest
+
+    inverted_index, positional_index = in_memory_build(tmp_path, TermDictionary())
+    terms, shards = encode_shards(inverted_index, word_id_map, positional_index, 3)
+    # The same bytes as a sharded in-memory build
+    assert handler.open_binary_index(manifest["terms"]).buffer[:] == terms
+    for shard, data in enumerate(shards):
+        index = handler.open_binary_index(manifest[f"shard-{shard}"])
+        assert index.buffer[:] == data
+
+
+def test_streaming_snapshot_empty(tmp_path):
+    handler = LocalHandler(tmp_path)
+    create_snapshot_streaming(handler, 1)
+    assert handler.load_index("index") == {}
+    index = handler.load_binary_index("binary-index")
+    assert len(index) == 0
+    assert len(handler.load_documents("documents")) == 0
+
+
+def test_streaming_keeps_word_ids(tmp_path):
+    write_quotes(tmp_path)
+    handler = LocalHandler(tmp_path)
+    create_snapshot_streaming(handler, 1)
+    first = handler.load_index("word-ids")
+
+    (tmp_path / "11.txt").write_text("'Another peace'\nAnonymous")
+    create_snapshot_streaming(handler, 1)
+    second = handler.load_index("word-ids")
+    assert {word: second[word] for word in first} == first
+    assert second["another"] == max(first.values()) + 1
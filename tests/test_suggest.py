@@ -0,0 +1,37 @@
+from src.binary_index import BinaryIndex, encode_index
+from src.suggest import Suggester
+
+INVERTED_INDEX = {
+    "0": [1, 2, 2, 3],
+    "1": [1],
+    "2": [2, 3],
+    "3": [4],
+    "4": [1, 2, 3, 4],
+    "5": [3],
+}
+WORD_ID_MAP = {"war": 0, "warm": 1, "ward": 2, "peace": 3, "the": 4, "über": 5}
+
+
+def test_suggest():
+    suggester = Suggester.from_index(INVERTED_INDEX, WORD_ID_MAP)
+    assert suggester.suggest("wa") == [("war", 3), ("ward", 2), ("warm", 1)]
+    assert suggester.suggest("war", k=2) == [("war", 3), ("ward", 2)]
+    assert suggester.suggest("warmer") == []
+    assert suggester.suggest("ü") == [("über", 1)]
+    assert suggester.suggest("") == []
+
+
+def test_precomputed_matches_range():
+    suggester = Suggester.from_index(INVERTED_INDEX, WORD_ID_MAP, precomputed_length=0)
+    precomputed = Suggester.from_index(INVERTED_INDEX, WORD_ID_MAP, k=2)
+    for prefix in ("w", "wa", "t", "p", "x"):
+        assert precomputed.suggest(prefix, k=2) == suggester.suggest(prefix, k=2)
+    # More completions than were precomputed
+    assert precomputed.suggest("w", k=3) == suggester.suggest("w", k=3)
+
+
+def test_binary_index():
+    index = BinaryIndex(encode_index(INVERTED_INDEX, WORD_ID_MAP))
+    suggester = Suggester.from_binary_index(index)
+    assert suggester.suggest("wa") == [("war", 3), ("ward", 2), ("warm", 1)]
+    assert suggester.suggest("th") == [("the", 4)]
@@ -0,0 +1,25 @@
+from src.terms import TermDictionary
+
+
+def test_assign_on_lookup():
+    terms = TermDictionary()
+    assert terms["war"] == 0
+    assert terms["peace"] == 1
+    assert terms["war"] == 0
+    assert terms.get("missing") is None
+    assert terms == {"war": 0, "peace": 1}
+
+
+def test_carry_forward():
+    # JSON loaded IDs may be strings
+    terms = TermDictionary({"war": "3", "peace": 0})
+    assert terms == {"war": 3, "peace": 0}
+    assert terms.add_terms(["the", "war", "and", "the"]) == ["and", "the"]
+    assert terms == {"war": 3, "peace": 0, "and": 4, "the": 5}
+
+
+def test_order_independent():
+    first, second = TermDictionary({"war": 0}), TermDictionary({"war": 0})
+    first.add_terms(["b", "a", "c"])
+    second.add_terms(["c", "a", "b"])
+    assert first == second
@@ -0,0 +1,48 @@
+from collections import defaultdict
+import itertools
+
+from src.tokenizer import batch_word_ids, normalize, text_word_ids, tokenize
+
+
+def test_tokenize():
+    assert tokenize('This is a line. Index this "line"') == [
+        "this",
+        "is",
+        "a",
+        "line",
+        "index",
+        "this",
+        "line",
+    ]
+    assert tokenize("") == []
+    # Tokens made only of punctuation are dropped
+    assert tokenize("war - and_peace") == ["war", "andpeace"]
+
+
+def test_unicode():
+    assert tokenize("«Über» ﬁne STRASSE straße — ¿qué?") == [
+        "über",
+        "fine",
+        "strasse",
+        "strasse",
+        "qué",
+    ]
+    assert normalize("Ｗａｒ") == "war"
+
+
+def test_text_word_ids():
+    word_id_map = defaultdict(itertools.count().__next__)
+    assert list(text_word_ids("war and war", word_id_map)) == [0, 1, 0]
+
+
+def test_batch_word_ids():
+    texts = ["War, and\npeace", "", "peace\fwar"]
+    word_id_map = defaultdict(itertools.count().__next__)
+    batch = batch_word_ids(texts, word_id_map)
+
+    single_map = defaultdict(itertools.count().__next__)
+    assert [list(ids) for ids in batch] == [
+        list(text_word_ids(text, single_map)) for text in texts
+    ]
+    assert [list(ids) for ids in batch] == [[0, 1, 2], [], [2, 0]]
+    assert batch_word_ids([], word_id_map) == []